@@ -1,5 +1,7 @@
 # app.py
 import asyncio
+from typing import Any, Callable, Coroutine
+
 import discord
 from discord import app_commands
 
@@ -20,7 +22,12 @@ client = discord.Client(intents=intents)
 # Slash commands (Application Commands)
 tree = app_commands.CommandTree(client)
 
+# channel_id -> когда этот процесс занял слот под панель (до записи в prompts);
+# долговременный кулдаун — по prompts.created_at, см. tickets.prompt_blocked
 _last_prompt_time: dict[int, float] = {}
+# channel_id -> id сообщения-триггера, на которое уже отправлены кнопки
+# (повторная правка того же сообщения не должна дать вторую панель)
+_last_trigger_message: dict[int, int] = {}
 _channel_locks: dict[int, asyncio.Lock] = {}
 
 
@@ -30,3 +37,14 @@ def _get_channel_lock(channel_id: int) -> asyncio.Lock:
         lock = asyncio.Lock()
         _channel_locks[channel_id] = lock
     return lock
+
+
+_background_tasks: dict[str, asyncio.Task] = {}
+
+
+def start_background_task(name: str, coro_factory: Callable[[], Coroutine[Any, Any, None]]) -> None:
+    """Запускает фоновую задачу один раз: on_ready может прийти повторно (reconnect)."""
+    task = _background_tasks.get(name)
+    if task is not None and not task.done():
+        return
+    _background_tasks[name] = asyncio.create_task(coro_factory(), name=f"sh-{name}")
@@ -0,0 +1,105 @@
+# backup.py
+import asyncio
+import gzip
+import os
+import shutil
+import time
+from datetime import datetime
+
+import metrics
+from app import client
+from config import (
+    BACKUP_INTERVAL_SECONDS,
+    BACKUP_DIR,
+    BACKUP_KEEP,
+    BACKUP_PAGES_PER_STEP,
+    BACKUP_STEP_SLEEP_SECONDS,
+)
+from db_async import db_flush, db_log_backup, get_storage
+
+
+# ==========================================================
+#                     ONLINE BACKUPS
+# ==========================================================
+# Снимок tickets.db без остановки бота: SQLite backup API копирует БД шагами по
+# BACKUP_PAGES_PER_STEP страниц в отдельном потоке, затем снимок сжимается в
+# BACKUP_DIR/tickets-YYYYmmdd-HHMMSS.db.gz. Храним BACKUP_KEEP последних.
+# Каждый запуск пишется в таблицу backup_runs (длительность и размеры).
+# Бэкап есть только у бэкенда с файлом (STORAGE_BACKEND="sqlite").
+
+_ARCHIVE_PREFIX = "tickets-"
+_ARCHIVE_SUFFIX = ".db.gz"
+
+_backup_lock = asyncio.Lock()
+
+
+def _snapshot_sync() -> tuple[str, int, int]:
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    tmp_path = os.path.join(BACKUP_DIR, f".{_ARCHIVE_PREFIX}{stamp}.db.tmp")
+    archive_path = os.path.join(BACKUP_DIR, f"{_ARCHIVE_PREFIX}{stamp}{_ARCHIVE_SUFFIX}")
+    part_path = archive_path + ".part"
+    try:
+        get_storage().backup_to(tmp_path, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP_SECONDS)
+        db_size = os.path.getsize(tmp_path)
+        with open(tmp_path, "rb") as src, gzip.open(part_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(part_path, archive_path)
+    finally:
+        for path in (tmp_path, part_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return archive_path, db_size, os.path.getsize(archive_path)
+
+
+def _rotate_sync() -> int:
+    archives = sorted(
+        name for name in os.listdir(BACKUP_DIR)
+        if name.startswith(_ARCHIVE_PREFIX) and name.endswith(_ARCHIVE_SUFFIX)
+    )
+    stale = archives[:-BACKUP_KEEP] if BACKUP_KEEP > 0 else []
+    for name in stale:
+        os.remove(os.path.join(BACKUP_DIR, name))
+    return len(stale)
+
+
+async def run_backup() -> dict[str, int | str]:
+    """Делает один снимок. Параллельные вызовы (расписание + !backup) выполняются по очереди."""
+    if not get_storage().supports_backup:
+        raise RuntimeError(f"storage backend {get_storage().name!r} не поддерживает бэкапы")
+    async with _backup_lock:
+        await db_flush()  # в снимок должен попасть буфер write-behind
+        started = time.perf_counter()
+        path, db_size, archive_size = await asyncio.to_thread(_snapshot_sync)
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        rotated = await asyncio.to_thread(_rotate_sync)
+        await db_log_backup(path, duration_ms, db_size, archive_size)
+
+    metrics.inc("backup.runs")
+    metrics.set_value("backup.last_duration_ms", duration_ms)
+    metrics.set_value("backup.last_archive_bytes", archive_size)
+    print(
+        f"[Backup] {path}: db={db_size // 1024} KiB gz={archive_size // 1024} KiB "
+        f"in {duration_ms} ms, rotated={rotated}"
+    )
+    return {
+        "path": path,
+        "duration_ms": duration_ms,
+        "db_size_bytes": db_size,
+        "archive_size_bytes": archive_size,
+        "rotated": rotated,
+    }
+
+
+async def backup_loop() -> None:
+    if BACKUP_INTERVAL_SECONDS <= 0 or not get_storage().supports_backup:
+        return
+    await client.wait_until_ready()
+    while not client.is_closed():
+        await asyncio.sleep(BACKUP_INTERVAL_SECONDS)
+        try:
+            await run_backup()
+        except Exception as e:
+            print(f"[Backup] FAILED: {type(e).__name__}: {e}")
@@ -0,0 +1,82 @@
+# bench/bench_db.py
+"""Задержка одного вызова db.py: соединение на каждый вызов (как было раньше)
+против долгоживущего соединения потока (WAL, synchronous=NORMAL).
+
+Запуск из SH_discord_bot_split:
+    python bench/bench_db.py [--calls 5000] [--rows 200]
+
+БД создаётся во временном каталоге, рабочий tickets.db не трогается.
+Запись сейчас идёт только пачками через db_write_batch (поток записи db_async),
+поэтому "новая" запись — пачка из одной строки.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DISCORD_TOKEN", "bench")
+
+import db  # noqa: E402
+
+
+# ---- старый путь: sqlite3.connect() на каждый вызов ----
+
+def old_get_opener(path: str, channel_id: int) -> int | None:
+    with sqlite3.connect(path) as con:
+        row = con.execute("SELECT opener_id FROM tickets WHERE channel_id=?;", (channel_id,)).fetchone()
+    return int(row[0]) if row else None
+
+
+def old_set_opener(path: str, channel_id: int, opener_id: int) -> None:
+    with sqlite3.connect(path) as con:
+        con.execute(
+            "INSERT INTO tickets(channel_id, opener_id, created_at) VALUES(?, ?, ?) "
+            "ON CONFLICT(channel_id) DO UPDATE SET opener_id=excluded.opener_id, created_at=excluded.created_at;",
+            (channel_id, opener_id, int(time.time())),
+        )
+
+
+def per_call_us(fn, calls: int) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    return (time.perf_counter() - started) / calls * 1_000_000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--rows", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        db.DB_PATH = path
+        db.db_init()
+        now = int(time.time())
+        db.db_write_batch([(1000 + i, 500 + i, now) for i in range(args.rows)], [])
+
+        def channel(i: int) -> int:
+            return 1000 + i % args.rows
+
+        results = [
+            ("get_opener, connect per call", per_call_us(lambda i: old_get_opener(path, channel(i)), args.calls)),
+            ("get_opener, thread connection", per_call_us(lambda i: db.db_get_opener(channel(i)), args.calls)),
+            ("set_opener, connect per call", per_call_us(lambda i: old_set_opener(path, channel(i), i), args.calls)),
+            (
+                "write_batch(1 row), thread connection",
+                per_call_us(lambda i: db.db_write_batch([(channel(i), i, now)], []), args.calls),
+            ),
+        ]
+        db.db_close()
+
+    print(f"{args.rows} ticket rows, {args.calls} calls each")
+    for name, us in results:
+        print(f"  {name:<40} {us:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
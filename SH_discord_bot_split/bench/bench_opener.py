@@ -0,0 +1,115 @@
+# bench/bench_opener.py
+"""Проверка "может ли участник быть opener": старая логика (is_staff через
+guild_permissions + member.roles, игнор-роли перебором) против tickets.classify_opener
+(frozenset-таблицы, кэш вердикта).
+
+Запуск из SH_discord_bot_split:
+    python bench/bench_opener.py [--members 200] [--roles 6] [--checks 200000]
+
+Участники — заглушки: у настоящего discord.Member свойство roles каждый раз строит
+и сортирует список, так что старая логика в проде медленнее, чем здесь.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DISCORD_TOKEN", "bench")
+
+import tickets  # noqa: E402
+from config import IGNORED_TICKET_OPENER_ROLE_IDS, STAFF_ROLE_IDS  # noqa: E402
+
+
+class _Permissions:
+    def __init__(self, administrator: bool = False):
+        self.administrator = administrator
+
+
+class _Role:
+    def __init__(self, role_id: int):
+        self.id = role_id
+        self.permissions = _Permissions()
+
+    def is_default(self) -> bool:
+        return False
+
+
+class _Guild:
+    def __init__(self, roles: list[_Role]):
+        self.id = 1
+        self.owner_id = 0
+        self.roles = roles
+        self.default_role = _Role(self.id)
+        self._by_id = {r.id: r for r in roles}
+
+    def get_role(self, role_id: int) -> _Role | None:
+        return self._by_id.get(role_id)
+
+
+class _Member:
+    def __init__(self, member_id: int, guild: _Guild, roles: list[_Role]):
+        self.id = member_id
+        self.bot = False
+        self.guild = guild
+        self.roles = roles
+        self.guild_permissions = _Permissions(any(r.permissions.administrator for r in roles))
+
+
+# ---- старая логика ----
+
+def old_is_staff(member) -> bool:
+    if member.guild_permissions.administrator:
+        return True
+    return any(r.id in STAFF_ROLE_IDS for r in member.roles)
+
+
+def old_is_valid_opener_member(member) -> bool:
+    if member.bot or old_is_staff(member):
+        return False
+    if tickets.is_ignored_ticket_opener_id(member.id):
+        return False
+    role_ids = {r.id for r in member.roles}
+    return not any(rid in IGNORED_TICKET_OPENER_ROLE_IDS for rid in role_ids)
+
+
+def checks_per_second(fn, members: list, checks: int) -> float:
+    n = len(members)
+    started = time.perf_counter()
+    for i in range(checks):
+        fn(members[i % n])
+    return checks / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--roles", type=int, default=6)
+    parser.add_argument("--checks", type=int, default=200_000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    # обычные роли + немного staff / игнор-ролей, чтобы встречались все вердикты
+    pool = [_Role(10_000 + i) for i in range(40)]
+    pool += [_Role(rid) for rid in list(STAFF_ROLE_IDS)[:2] + list(IGNORED_TICKET_OPENER_ROLE_IDS)[:2]]
+    guild = _Guild(pool)
+    members = [_Member(100_000 + i, guild, rng.sample(pool, args.roles)) for i in range(args.members)]
+
+    old = checks_per_second(old_is_valid_opener_member, members, args.checks)
+
+    ttl = tickets.OPENER_VERDICT_TTL_SECONDS
+    tickets.OPENER_VERDICT_TTL_SECONDS = -1  # вердикт сразу протухает — всегда промах
+    miss = checks_per_second(tickets.classify_opener, members, args.checks)
+    tickets.OPENER_VERDICT_TTL_SECONDS = ttl
+    tickets.forget_guild_opener_verdicts(guild.id)
+    hit = checks_per_second(tickets.classify_opener, members, args.checks)
+
+    print(f"{args.members} members, {args.roles} roles each, {args.checks} checks")
+    print(f"  old _is_valid_opener_member:  {old / 1e6:.2f} M checks/s")
+    print(f"  classify_opener, cache miss:  {miss / 1e6:.2f} M checks/s")
+    print(f"  classify_opener, cache hit:   {hit / 1e6:.2f} M checks/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# bench/bench_trigger.py
+"""Поиск фразы-триггера в сообщении: старый message_contains_trigger (склейка всех
+частей + re.sub-нормализация) против helpers.TRIGGER_MATCHER.
+
+Запуск из SH_discord_bot_split:
+    python bench/bench_trigger.py [--calls 20000] [--fuzzy 2]
+
+Матчер вызывается напрямую (matches_any по частям), без LRU из
+_parts_contain_trigger — иначе повторяющиеся сообщения меряли бы только кэш.
+--fuzzy K добавляет колонку с TriggerMatcher(..., max_distance=K) (нечёткий поиск).
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DISCORD_TOKEN", "bench")
+
+import helpers  # noqa: E402
+from config import TRIGGER_PHRASE, TRIGGER_PHRASES  # noqa: E402
+
+
+def _embed(title=None, description=None, fields=(), footer=None):
+    return SimpleNamespace(
+        title=title,
+        description=description,
+        fields=[SimpleNamespace(name=n, value=v) for n, v in fields],
+        footer=SimpleNamespace(text=footer) if footer else None,
+    )
+
+
+def _message(content="", embeds=()):
+    return SimpleNamespace(content=content, embeds=list(embeds))
+
+
+APPLICATION = (
+    "Ник в игре: Player_123\nВозраст: 19\nЧасов в Rust: 2500+\n"
+    "Был в кланах: северяне, ночной дозор. Играю каждый вайп с первого дня, "
+    "могу фармить, строить и стоять на рейдах. Микрофон есть, в дискорде каждый вечер."
+)
+
+MESSAGES = {
+    "close confirmation": _message(embeds=[_embed(description=f"**{TRIGGER_PHRASE.capitalize()}?**")]),
+    # две опечатки: точный поиск промахивается, нечёткий с K >= 2 находит
+    "typo'd confirmation": _message(
+        embeds=[_embed(description=f"**{TRIGGER_PHRASE.capitalize().replace('закрыть', 'закрвть').replace('тикет', 'тикот')}?**")]
+    ),
+    "Ticket Tool welcome": _message(
+        content="<@123456789012345678> Welcome",
+        embeds=[_embed(
+            description="Support will be with you shortly.\nTo close this ticket react with 🔒",
+            footer="TicketTool.xyz - Ticketing without clutter",
+        )],
+    ),
+    "application text": _message(content=APPLICATION),
+    "short chat line": _message(content="ок, жду модератора"),
+    "10-field log embed": _message(embeds=[_embed(
+        title="Заявка принята",
+        description="Канал: #ticket-0421",
+        fields=[(f"Поле {i}", f"значение {i}: " + "текст " * 12) for i in range(10)],
+        footer="SH logs",
+    )]),
+    "3.8k-char embed": _message(embeds=[_embed(
+        title="Правила клана",
+        description=("Не покидать базу без предупреждения, делиться лутом, слушать лидера рейда. " * 48)[:3800],
+    )]),
+}
+
+
+# ---- старая логика ----
+
+def old_normalize_text(text: str) -> str:
+    text = (text or "").lower().strip()
+    text = text.replace("ё", "е")
+    text = text.replace("**", "").replace("__", "").replace("*", "").replace("`", "")
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(" .,!?:;—-")
+
+
+def old_message_contains_trigger(msg) -> bool:
+    parts = list(helpers._message_text_parts(msg))
+    return old_normalize_text(TRIGGER_PHRASE) in old_normalize_text(" ".join(parts))
+
+
+def per_call_us(fn, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - started) / calls * 1_000_000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20_000)
+    parser.add_argument("--fuzzy", type=int, default=0, metavar="K")
+    args = parser.parse_args()
+
+    matcher = helpers.TRIGGER_MATCHER
+    fuzzy = helpers.TriggerMatcher(TRIGGER_PHRASES, args.fuzzy) if args.fuzzy > 0 else None
+    print(f"{args.calls} calls each, us/message (* — фраза найдена)")
+    header = f"  {'':<22}{'before':>10}{'after':>10}"
+    if fuzzy is not None:
+        header += f"{f'k={args.fuzzy}':>10}"
+    print(header)
+    for name, msg in MESSAGES.items():
+        parts = tuple(helpers._message_text_parts(msg))
+        before = per_call_us(lambda: old_message_contains_trigger(msg), args.calls)
+        after = per_call_us(lambda: matcher.matches_any(parts), args.calls)
+        row = f"  {name:<22}{before:>10.1f}{after:>9.1f}{'*' if matcher.matches_any(parts) else ' '}"
+        if fuzzy is not None:
+            us = per_call_us(lambda: fuzzy.matches_any(parts), args.calls)
+            row += f"{us:>9.1f}{'*' if fuzzy.matches_any(parts) else ' '}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
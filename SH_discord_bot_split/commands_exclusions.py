@@ -7,15 +7,16 @@ import re
 import discord
 from discord import app_commands
 
-from app import tree, client
+from app import tree
 from config import IGNORE_ADD_ADMIN_ID
-from db import (
+from db_async import (
     db_add_ignored_user,
     db_is_ignored_user,
     db_remove_ignored_user,
     db_list_ignored_users,
 )
 from helpers import is_staff
+from lookups import fetch_member_cached, fetch_user_cached
 
 _ID_RE = re.compile(r"<@!?([0-9]{15,25})>|\b([0-9]{15,25})\b")
 
@@ -48,17 +49,15 @@ def _can_manage(interaction: discord.Interaction) -> bool:
 async def _display_name(guild: discord.Guild | None, user_id: int) -> str:
     """Пытаемся показать display_name в контексте сервера; если нет — username."""
     if guild:
-        m = guild.get_member(user_id)
-        if m:
-            return m.display_name
         try:
-            m = await guild.fetch_member(user_id)
-            return m.display_name
-        except (discord.NotFound, discord.Forbidden, discord.HTTPException):
+            m = await fetch_member_cached(guild, user_id)
+            if m:
+                return m.display_name
+        except (discord.Forbidden, discord.HTTPException):
             pass
     try:
-        u = await client.fetch_user(user_id)
-        return u.name
+        u = await fetch_user_cached(user_id)
+        return u.name if u else "unknown"
     except discord.HTTPException:
         return "unknown"
 
@@ -92,7 +91,7 @@ class _ConfirmAddView(discord.ui.View):
 
     @discord.ui.button(label="Yes", style=discord.ButtonStyle.green)
     async def yes(self, interaction: discord.Interaction, button: discord.ui.Button):  # noqa: ARG002
-        db_add_ignored_user(self.target_id, interaction.user.id)
+        await db_add_ignored_user(self.target_id, interaction.user.id)
         name = await _display_name(interaction.guild, self.target_id)
         await self._finish(interaction, f"✅ Добавлено в списки исключения: {self.target_id} - {name}")
 
@@ -117,7 +116,7 @@ async def add_cmd(interaction: discord.Interaction, user_id: str):
         return
 
     already = db_is_ignored_user(uid)
-    db_add_ignored_user(uid, interaction.user.id)
+    await db_add_ignored_user(uid, interaction.user.id)
     name = await _display_name(interaction.guild, uid)
 
     if already:
@@ -159,7 +158,7 @@ async def del_cmd(interaction: discord.Interaction, user_id: str):
         await interaction.response.send_message("Данный пользователь не находится в списках исключения.", ephemeral=True)
         return
 
-    removed = db_remove_ignored_user(uid)
+    removed = await db_remove_ignored_user(uid)
     name = await _display_name(interaction.guild, uid)
     if removed:
         await interaction.response.send_message(f"✅ Удалено из исключений: {uid} - {name}", ephemeral=True)
@@ -176,7 +175,7 @@ async def menu_cmd(interaction: discord.Interaction):
         await interaction.response.send_message("Недостаточно прав.", ephemeral=True)
         return
 
-    ids = db_list_ignored_users()
+    ids = await db_list_ignored_users()
     if not ids:
         await interaction.response.send_message("Списки исключения пусты.", ephemeral=True)
         return
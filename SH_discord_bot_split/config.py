@@ -60,12 +60,38 @@ LOG_CHANNEL_ID = 1466163549150773363
 # Фраза-триггер (Ticket Tool пишет это при попытке закрыть тикет)
 TRIGGER_PHRASE = "вы серьезно хотите закрыть данный тикет"
 
+# Все фразы-триггеры (Ticket Tool в разных локализациях и другие тикет-боты).
+# Регистр, ё/е, markdown и лишние пробелы не важны — нормализуются при сравнении.
+TRIGGER_PHRASES: list[str] = [
+    TRIGGER_PHRASE,
+    "вы уверены, что хотите закрыть этот тикет",
+    "are you sure you would like to close this ticket",
+    "are you sure you want to close this ticket",
+]
+# Нечёткое совпадение: сколько правок (вставка/удаление/замена символа) допускается
+# между фразой и текстом — на случай опечатки в кастомной панели или другого перевода.
+# 0 = только точное совпадение (после нормализации). Разумно 1-3 при фразах от ~20 символов.
+# Режим НЕ бесплатный: при промахе точного поиска каждая часть сообщения проверяется
+# кусками фраз, а обычный текст тикетов ("...to close this ticket...") часто доходит и
+# до самого нечёткого поиска. По bench/bench_trigger.py --fuzzy 2 это примерно в 2-15 раз
+# дороже точного поиска (десятки-сотни мкс на сообщение вместо единиц). Включать, только
+# если панель реально приходит с опечатками.
+TRIGGER_FUZZY_MAX_DISTANCE = 0
+# Сколько последних текстов сообщений помнить вместе с вердиктом триггера (LRU).
+# Ticket Tool шлёт один и тот же embed в каждый тикет — повтор стоит один поиск в кэше.
+# 0 = без кэша.
+TRIGGER_CACHE_SIZE = 512
+
 # Анти-спам: не чаще, чем раз в N секунд в одном канале
 PROMPT_COOLDOWN_SECONDS = 30
 
 # SQLite
 DB_PATH = "tickets.db"
 
+# Хранилище: "sqlite" (боевой режим) или "memory" (без диска — для нагрузочных тестов
+# и бенчмарков; данные теряются при остановке). Можно переопределить через ENV.
+STORAGE_BACKEND = os.getenv("SH_STORAGE_BACKEND", "sqlite")
+
 # Инвайт (permanent link)
 INVITE_LINK = "https://discord.gg/Pgs8uZffhr"
 
@@ -146,3 +172,95 @@ IGNORE_ADD_ADMIN_ID = 1166060811672883210
 # - 1 использование
 PRIVATE_INVITE_MAX_AGE_SECONDS = 86400
 PRIVATE_INVITE_MAX_USES = 1
+# Пул заранее созданных инвайтов (privatka.py): принятие забирает готовый инвайт
+# вместо REST-запроса. Сколько держать в пуле, как часто пополнять (сек) и сколько
+# инвайт может пролежать в пуле до замены: он создаётся с запасом на это время,
+# поэтому после выдачи игроку всё равно действует не меньше PRIVATE_INVITE_MAX_AGE_SECONDS.
+INVITE_POOL_SIZE = 5
+INVITE_POOL_REFILL_INTERVAL_SECONDS = 600
+INVITE_POOL_MAX_IDLE_SECONDS = 6 * 3600
+# Выданный под решение инвайт, который за это время так и не ушёл в DM, отзывается (сек)
+INVITE_CLAIM_GRACE_SECONDS = 3600
+
+# -------------------- SQLITE TUNING --------------------
+# Кэш страниц на одно соединение (KiB) и размер кэша подготовленных выражений.
+DB_CACHE_SIZE_KIB = 8192
+DB_CACHED_STATEMENTS = 128
+# Сколько ждать снятия блокировки БД другим соединением (сек)
+DB_BUSY_TIMEOUT_SECONDS = 5.0
+# Сколько потоков одновременно читают из БД (запись всегда идёт в одном потоке)
+DB_READ_THREADS = 2
+# Write-behind для tickets/prompts: пачка сбрасывается одной транзакцией
+# не позже чем через N мс после первой записи или при накоплении M строк
+DB_WRITE_BATCH_INTERVAL_MS = 200
+DB_WRITE_BATCH_MAX_ROWS = 50
+
+# -------------------- OPENER CLASSIFICATION --------------------
+# Сколько живёт закэшированный вердикт "может ли участник быть opener" (сек).
+# Обычно кэш сбрасывается раньше — в on_member_update (если включён intents.members).
+OPENER_VERDICT_TTL_SECONDS = 300
+
+# -------------------- REST LOOKUPS --------------------
+# Кэш fetch_user / fetch_member (lookups.py): сколько записей держать, сколько живёт
+# найденный пользователь/участник и сколько помнить NotFound (сек).
+LOOKUP_CACHE_SIZE = 2000
+LOOKUP_TTL_SECONDS = 300
+LOOKUP_NEGATIVE_TTL_SECONDS = 60
+
+# -------------------- DECISION JOBS --------------------
+# Решения по тикетам выполняются фоновыми воркерами из очереди в БД (decisions.py).
+# Сколько решений обрабатывать параллельно, сколько раз повторять задачу с
+# невыполненными шагами и пауза между повторами (сек).
+DECISION_WORKERS = 2
+DECISION_MAX_ATTEMPTS = 5
+DECISION_RETRY_DELAY_SECONDS = 30
+
+# -------------------- REST RETRIES --------------------
+# Общая обёртка над REST-вызовами Discord (rest.py): 5xx/429/обрывы сети повторяются
+# с экспоненциальной задержкой (со случайным разбросом) в пределах дедлайна,
+# 403/404 и прочие 4xx — сразу. Базовая/максимальная задержка и дедлайны (сек):
+# обычный и для ответов на interaction (у них всего 3 секунды на ответ).
+REST_RETRY_BASE_DELAY = 0.5
+REST_RETRY_MAX_DELAY = 8.0
+REST_RETRY_DEADLINE_SECONDS = 20.0
+REST_INTERACTION_DEADLINE_SECONDS = 2.5
+# Сколько REST-вызовов каждого приоритета выполнять одновременно (см. rest.py):
+# ответы на interaction, видимое игрокам (DM/роли/панель/канал) и фон (лог-канал, закрепы)
+REST_LIMIT_INTERACTIVE = 8
+REST_LIMIT_USER = 4
+REST_LIMIT_BACKGROUND = 1
+# Панель с кнопками в свежем тикете: права могут прогрузиться не сразу,
+# поэтому её отправку повторяем и при 403 — но не дольше этого (сек)
+PROMPT_SEND_DEADLINE_SECONDS = 4.0
+
+# -------------------- STARTUP RECONCILIATION --------------------
+# После старта проходим по всем каналам TICKETS_CATEGORY_ID: дописываем opener-ов и
+# панели с кнопками для тикетов, созданных пока бот был выключен.
+# Сколько каналов обрабатывать одновременно (каждый — до пары REST-запросов)
+# и сколько последних сообщений канала смотреть в поисках панели/триггера.
+RECONCILE_CONCURRENCY = 4
+RECONCILE_HISTORY_LIMIT = 50
+
+# -------------------- RETENTION --------------------
+# Фоновая очистка БД: как часто запускать (сек), сколько строк удалять за один шаг,
+# сколько дней хранить invite_logs после истечения инвайта (для аудита),
+# и сколько ждать, прежде чем считать строку tickets/prompts "осиротевшей"
+# (канал уже удалён, например Ticket Tool-ом, а не нашей модалкой).
+RETENTION_SWEEP_INTERVAL_SECONDS = 3600
+RETENTION_BATCH_SIZE = 200
+RETENTION_INVITE_LOGS_DAYS = 30
+RETENTION_ORPHAN_GRACE_SECONDS = 600
+# Сколько дней хранить завершённые задачи decision_jobs (аудит решений)
+RETENTION_DECISION_JOBS_DAYS = 30
+# Сколько свободных страниц за один проход возвращать ОС (PRAGMA incremental_vacuum)
+RETENTION_VACUUM_PAGES = 2000
+
+# -------------------- BACKUPS --------------------
+# Онлайн-бэкап tickets.db (без остановки бота). 0 = только вручную (!backup).
+BACKUP_INTERVAL_SECONDS = 6 * 3600
+# Куда складывать сжатые снимки (относительно рабочей директории) и сколько хранить
+BACKUP_DIR = "backups"
+BACKUP_KEEP = 14
+# Сколько страниц копировать за шаг и пауза между шагами (сек)
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP_SECONDS = 0.01
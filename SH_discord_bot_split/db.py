@@ -1,106 +1,272 @@
 # db.py
 import sqlite3
+import threading
 import time
 
-from config import DB_PATH
+from config import DB_PATH, DB_CACHE_SIZE_KIB, DB_CACHED_STATEMENTS, DB_BUSY_TIMEOUT_SECONDS
 
 # ==========================================================
-#                      DB HELPERS
+#                   CONNECTION MANAGER
 # ==========================================================
+# Раньше каждая db_* функция делала sqlite3.connect(): открытие файла, разбор схемы
+# и fsync на каждый commit. Теперь у каждого потока одно долгоживущее соединение
+# (по сути маленький пул), настроенное один раз: WAL + synchronous=NORMAL + кэш страниц.
+# Подготовленные выражения кэширует сам sqlite3 (cached_statements), поэтому SQL-строки
+# в функциях ниже должны оставаться неизменными.
+
+_local = threading.local()
+_connections: list[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    con = sqlite3.connect(
+        DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_SECONDS,
+        check_same_thread=False,
+        cached_statements=DB_CACHED_STATEMENTS,
+    )
+    # per-connection настройки (journal_mode=WAL хранится в самом файле, см. db_init)
+    con.execute("PRAGMA synchronous=NORMAL;")
+    con.execute(f"PRAGMA cache_size=-{int(DB_CACHE_SIZE_KIB)};")
+    con.execute("PRAGMA temp_store=MEMORY;")
+    return con
+
+
+def db_connection() -> sqlite3.Connection:
+    """Долгоживущее соединение текущего потока (создаётся при первом обращении)."""
+    con = getattr(_local, "con", None)
+    if con is None:
+        con = _connect()
+        _local.con = con
+        with _connections_lock:
+            _connections.append(con)
+    return con
+
+
+def db_close() -> None:
+    """Закрывает все открытые соединения (при остановке бота)."""
+    with _connections_lock:
+        cons = list(_connections)
+        _connections.clear()
+    for con in cons:
+        try:
+            con.close()
+        except sqlite3.Error:
+            pass
+    _local.__dict__.pop("con", None)
 
 
-def db_init() -> None:
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute(
-            "CREATE TABLE IF NOT EXISTS tickets ("
-            "channel_id INTEGER PRIMARY KEY, "
-            "opener_id INTEGER NOT NULL, "
-            "created_at INTEGER NOT NULL"
-            ");"
-        )
-        con.execute(
-            "CREATE TABLE IF NOT EXISTS prompts ("
-            "channel_id INTEGER PRIMARY KEY, "
-            "prompt_message_id INTEGER NOT NULL, "
-            "created_at INTEGER NOT NULL"
-            ");"
-        )
-        con.execute(
-            "CREATE TABLE IF NOT EXISTS private_setup ("
-            "channel_id INTEGER PRIMARY KEY, "
-            "message_id INTEGER NOT NULL, "
-            "created_at INTEGER NOT NULL"
-            ");"
-        )
+# ==========================================================
+#                      MIGRATIONS
+# ==========================================================
+# Версия схемы хранится в PRAGMA user_version. Миграции пронумерованы по порядку
+# (номер = позиция в списке), db_init применяет все недостающие одной транзакцией.
+# Изменения схемы — только новой миграцией в конец списка, старые не редактируем.
+
+_MIGRATIONS: list[tuple[str, ...]] = [
+    # 1: базовая схема (раньше её создавал db_init через CREATE TABLE IF NOT EXISTS)
+    (
+        "CREATE TABLE IF NOT EXISTS tickets ("
+        "channel_id INTEGER PRIMARY KEY, "
+        "opener_id INTEGER NOT NULL, "
+        "created_at INTEGER NOT NULL"
+        ");",
+        "CREATE TABLE IF NOT EXISTS prompts ("
+        "channel_id INTEGER PRIMARY KEY, "
+        "prompt_message_id INTEGER NOT NULL, "
+        "created_at INTEGER NOT NULL"
+        ");",
+        "CREATE TABLE IF NOT EXISTS private_setup ("
+        "channel_id INTEGER PRIMARY KEY, "
+        "message_id INTEGER NOT NULL, "
+        "created_at INTEGER NOT NULL"
+        ");",
         # Пользователи, которых нельзя считать "автором тикета"
-        con.execute(
-            "CREATE TABLE IF NOT EXISTS ignored_users ("
-            "user_id INTEGER PRIMARY KEY, "
-            "added_by INTEGER NOT NULL, "
-            "added_at INTEGER NOT NULL"
-            ");"
-        )
+        "CREATE TABLE IF NOT EXISTS ignored_users ("
+        "user_id INTEGER PRIMARY KEY, "
+        "added_by INTEGER NOT NULL, "
+        "added_at INTEGER NOT NULL"
+        ");",
         # Логи инвайтов в приватку (аудит)
-        con.execute(
-            "CREATE TABLE IF NOT EXISTS invite_logs ("
-            "invite_code TEXT PRIMARY KEY, "
-            "user_id INTEGER NOT NULL, "
-            "moderator_id INTEGER NOT NULL, "
-            "channel_id INTEGER NOT NULL, "
-            "created_at INTEGER NOT NULL, "
-            "expires_at INTEGER NOT NULL"
-            ");"
+        "CREATE TABLE IF NOT EXISTS invite_logs ("
+        "invite_code TEXT PRIMARY KEY, "
+        "user_id INTEGER NOT NULL, "
+        "moderator_id INTEGER NOT NULL, "
+        "channel_id INTEGER NOT NULL, "
+        "created_at INTEGER NOT NULL, "
+        "expires_at INTEGER NOT NULL"
+        ");",
+    ),
+    # 2: индексы под аудит инвайтов и список исключений (/menu)
+    (
+        "CREATE INDEX IF NOT EXISTS idx_invite_logs_user ON invite_logs(user_id, created_at);",
+        "CREATE INDEX IF NOT EXISTS idx_invite_logs_moderator ON invite_logs(moderator_id, created_at);",
+        "CREATE INDEX IF NOT EXISTS idx_invite_logs_expires ON invite_logs(expires_at);",
+        "CREATE INDEX IF NOT EXISTS idx_ignored_users_added ON ignored_users(added_at, user_id);",
+    ),
+    # 3: журнал онлайн-бэкапов (см. backup.py)
+    (
+        "CREATE TABLE IF NOT EXISTS backup_runs ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "created_at INTEGER NOT NULL, "
+        "path TEXT NOT NULL, "
+        "duration_ms INTEGER NOT NULL, "
+        "db_size_bytes INTEGER NOT NULL, "
+        "archive_size_bytes INTEGER NOT NULL"
+        ");",
+    ),
+    # 4: очередь решений по тикетам (принять/отклонить), см. decisions.py.
+    # done_steps — выполненные шаги через запятую, state — JSON с их результатами.
+    # Частичный уникальный индекс: не больше одной незавершённой задачи на канал.
+    (
+        "CREATE TABLE IF NOT EXISTS decision_jobs ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "guild_id INTEGER NOT NULL, "
+        "channel_id INTEGER NOT NULL, "
+        "decision TEXT NOT NULL, "
+        "moderator_id INTEGER NOT NULL, "
+        "reason TEXT NOT NULL, "
+        "state TEXT NOT NULL DEFAULT '{}', "
+        "done_steps TEXT NOT NULL DEFAULT '', "
+        "status TEXT NOT NULL DEFAULT 'pending', "
+        "attempts INTEGER NOT NULL DEFAULT 0, "
+        "created_at INTEGER NOT NULL, "
+        "updated_at INTEGER NOT NULL"
+        ");",
+        "CREATE INDEX IF NOT EXISTS idx_decision_jobs_status ON decision_jobs(status, updated_at);",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_decision_jobs_pending_channel "
+        "ON decision_jobs(channel_id) WHERE status='pending';",
+    ),
+    # 5: пул заранее созданных инвайтов в приватку (см. privatka.py).
+    # status: pool — ждёт выдачи (user_id/moderator_id = 0), claimed — выдан,
+    # revoked — отозван. Старые строки — уже выданные инвайты.
+    (
+        "ALTER TABLE invite_logs ADD COLUMN status TEXT NOT NULL DEFAULT 'claimed';",
+        "CREATE INDEX IF NOT EXISTS idx_invite_logs_status ON invite_logs(status, created_at);",
+    ),
+    # 6: статус delivered — ссылка ушла игроку. claimed теперь значит "выдан, но ещё
+    # не отправлен" и отзывается по таймауту, поэтому всё, что было выдано до этого, —
+    # delivered (иначе отзыв удалил бы уже отправленные ссылки).
+    (
+        "UPDATE invite_logs SET status='delivered' WHERE status='claimed';",
+    ),
+]
+
+SCHEMA_VERSION = len(_MIGRATIONS)
+
+
+def db_migrate(con: sqlite3.Connection) -> int:
+    """Применяет недостающие миграции одной транзакцией. Возвращает итоговую версию схемы."""
+    current = int(con.execute("PRAGMA user_version;").fetchone()[0])
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Схема БД ({current}) новее, чем знает этот код ({SCHEMA_VERSION}). Обнови бота."
         )
+    if current == SCHEMA_VERSION:
+        return current
 
+    con.execute("BEGIN IMMEDIATE;")
+    try:
+        for version in range(current + 1, SCHEMA_VERSION + 1):
+            for statement in _MIGRATIONS[version - 1]:
+                con.execute(statement)
+        con.execute(f"PRAGMA user_version={SCHEMA_VERSION};")
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
+    print(f"[DB] schema migrated {current} -> {SCHEMA_VERSION}")
+    return SCHEMA_VERSION
+
+
+# Горячие запросы (и запросы аудита) — каждый обязан идти по индексу.
+_HOT_QUERIES: list[tuple[str, tuple]] = [
+    ("SELECT opener_id FROM tickets WHERE channel_id=?;", (0,)),
+    ("SELECT prompt_message_id FROM prompts WHERE channel_id=?;", (0,)),
+    ("SELECT message_id FROM private_setup WHERE channel_id=?;", (0,)),
+    ("SELECT 1 FROM ignored_users WHERE user_id=?;", (0,)),
+    ("SELECT user_id FROM ignored_users ORDER BY added_at ASC;", ()),
+    ("SELECT * FROM invite_logs WHERE user_id=? ORDER BY created_at DESC;", (0,)),
+    ("SELECT * FROM invite_logs WHERE moderator_id=? ORDER BY created_at DESC;", (0,)),
+    ("SELECT invite_code FROM invite_logs WHERE expires_at<?;", (0,)),
+    ("SELECT invite_code FROM invite_logs WHERE status='pool' AND expires_at>=? ORDER BY created_at LIMIT 1;", (0,)),
+    ("SELECT id FROM decision_jobs WHERE status='pending';", ()),
+    ("SELECT id FROM decision_jobs WHERE status=? AND updated_at<?;", ("done", 0)),
+]
+
+
+def db_check_query_plans() -> list[str]:
+    """EXPLAIN QUERY PLAN для горячих запросов: список тех, что идут полным сканом."""
+    con = db_connection()
+    problems: list[str] = []
+    for sql, params in _HOT_QUERIES:
+        details = [str(row[-1]) for row in con.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        full_scan = any(d.startswith("SCAN") and "INDEX" not in d for d in details)
+        if full_scan:
+            problems.append(f"{sql} -> {' | '.join(details)}")
+    return problems
 
-def db_set_opener(channel_id: int, opener_id: int) -> None:
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute(
-            "INSERT INTO tickets(channel_id, opener_id, created_at) VALUES(?, ?, ?) "
-            "ON CONFLICT(channel_id) DO UPDATE SET opener_id=excluded.opener_id, created_at=excluded.created_at;",
-            (channel_id, opener_id, int(time.time())),
-        )
+
+# ==========================================================
+#                      DB HELPERS
+# ==========================================================
+
+
+def db_init() -> None:
+    con = db_connection()
+    # auto_vacuum=INCREMENTAL нужен фоновой очистке (PRAGMA incremental_vacuum).
+    # Для уже существующего файла режим включается только через VACUUM — один раз.
+    if int(con.execute("PRAGMA auto_vacuum;").fetchone()[0]) != 2:
+        con.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        con.execute("VACUUM;")
+    con.execute("PRAGMA journal_mode=WAL;")
+    db_migrate(con)
+    for problem in db_check_query_plans():
+        print(f"[DB] WARNING: query without index: {problem}")
+
+
+_UPSERT_TICKET_SQL = (
+    "INSERT INTO tickets(channel_id, opener_id, created_at) VALUES(?, ?, ?) "
+    "ON CONFLICT(channel_id) DO UPDATE SET opener_id=excluded.opener_id, created_at=excluded.created_at;"
+)
+_UPSERT_PROMPT_SQL = (
+    "INSERT INTO prompts(channel_id, prompt_message_id, created_at) VALUES(?, ?, ?) "
+    "ON CONFLICT(channel_id) DO UPDATE SET prompt_message_id=excluded.prompt_message_id, created_at=excluded.created_at;"
+)
 
 
 def db_get_opener(channel_id: int) -> int | None:
-    with sqlite3.connect(DB_PATH) as con:
-        row = con.execute(
-            "SELECT opener_id FROM tickets WHERE channel_id=?;",
-            (channel_id,),
-        ).fetchone()
+    row = db_connection().execute(
+        "SELECT opener_id FROM tickets WHERE channel_id=?;",
+        (channel_id,),
+    ).fetchone()
     return int(row[0]) if row else None
 
 
 def db_delete_ticket(channel_id: int) -> None:
-    with sqlite3.connect(DB_PATH) as con:
+    con = db_connection()
+    with con:
         con.execute("DELETE FROM tickets WHERE channel_id=?;", (channel_id,))
 
 
-def db_set_prompt(channel_id: int, message_id: int) -> None:
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute(
-            "INSERT INTO prompts(channel_id, prompt_message_id, created_at) VALUES(?, ?, ?) "
-            "ON CONFLICT(channel_id) DO UPDATE SET prompt_message_id=excluded.prompt_message_id, created_at=excluded.created_at;",
-            (channel_id, message_id, int(time.time())),
-        )
-
-
 def db_get_prompt(channel_id: int) -> int | None:
-    with sqlite3.connect(DB_PATH) as con:
-        row = con.execute(
-            "SELECT prompt_message_id FROM prompts WHERE channel_id=?;",
-            (channel_id,),
-        ).fetchone()
+    row = db_connection().execute(
+        "SELECT prompt_message_id FROM prompts WHERE channel_id=?;",
+        (channel_id,),
+    ).fetchone()
     return int(row[0]) if row else None
 
 
 def db_delete_prompt(channel_id: int) -> None:
-    with sqlite3.connect(DB_PATH) as con:
+    con = db_connection()
+    with con:
         con.execute("DELETE FROM prompts WHERE channel_id=?;", (channel_id,))
 
 
 def db_set_private_setup_message(channel_id: int, message_id: int) -> None:
-    with sqlite3.connect(DB_PATH) as con:
+    con = db_connection()
+    with con:
         con.execute(
             "INSERT INTO private_setup(channel_id, message_id, created_at) VALUES(?, ?, ?) "
             "ON CONFLICT(channel_id) DO UPDATE SET message_id=excluded.message_id, created_at=excluded.created_at;",
@@ -109,26 +275,54 @@ def db_set_private_setup_message(channel_id: int, message_id: int) -> None:
 
 
 def db_get_private_setup_message(channel_id: int) -> int | None:
-    with sqlite3.connect(DB_PATH) as con:
-        row = con.execute(
-            "SELECT message_id FROM private_setup WHERE channel_id=?;",
-            (channel_id,),
-        ).fetchone()
+    row = db_connection().execute(
+        "SELECT message_id FROM private_setup WHERE channel_id=?;",
+        (channel_id,),
+    ).fetchone()
     return int(row[0]) if row else None
 
 
 def db_delete_private_setup_message(channel_id: int) -> None:
-    with sqlite3.connect(DB_PATH) as con:
+    con = db_connection()
+    with con:
         con.execute("DELETE FROM private_setup WHERE channel_id=?;", (channel_id,))
 
 
+def db_write_batch(
+    tickets: list[tuple[int, int, int]],
+    prompts: list[tuple[int, int, int]],
+) -> None:
+    """Пишет пачку upsert-ов одной транзакцией. Кортежи: (channel_id, opener_id/message_id, created_at)."""
+    con = db_connection()
+    with con:
+        if tickets:
+            con.executemany(_UPSERT_TICKET_SQL, tickets)
+        if prompts:
+            con.executemany(_UPSERT_PROMPT_SQL, prompts)
+
+
+def db_load_ticket_state() -> dict[int, tuple[int | None, int | None, int | None]]:
+    """Все строки tickets/prompts: channel_id -> (opener_id, prompt_message_id, prompt_created_at)."""
+    con = db_connection()
+    state: dict[int, tuple[int | None, int | None, int | None]] = {}
+    for channel_id, opener_id in con.execute("SELECT channel_id, opener_id FROM tickets;"):
+        state[int(channel_id)] = (int(opener_id), None, None)
+    for channel_id, message_id, created_at in con.execute(
+        "SELECT channel_id, prompt_message_id, created_at FROM prompts;"
+    ):
+        opener_id = state.get(int(channel_id), (None, None, None))[0]
+        state[int(channel_id)] = (opener_id, int(message_id), int(created_at))
+    return state
+
+
 # -------------------- IGNORE USERS --------------------
 
 
 def db_add_ignored_user(user_id: int, added_by: int) -> None:
     """Добавляет user_id в ignored_users (если его там ещё нет)."""
     try:
-        with sqlite3.connect(DB_PATH) as con:
+        con = db_connection()
+        with con:
             con.execute(
                 "INSERT OR IGNORE INTO ignored_users(user_id, added_by, added_at) VALUES(?, ?, ?);",
                 (user_id, added_by, int(time.time())),
@@ -140,11 +334,10 @@ def db_add_ignored_user(user_id: int, added_by: int) -> None:
 
 def db_is_ignored_user(user_id: int) -> bool:
     try:
-        with sqlite3.connect(DB_PATH) as con:
-            row = con.execute(
-                "SELECT 1 FROM ignored_users WHERE user_id=?;",
-                (user_id,),
-            ).fetchone()
+        row = db_connection().execute(
+            "SELECT 1 FROM ignored_users WHERE user_id=?;",
+            (user_id,),
+        ).fetchone()
         return row is not None
     except sqlite3.OperationalError:
         return False
@@ -153,7 +346,8 @@ def db_is_ignored_user(user_id: int) -> bool:
 def db_remove_ignored_user(user_id: int) -> bool:
     """Удаляет user_id из ignored_users. Возвращает True если реально было удалено."""
     try:
-        with sqlite3.connect(DB_PATH) as con:
+        con = db_connection()
+        with con:
             cur = con.execute("DELETE FROM ignored_users WHERE user_id=?;", (user_id,))
             return (cur.rowcount or 0) > 0
     except sqlite3.OperationalError:
@@ -163,8 +357,7 @@ def db_remove_ignored_user(user_id: int) -> bool:
 def db_list_ignored_users() -> list[int]:
     """Возвращает список user_id из ignored_users."""
     try:
-        with sqlite3.connect(DB_PATH) as con:
-            rows = con.execute("SELECT user_id FROM ignored_users ORDER BY added_at ASC;").fetchall()
+        rows = db_connection().execute("SELECT user_id FROM ignored_users ORDER BY added_at ASC;").fetchall()
         return [int(r[0]) for r in rows]
     except sqlite3.OperationalError:
         return []
@@ -176,7 +369,8 @@ def db_list_ignored_users() -> list[int]:
 def db_log_invite(invite_code: str, user_id: int, moderator_id: int, channel_id: int, expires_at: int) -> None:
     """Логирует созданный инвайт в БД для аудита."""
     try:
-        with sqlite3.connect(DB_PATH) as con:
+        con = db_connection()
+        with con:
             con.execute(
                 "INSERT OR REPLACE INTO invite_logs(invite_code, user_id, moderator_id, channel_id, created_at, expires_at) "
                 "VALUES(?, ?, ?, ?, ?, ?);",
@@ -184,3 +378,214 @@ def db_log_invite(invite_code: str, user_id: int, moderator_id: int, channel_id:
             )
     except sqlite3.OperationalError:
         pass
+
+
+# Статусы invite_logs: pool -> claimed (выдан под решение, created_at = время выдачи)
+# -> delivered (ссылка ушла игроку/модератору); pool/claimed -> revoked.
+# Переходы только условные (db_transition_invite): пополнение пула и шаги решения
+# работают одновременно, и отозвать можно лишь то, что никто не успел забрать.
+INVITE_POOL = "pool"
+INVITE_CLAIMED = "claimed"
+INVITE_DELIVERED = "delivered"
+INVITE_REVOKED = "revoked"
+
+
+def db_add_pool_invite(invite_code: str, channel_id: int, expires_at: int) -> None:
+    con = db_connection()
+    with con:
+        con.execute(
+            "INSERT OR REPLACE INTO invite_logs"
+            "(invite_code, user_id, moderator_id, channel_id, created_at, expires_at, status) "
+            "VALUES(?, 0, 0, ?, ?, ?, ?);",
+            (invite_code, channel_id, int(time.time()), expires_at, INVITE_POOL),
+        )
+
+
+def db_claim_pool_invite(user_id: int, moderator_id: int, valid_until: int) -> tuple[str, int] | None:
+    """Забирает самый старый инвайт из пула, живущий хотя бы до valid_until.
+    Возвращает (invite_code, expires_at); None — пул пуст."""
+    con = db_connection()
+    with con:
+        row = con.execute(
+            "SELECT invite_code, expires_at FROM invite_logs WHERE status=? AND expires_at>=? "
+            "ORDER BY created_at LIMIT 1;",
+            (INVITE_POOL, valid_until),
+        ).fetchone()
+        if row is None:
+            return None
+        con.execute(
+            "UPDATE invite_logs SET status=?, user_id=?, moderator_id=?, created_at=? WHERE invite_code=?;",
+            (INVITE_CLAIMED, user_id, moderator_id, int(time.time()), row[0]),
+        )
+    return str(row[0]), int(row[1])
+
+
+def db_list_invites(status: str) -> list[tuple[str, int]]:
+    """(invite_code, created_at) инвайтов с этим статусом, от старых к новым."""
+    rows = db_connection().execute(
+        "SELECT invite_code, created_at FROM invite_logs WHERE status=? ORDER BY created_at;",
+        (status,),
+    ).fetchall()
+    return [(str(r[0]), int(r[1])) for r in rows]
+
+
+def db_transition_invite(invite_code: str, from_statuses: tuple[str, ...], to_status: str) -> bool:
+    """Меняет статус, только если текущий — один из from_statuses. True — строка обновлена."""
+    con = db_connection()
+    placeholders = ",".join("?" * len(from_statuses))
+    with con:
+        cur = con.execute(
+            f"UPDATE invite_logs SET status=? WHERE invite_code=? AND status IN ({placeholders});",
+            (to_status, invite_code, *from_statuses),
+        )
+        return cur.rowcount == 1
+
+
+def db_refresh_invite_claim(invite_code: str) -> bool:
+    """Перед отправкой ссылки: claimed получает новое время выдачи (отзыв по таймауту
+    не заденет её посреди отправки). True — инвайт ещё действует (claimed/delivered)."""
+    con = db_connection()
+    with con:
+        cur = con.execute(
+            "UPDATE invite_logs SET created_at=CASE WHEN status=? THEN ? ELSE created_at END "
+            "WHERE invite_code=? AND status IN (?, ?);",
+            (INVITE_CLAIMED, int(time.time()), invite_code, INVITE_CLAIMED, INVITE_DELIVERED),
+        )
+        return cur.rowcount == 1
+
+
+# -------------------- RETENTION --------------------
+
+
+def db_delete_expired_invites(expired_before: int, limit: int) -> int:
+    """Удаляет до limit строк invite_logs с expires_at < expired_before. Возвращает число удалённых."""
+    con = db_connection()
+    with con:
+        cur = con.execute(
+            "DELETE FROM invite_logs WHERE invite_code IN "
+            "(SELECT invite_code FROM invite_logs WHERE expires_at<? LIMIT ?);",
+            (expired_before, limit),
+        )
+        return cur.rowcount or 0
+
+
+def db_list_ticket_channels() -> list[tuple[int, int]]:
+    """(channel_id, последний created_at) для всех каналов из tickets и prompts."""
+    rows = db_connection().execute(
+        "SELECT channel_id, MAX(created_at) FROM ("
+        "SELECT channel_id, created_at FROM tickets "
+        "UNION ALL SELECT channel_id, created_at FROM prompts"
+        ") GROUP BY channel_id;"
+    ).fetchall()
+    return [(int(r[0]), int(r[1])) for r in rows]
+
+
+def db_delete_ticket_channels(channel_ids: list[int]) -> tuple[int, int]:
+    """Удаляет строки tickets и prompts для каналов одной транзакцией. Возвращает (tickets, prompts)."""
+    params = [(cid,) for cid in channel_ids]
+    con = db_connection()
+    with con:
+        before = con.total_changes
+        con.executemany("DELETE FROM tickets WHERE channel_id=?;", params)
+        tickets = con.total_changes - before
+        con.executemany("DELETE FROM prompts WHERE channel_id=?;", params)
+        prompts = con.total_changes - before - tickets
+    return tickets, prompts
+
+
+def db_incremental_vacuum(max_pages: int) -> int:
+    """Возвращает ОС до max_pages свободных страниц. Результат — освобождено байт."""
+    con = db_connection()
+    page_size = int(con.execute("PRAGMA page_size;").fetchone()[0])
+    free_before = int(con.execute("PRAGMA freelist_count;").fetchone()[0])
+    # через executescript: sqlite3.execute() делает один шаг и освобождает лишь одну страницу
+    con.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+    free_after = int(con.execute("PRAGMA freelist_count;").fetchone()[0])
+    return max(0, free_before - free_after) * page_size
+
+
+# -------------------- DECISION JOBS --------------------
+
+DecisionJobRow = tuple[int, int, int, str, int, str, str, str, int]
+
+
+def db_create_decision_job(guild_id: int, channel_id: int, decision: str, moderator_id: int, reason: str) -> int | None:
+    """Новая задача "pending". None — по этому каналу уже есть незавершённая задача."""
+    now = int(time.time())
+    con = db_connection()
+    try:
+        with con:
+            cur = con.execute(
+                "INSERT INTO decision_jobs(guild_id, channel_id, decision, moderator_id, reason, created_at, updated_at) "
+                "VALUES(?, ?, ?, ?, ?, ?, ?);",
+                (guild_id, channel_id, decision, moderator_id, reason, now, now),
+            )
+            return int(cur.lastrowid)
+    except sqlite3.IntegrityError:
+        return None
+
+
+def db_update_decision_job(job_id: int, state_json: str, done_steps: str, status: str, attempts: int) -> None:
+    con = db_connection()
+    with con:
+        con.execute(
+            "UPDATE decision_jobs SET state=?, done_steps=?, status=?, attempts=?, updated_at=? WHERE id=?;",
+            (state_json, done_steps, status, attempts, int(time.time()), job_id),
+        )
+
+
+def db_list_unfinished_decision_jobs() -> list[DecisionJobRow]:
+    """(id, guild_id, channel_id, decision, moderator_id, reason, state, done_steps, attempts)"""
+    rows = db_connection().execute(
+        "SELECT id, guild_id, channel_id, decision, moderator_id, reason, state, done_steps, attempts "
+        "FROM decision_jobs WHERE status='pending' ORDER BY id;"
+    ).fetchall()
+    return [
+        (int(r[0]), int(r[1]), int(r[2]), str(r[3]), int(r[4]), str(r[5]), str(r[6]), str(r[7]), int(r[8]))
+        for r in rows
+    ]
+
+
+def db_delete_finished_decision_jobs(finished_before: int, limit: int) -> int:
+    """Удаляет до limit завершённых (done/failed) задач старше finished_before (limit — на оба статуса)."""
+    con = db_connection()
+    remaining = limit
+    with con:
+        for status in ("done", "failed"):
+            if remaining <= 0:
+                break
+            cur = con.execute(
+                "DELETE FROM decision_jobs WHERE id IN "
+                "(SELECT id FROM decision_jobs WHERE status=? AND updated_at<? LIMIT ?);",
+                (status, finished_before, remaining),
+            )
+            remaining -= cur.rowcount
+    return limit - remaining
+
+
+# -------------------- BACKUPS --------------------
+
+
+def db_backup_to(dest_path: str, pages_per_step: int, sleep_seconds: float) -> None:
+    """Онлайн-копия БД через SQLite backup API.
+
+    Отдельное соединение-источник: копирование идёт по pages_per_step страниц с паузами,
+    и ни одно соединение бота (писатель/читатели) не удерживается надолго.
+    """
+    src = _connect()
+    dst = sqlite3.connect(dest_path)
+    try:
+        src.backup(dst, pages=pages_per_step, sleep=sleep_seconds)
+    finally:
+        dst.close()
+        src.close()
+
+
+def db_log_backup(path: str, duration_ms: int, db_size_bytes: int, archive_size_bytes: int) -> None:
+    con = db_connection()
+    with con:
+        con.execute(
+            "INSERT INTO backup_runs(created_at, path, duration_ms, db_size_bytes, archive_size_bytes) "
+            "VALUES(?, ?, ?, ?, ?);",
+            (int(time.time()), path, duration_ms, db_size_bytes, archive_size_bytes),
+        )
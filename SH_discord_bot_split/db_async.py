@@ -0,0 +1,496 @@
+# db_async.py
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import metrics
+from config import DB_READ_THREADS, DB_WRITE_BATCH_INTERVAL_MS, DB_WRITE_BATCH_MAX_ROWS, IGNORED_TICKET_OPENER_IDS
+from storage import Storage, create_storage
+
+# ==========================================================
+#                     ASYNC DB FACADE
+# ==========================================================
+# Все обращения к SQLite выполняются вне event loop:
+#   - записи — в одном выделенном потоке-писателе, который разбирает очередь запросов
+#     (SQLite всё равно допускает только одного писателя одновременно);
+#   - чтения — в небольшом пуле потоков, у каждого своё соединение (WAL позволяет
+#     читать параллельно с записью).
+# Обработчики событий только await-ят результат и не блокируются на диске.
+# Имена и сигнатуры совпадают с db.py, но функции здесь — корутины.
+# Само хранилище подключаемое (STORAGE_BACKEND, см. storage.py): SQLite или память.
+#
+# Write-behind: db_set_opener/db_set_prompt не ждут commit, а кладут строку в буфер.
+# Повторные upsert-ы одного channel_id схлопываются, буфер сбрасывается одной транзакцией
+# раз в DB_WRITE_BATCH_INTERVAL_MS или при DB_WRITE_BATCH_MAX_ROWS строк.
+# Порядок: любая другая запись в момент постановки в очередь забирает из буфера всё,
+# что накопилось до неё, и писатель коммитит эти строки прямо перед ней. Upsert-ы,
+# сделанные позже, остаются в буфере и попадут в БД уже после этой записи (например,
+# db_delete_ticket(ch) и следом db_set_opener(ch, X) дадут в БД строку X).
+# Если эти строки не записались и после повторов (_BATCH_RETRY_DELAYS), сама запись
+# не выполняется и завершается той же ошибкой, а строки остаются в буфере.
+# Сброс по таймеру ждёт, пока в очереди не останется записей, поставленных раньше.
+# Перед чтением буферизованного ключа и при остановке буфер тоже сбрасывается.
+#
+# Кэш состояния тикетов: channel_id -> (opener_id, prompt_message_id). Прогревается из
+# SQLite в db_init и дальше обновляется write-through из db_set_*/db_delete_*, поэтому
+# db_get_opener/db_get_prompt в штатном режиме вообще не ходят на диск. Кэш трогается
+# только из event loop, блокировки не нужны.
+#
+# ignored_users целиком держится в памяти как frozenset (загружается в db_init).
+# /add, /del и db_add_ignored_user подменяют его новым frozenset — присваивание атомарно,
+# поэтому проверки игнора — это O(1) lookup без await и без диска.
+
+_storage: Storage = create_storage()
+
+_WAKE = object()  # "проверь, не пора ли сбросить буфер"
+
+_write_queue: "queue.Queue[Any]" = queue.Queue()
+_writer: threading.Thread | None = None
+_readers: ThreadPoolExecutor | None = None
+_start_lock = threading.Lock()
+
+# (table, channel_id) -> (channel_id, value, created_at)
+_pending: dict[tuple[str, int], tuple[int, int, int]] = {}
+_pending_since: float | None = None
+# записи в очереди (не _WAKE): пока они есть, буфер по таймеру не сбрасываем —
+# в нём только upsert-ы новее этих записей
+_queued_writes = 0
+_pending_lock = threading.Lock()
+
+_OPENER, _PROMPT, _PROMPT_AT = 0, 1, 2
+_EMPTY_STATE: tuple[None, None, None] = (None, None, None)
+# channel_id -> (opener_id, prompt_message_id, prompt created_at unix)
+_ticket_state: dict[int, tuple[int | None, int | None, int | None]] = {}
+_ticket_state_warm = False
+# поля, изменённые пока кэш прогревается: значения из БД для них уже устарели
+_ticket_state_dirty: set[tuple[int, int]] = set()
+
+_STATIC_IGNORED_IDS: frozenset[int] = frozenset(IGNORED_TICKET_OPENER_IDS)
+_ignored_db_ids: frozenset[int] = frozenset()
+_ignored_all_ids: frozenset[int] = _STATIC_IGNORED_IDS
+_ignored_warm = False
+
+
+def _resolve(fut: asyncio.Future, result: Any, exc: BaseException | None) -> None:
+    if fut.done():  # вызывающий мог быть отменён
+        return
+    if exc is not None:
+        fut.set_exception(exc)
+    else:
+        fut.set_result(result)
+
+
+def _buffer_upsert(table: str, channel_id: int, value: int, created_at: int | None = None) -> None:
+    global _pending_since
+    with _pending_lock:
+        _pending[(table, channel_id)] = (channel_id, value, created_at or int(time.time()))
+        first = _pending_since is None
+        if first:
+            _pending_since = time.monotonic()
+        full = len(_pending) >= DB_WRITE_BATCH_MAX_ROWS
+    metrics.inc("db.write_behind.upserts")
+    _ensure_started()
+    # первый элемент — писатель должен пересчитать таймаут; переполнение — сбросить сразу
+    if first or full:
+        _write_queue.put(_WAKE)
+
+
+def _is_pending(table: str, channel_id: int) -> bool:
+    with _pending_lock:
+        return (table, channel_id) in _pending
+
+
+def _flush_timeout() -> float | None:
+    with _pending_lock:
+        if _pending_since is None:
+            return None
+        return max(0.0, _pending_since + DB_WRITE_BATCH_INTERVAL_MS / 1000 - time.monotonic())
+
+
+def _flush_due() -> bool:
+    with _pending_lock:
+        if _pending_since is None or _queued_writes:
+            return False
+        if len(_pending) >= DB_WRITE_BATCH_MAX_ROWS:
+            return True
+        return time.monotonic() >= _pending_since + DB_WRITE_BATCH_INTERVAL_MS / 1000
+
+
+def _take_pending() -> dict[tuple[str, int], tuple[int, int, int]]:
+    """Забирает буфер целиком. Вызывать под _pending_lock."""
+    global _pending_since
+    batch = dict(_pending)
+    _pending.clear()
+    _pending_since = None
+    return batch
+
+
+def _flush_pending() -> None:
+    """Выполняется только в потоке-писателе."""
+    with _pending_lock:
+        batch = _take_pending()
+    _write_rows(batch)
+
+
+# Паузы между повторами пачки, которая должна лечь в БД перед записью из очереди
+_BATCH_RETRY_DELAYS = (0.05, 0.2, 1.0)
+
+
+def _write_rows(
+    batch: dict[tuple[str, int], tuple[int, int, int]], retry_delays: tuple[float, ...] = ()
+) -> Exception | None:
+    """Выполняется только в потоке-писателе. None — записано; иначе строки
+    возвращены в буфер (уйдут следующим сбросом), а ошибка возвращается."""
+    global _pending_since
+    if not batch:
+        return None
+    tickets = [row for (table, _), row in batch.items() if table == "tickets"]
+    prompts = [row for (table, _), row in batch.items() if table == "prompts"]
+    for delay in (*retry_delays, None):
+        try:
+            _storage.write_batch(tickets, prompts)
+            break
+        except Exception as e:
+            if delay is not None:
+                metrics.inc("db.write_behind.retries")
+                time.sleep(delay)
+                continue
+            print(f"[DB] write-behind flush failed ({len(batch)} rows), will retry: {type(e).__name__}: {e}")
+            with _pending_lock:
+                for key, row in batch.items():
+                    _pending.setdefault(key, row)  # более свежие значения не затираем
+                if _pending_since is None:
+                    _pending_since = time.monotonic()
+            return e
+
+    metrics.inc("db.write_behind.flushes")
+    metrics.inc("db.write_behind.rows_written", len(batch))
+    return None
+
+
+def db_write_stats() -> dict[str, int]:
+    """Статистика write-behind: сколько commit-ов сэкономлено батчингом."""
+    upserts = metrics.get("db.write_behind.upserts")
+    flushes = metrics.get("db.write_behind.flushes")
+    return {
+        "upserts": upserts,
+        "flushes": flushes,
+        "rows_written": metrics.get("db.write_behind.rows_written"),
+        "commits_saved": max(0, upserts - flushes),
+    }
+
+
+def _writer_loop() -> None:
+    global _queued_writes
+    while True:
+        try:
+            item = _write_queue.get(timeout=_flush_timeout())
+        except queue.Empty:
+            item = _WAKE
+        if item is None:
+            _flush_pending()
+            return
+        if item is _WAKE:
+            if _flush_due():
+                _flush_pending()
+            continue
+
+        # upsert-ы, буферизованные до постановки этой записи в очередь, — строго перед ней.
+        # Не записались и после повторов — запись из очереди не выполняем (иначе, например,
+        # удаление обгонит upsert, и тот потом вернёт строку), вызывающий получает ошибку.
+        fn, args, loop, fut, batch = item
+        result: Any = None
+        exc: BaseException | None = _write_rows(batch, _BATCH_RETRY_DELAYS)
+        if exc is None:
+            try:
+                result = fn(*args)
+            except Exception as e:
+                exc = e
+        with _pending_lock:
+            _queued_writes -= 1
+        try:
+            loop.call_soon_threadsafe(_resolve, fut, result, exc)
+        except RuntimeError:
+            # event loop уже закрыт (остановка бота) — результат никому не нужен
+            pass
+
+
+def _ensure_started() -> None:
+    global _writer, _readers
+    if _writer is not None:
+        return
+    with _start_lock:
+        if _writer is not None:
+            return
+        _readers = ThreadPoolExecutor(max_workers=DB_READ_THREADS, thread_name_prefix="sh-db-read")
+        writer = threading.Thread(target=_writer_loop, name="sh-db-write", daemon=True)
+        writer.start()
+        _writer = writer
+
+
+def _noop() -> None:
+    pass
+
+
+async def _write(fn: Callable[..., Any], *args: Any) -> Any:
+    global _queued_writes
+    _ensure_started()
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+    # снимок буфера и постановка в очередь — атомарно относительно _buffer_upsert
+    with _pending_lock:
+        _queued_writes += 1
+        _write_queue.put((fn, args, loop, fut, _take_pending()))
+    return await fut
+
+
+async def _read(fn: Callable[..., Any], *args: Any) -> Any:
+    _ensure_started()
+    return await asyncio.get_running_loop().run_in_executor(_readers, fn, *args)
+
+
+def get_storage() -> Storage:
+    """Активный бэкенд хранилища (для бэкапов и диагностики)."""
+    return _storage
+
+
+async def db_flush() -> None:
+    """Сбрасывает буфер write-behind и ждёт commit."""
+    await _write(_noop)  # буфер уходит в БД снимком этой записи
+
+
+def db_shutdown() -> None:
+    """Сбрасывает буфер, дожидается выполнения поставленных в очередь записей и закрывает соединения."""
+    global _writer, _readers
+    writer, readers = _writer, _readers
+    _writer, _readers = None, None
+    if writer is not None:
+        _write_queue.put(None)
+        writer.join()
+    if readers is not None:
+        readers.shutdown(wait=True)
+    _storage.close()
+    print(f"[DB] write-behind: {db_write_stats()}")
+
+
+# -------------------- TICKET STATE CACHE --------------------
+
+
+def _state_set(channel_id: int, field: int, value: int | None) -> None:
+    state = list(_ticket_state.get(channel_id, _EMPTY_STATE))
+    state[field] = value
+    if state[_OPENER] is None and state[_PROMPT] is None:
+        _ticket_state.pop(channel_id, None)
+    else:
+        _ticket_state[channel_id] = tuple(state)
+    if not _ticket_state_warm:
+        _ticket_state_dirty.add((channel_id, field))
+
+
+async def _warm_ticket_state() -> None:
+    global _ticket_state_warm
+    if _ticket_state_warm:
+        return
+    # через писателя: снимок берётся после всех уже поставленных в очередь записей
+    loaded = await _write(_storage.load_ticket_state)
+    for channel_id, values in loaded.items():
+        for field in (_OPENER, _PROMPT, _PROMPT_AT):
+            if (channel_id, field) not in _ticket_state_dirty:
+                _state_set(channel_id, field, values[field])
+    _ticket_state_dirty.clear()
+    _ticket_state_warm = True
+    print(f"[DB] ticket state cache warmed: {len(_ticket_state)} channels")
+
+
+async def _get_state(table: str, channel_id: int, field: int, fn: Callable[[int], int | None]) -> int | None:
+    if _ticket_state_warm:
+        metrics.inc("db.ticket_cache.hits")
+        return _ticket_state.get(channel_id, _EMPTY_STATE)[field]
+    # до прогрева (очень ранний старт) — читаем с диска
+    metrics.inc("db.ticket_cache.disk_reads")
+    if _is_pending(table, channel_id):
+        await db_flush()
+    return await _read(fn, channel_id)
+
+
+# -------------------- TICKETS / PROMPTS --------------------
+
+
+async def db_init() -> None:
+    await _write(_storage.init)
+    await _warm_ticket_state()
+    await _warm_ignored_users()
+
+
+async def db_set_opener(channel_id: int, opener_id: int) -> None:
+    _state_set(channel_id, _OPENER, opener_id)
+    _buffer_upsert("tickets", channel_id, opener_id)
+
+
+async def db_get_opener(channel_id: int) -> int | None:
+    return await _get_state("tickets", channel_id, _OPENER, _storage.get_opener)
+
+
+async def db_delete_ticket(channel_id: int) -> None:
+    _state_set(channel_id, _OPENER, None)
+    await _write(_storage.delete_ticket, channel_id)
+
+
+async def db_set_prompt(channel_id: int, message_id: int, created_at: int | None = None) -> None:
+    created_at = created_at or int(time.time())
+    _state_set(channel_id, _PROMPT, message_id)
+    _state_set(channel_id, _PROMPT_AT, created_at)
+    _buffer_upsert("prompts", channel_id, message_id, created_at)
+
+
+async def db_get_prompt(channel_id: int) -> int | None:
+    return await _get_state("prompts", channel_id, _PROMPT, _storage.get_prompt)
+
+
+def db_cached_prompt(channel_id: int) -> tuple[int | None, int | None]:
+    """(prompt_message_id, created_at) из кэша, без диска. До прогрева — (None, None)."""
+    state = _ticket_state.get(channel_id, _EMPTY_STATE)
+    return state[_PROMPT], state[_PROMPT_AT]
+
+
+async def db_delete_prompt(channel_id: int) -> None:
+    _state_set(channel_id, _PROMPT, None)
+    _state_set(channel_id, _PROMPT_AT, None)
+    await _write(_storage.delete_prompt, channel_id)
+
+
+async def db_set_private_setup_message(channel_id: int, message_id: int) -> None:
+    await _write(_storage.set_private_setup_message, channel_id, message_id)
+
+
+async def db_get_private_setup_message(channel_id: int) -> int | None:
+    return await _read(_storage.get_private_setup_message, channel_id)
+
+
+async def db_delete_private_setup_message(channel_id: int) -> None:
+    await _write(_storage.delete_private_setup_message, channel_id)
+
+
+# -------------------- IGNORE USERS --------------------
+
+
+def _set_ignored_db_ids(ids: frozenset[int]) -> None:
+    global _ignored_db_ids, _ignored_all_ids
+    _ignored_db_ids = ids
+    _ignored_all_ids = _STATIC_IGNORED_IDS | ids
+
+
+async def _warm_ignored_users() -> None:
+    global _ignored_warm
+    if _ignored_warm:
+        return
+    loaded = frozenset(await _write(_storage.list_ignored_users))
+    # то, что успели добавить через /add до прогрева, тоже сохраняем
+    _set_ignored_db_ids(loaded | _ignored_db_ids)
+    _ignored_warm = True
+
+
+def db_is_ignored_user(user_id: int) -> bool:
+    """Есть ли user_id в таблице ignored_users (из памяти, без await)."""
+    return user_id in _ignored_db_ids
+
+
+def is_ignored_opener_id(user_id: int) -> bool:
+    """ignored_users + статический IGNORED_TICKET_OPENER_IDS из config.py (из памяти)."""
+    return user_id in _ignored_all_ids
+
+
+async def db_add_ignored_user(user_id: int, added_by: int) -> None:
+    _set_ignored_db_ids(_ignored_db_ids | {user_id})
+    await _write(_storage.add_ignored_user, user_id, added_by)
+
+
+async def db_remove_ignored_user(user_id: int) -> bool:
+    removed = await _write(_storage.remove_ignored_user, user_id)
+    _set_ignored_db_ids(_ignored_db_ids - {user_id})
+    return removed
+
+
+async def db_list_ignored_users() -> list[int]:
+    return await _read(_storage.list_ignored_users)
+
+
+# -------------------- INVITE LOGS --------------------
+
+
+async def db_log_invite(invite_code: str, user_id: int, moderator_id: int, channel_id: int, expires_at: int) -> None:
+    await _write(_storage.log_invite, invite_code, user_id, moderator_id, channel_id, expires_at)
+
+
+async def db_add_pool_invite(invite_code: str, channel_id: int, expires_at: int) -> None:
+    await _write(_storage.add_pool_invite, invite_code, channel_id, expires_at)
+
+
+async def db_claim_pool_invite(user_id: int, moderator_id: int, valid_until: int) -> tuple[str, int] | None:
+    return await _write(_storage.claim_pool_invite, user_id, moderator_id, valid_until)
+
+
+async def db_list_invites(status: str) -> list[tuple[str, int]]:
+    return await _write(_storage.list_invites, status)
+
+
+async def db_transition_invite(invite_code: str, from_statuses: tuple[str, ...], to_status: str) -> bool:
+    return await _write(_storage.transition_invite, invite_code, from_statuses, to_status)
+
+
+async def db_refresh_invite_claim(invite_code: str) -> bool:
+    return await _write(_storage.refresh_invite_claim, invite_code)
+
+
+# -------------------- RETENTION --------------------
+
+
+async def db_delete_expired_invites(expired_before: int, limit: int) -> int:
+    return await _write(_storage.delete_expired_invites, expired_before, limit)
+
+
+async def db_list_ticket_channels() -> list[tuple[int, int]]:
+    # через писателя: буфер write-behind к этому моменту уже сброшен
+    return await _write(_storage.list_ticket_channels)
+
+
+async def db_delete_ticket_channels(channel_ids: list[int]) -> tuple[int, int]:
+    for channel_id in channel_ids:
+        _state_set(channel_id, _OPENER, None)
+        _state_set(channel_id, _PROMPT, None)
+    return await _write(_storage.delete_ticket_channels, list(channel_ids))
+
+
+async def db_incremental_vacuum(max_pages: int) -> int:
+    return await _write(_storage.incremental_vacuum, max_pages)
+
+
+# -------------------- DECISION JOBS --------------------
+# Запись сразу (не через write-behind): задача должна быть на диске до ответа модератору,
+# а отметка шага — до перехода к зависящим от него шагам.
+
+
+async def db_create_decision_job(guild_id: int, channel_id: int, decision: str, moderator_id: int, reason: str) -> int | None:
+    return await _write(_storage.create_decision_job, guild_id, channel_id, decision, moderator_id, reason)
+
+
+async def db_update_decision_job(job_id: int, state_json: str, done_steps: str, status: str, attempts: int) -> None:
+    await _write(_storage.update_decision_job, job_id, state_json, done_steps, status, attempts)
+
+
+async def db_list_unfinished_decision_jobs() -> list[tuple]:
+    return await _write(_storage.list_unfinished_decision_jobs)
+
+
+async def db_delete_finished_decision_jobs(finished_before: int, limit: int) -> int:
+    return await _write(_storage.delete_finished_decision_jobs, finished_before, limit)
+
+
+# -------------------- BACKUPS --------------------
+
+
+async def db_log_backup(path: str, duration_ms: int, db_size_bytes: int, archive_size_bytes: int) -> None:
+    await _write(_storage.log_backup, path, duration_ms, db_size_bytes, archive_size_bytes)
@@ -0,0 +1,472 @@
+# decisions.py
+import asyncio
+import json
+import time
+
+import discord
+
+import metrics
+from app import client, _get_channel_lock, _last_prompt_time, _last_trigger_message, _channel_locks
+from config import (
+    INVITE_LINK,
+    ACCEPT_EXTRA_DM,
+    ACCEPT_ADD_ROLE_ID,
+    ACCEPT_REMOVE_ROLE_ID,
+    DECISION_WORKERS,
+    DECISION_MAX_ATTEMPTS,
+    DECISION_RETRY_DELAY_SECONDS,
+)
+from db import INVITE_CLAIMED
+from db_async import (
+    db_delete_ticket,
+    db_delete_prompt,
+    db_create_decision_job,
+    db_update_decision_job,
+    db_list_unfinished_decision_jobs,
+)
+from logs import log_event, send_application_log
+from lookups import fetch_member_cached, fetch_user_cached
+from privatka import (
+    create_one_time_private_invite,
+    mark_invite_delivered,
+    private_invite_url,
+    refresh_invite_claim,
+    revoke_private_invite,
+)
+from rest import rest_call
+from taskgraph import Step, run_step_graph
+from tickets import (
+    get_opener_user,
+    apply_accept_roles,
+    disable_or_delete_prompt_message,
+    archive_and_lock_channel,
+)
+
+
+# ==========================================================
+#                 DECISION JOBS (accept/reject)
+# ==========================================================
+# Решение модератора сначала пишется в decision_jobs, модалка сразу отвечает, а
+# шаги (DM, роли, лог, удаление канала...) выполняют фоновые воркеры
+# (DECISION_WORKERS штук). После каждого шага его имя и результат сохраняются
+# в задаче, поэтому после рестарта незавершённые задачи продолжаются с места
+# остановки, а выполненные шаги не повторяются.
+# Шаг, упавший с исключением, не отмечается; зависящие от него шаги ждут, и вся
+# задача повторяется через DECISION_RETRY_DELAY_SECONDS (до DECISION_MAX_ATTEMPTS раз).
+# Сообщение модератору (followup) возможно только в том процессе, где пришла
+# модалка: после рестарта этот шаг пропускается.
+
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+class DecisionJob:
+    def __init__(
+        self,
+        job_id: int,
+        guild_id: int,
+        channel_id: int,
+        decision: str,
+        moderator_id: int,
+        reason: str,
+        state: dict | None = None,
+        done: set[str] | None = None,
+        attempts: int = 0,
+    ):
+        self.id = job_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.decision = decision  # "accept" | "reject"
+        self.moderator_id = moderator_id
+        self.reason = reason
+        self.state: dict = state if state is not None else {}
+        self.done: set[str] = done if done is not None else set()
+        self.attempts = attempts
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "DecisionJob":
+        job_id, guild_id, channel_id, decision, moderator_id, reason, state_json, done_steps, attempts = row
+        return cls(
+            job_id, guild_id, channel_id, decision, moderator_id, reason,
+            state=json.loads(state_json or "{}"),
+            done={s for s in done_steps.split(",") if s},
+            attempts=attempts,
+        )
+
+
+_jobs: dict[int, DecisionJob] = {}
+# job_id -> Interaction модалки (только в этом процессе, для followup модератору)
+_interactions: dict[int, discord.Interaction] = {}
+_queue: "asyncio.Queue[int]" = asyncio.Queue()
+# отложенные повторы: event loop держит задачи слабой ссылкой, без этого их соберёт GC
+_retry_tasks: set[asyncio.Task] = set()
+
+
+async def _save(job: DecisionJob, status: str = STATUS_PENDING) -> None:
+    await db_update_decision_job(
+        job.id, json.dumps(job.state, ensure_ascii=False), ",".join(sorted(job.done)), status, job.attempts
+    )
+
+
+async def create_decision_job(
+    interaction: discord.Interaction,
+    channel: discord.TextChannel,
+    moderator: discord.Member,
+    decision: str,
+    reason: str,
+) -> DecisionJob | None:
+    """Пишет задачу в БД. None — по каналу уже есть незавершённое решение."""
+    job_id = await db_create_decision_job(channel.guild.id, channel.id, decision, moderator.id, reason)
+    if job_id is None:
+        return None
+    job = DecisionJob(job_id, channel.guild.id, channel.id, decision, moderator.id, reason)
+    _jobs[job_id] = job
+    _interactions[job_id] = interaction
+    metrics.inc("decision.jobs.created")
+    return job
+
+
+def enqueue_decision_job(job: DecisionJob) -> None:
+    _queue.put_nowait(job.id)
+
+
+async def _resolve_user(guild: discord.Guild, user_id: int | None) -> discord.abc.User | None:
+    if user_id is None:
+        return None
+    try:
+        return await fetch_member_cached(guild, user_id) or await fetch_user_cached(user_id)
+    except discord.HTTPException:
+        return await fetch_user_cached(user_id)
+
+
+def _decision_steps(
+    job: DecisionJob,
+    guild: discord.Guild,
+    channel: discord.TextChannel | None,
+    moderator: discord.abc.User,
+    ctx: dict,
+) -> list[Step]:
+    # Порядок важен только там, где есть зависимость:
+    #   opener -> всё, что про игрока, и db_cleanup (opener читается из tickets)
+    #   invite -> dm -> extra_dm  (ссылка нужна в тексте, доп. DM — после основного)
+    #   dm -> app_log             (в логе — отправилось ли DM)
+    #   prompt -> db_cleanup      (id панели берётся из БД)
+    #   всё -> summary -> delete  (итог модератору и лог — до удаления канала)
+    # Остальное (роли, панель, инвайт) идёт параллельно.
+    accept = job.decision == "accept"
+    reason = job.reason
+    st = job.state
+
+    async def opener() -> None:
+        user = await get_opener_user(channel) if channel is not None else None
+        ctx["opener"] = user
+        st["opener_id"] = user.id if user else None
+        st["dm_ok"] = user is not None
+        st["extra_dm_ok"] = user is not None
+
+    # ------------------------------------------------------
+    # Инвайт в приватку (только при принятии)
+    # ------------------------------------------------------
+    async def claim_invite(user: discord.abc.User) -> None:
+        invite = await create_one_time_private_invite(opener=user, moderator=moderator)
+        if invite:
+            code, expires_at = invite
+            st["invite_code"] = code
+            st["invite_url"] = private_invite_url(code)
+            st["invite_expires_at"] = expires_at
+
+    async def invite() -> None:
+        user = ctx.get("opener")
+        if accept and user is not None:
+            await claim_invite(user)
+
+    # ------------------------------------------------------
+    # DM пользователю
+    # ------------------------------------------------------
+    async def dm() -> None:
+        user = ctx.get("opener")
+        if user is None:
+            return
+        if not accept:
+            dm_text = (
+                f"**Приветствую {user.mention} ! Сожалеем, но ваша заявка в клан SH была отклонена модератором.**\n"
+                f"**Причина:** *{reason}*\n\n"
+                f"**Если хотите, то обязательно подавайте заявку повторно, мы вас обязательно ждем!**\n"
+                f"**permanent link:** {INVITE_LINK}"
+            )
+        else:
+            # выданный инвайт могли отозвать (дедлайн выдачи истёк) — берём новый
+            if st.get("invite_code") and not await refresh_invite_claim(st["invite_code"]):
+                for key in ("invite_code", "invite_url", "invite_expires_at"):
+                    st.pop(key, None)
+                await claim_invite(user)
+            if not st.get("invite_url"):
+                invite_line = "**Ссылка в приватку:** *(не удалось создать автоматически — напишите модератору)*"
+            elif st.get("invite_expires_at"):
+                invite_line = (
+                    f"**Персональная ссылка в приватку (1 раз, действует до <t:{st['invite_expires_at']}:f>):** "
+                    f"{st['invite_url']}"
+                )
+            else:
+                # состояние задания, сохранённое до появления invite_expires_at
+                invite_line = f"**Персональная ссылка в приватку (1 раз, действует 24 часа):** {st['invite_url']}"
+            dm_text = (
+                f"**Приветствую {user.mention} ! Отличные новости — ваша заявка в клан SH была одобрена модератором.**\n"
+                f"**Комментарий:** *{reason}*\n\n"
+                f"{invite_line}"
+            )
+        try:
+            await rest_call(
+                "dm.send",
+                lambda: user.send(dm_text, allowed_mentions=discord.AllowedMentions(users=True)),
+                idempotent=False,
+            )
+        except (discord.Forbidden, discord.HTTPException):
+            st["dm_ok"] = False
+            # ссылку игрок не получил — одноразовый инвайт не оставляем живым
+            code = st.get("invite_code")
+            if code:
+                await revoke_private_invite(code, (INVITE_CLAIMED,))
+                for key in ("invite_code", "invite_url", "invite_expires_at"):
+                    st.pop(key, None)
+            return
+        if st.get("invite_code"):
+            await mark_invite_delivered(st["invite_code"])
+
+    # Дополнительное сообщение при принятии
+    async def extra_dm() -> None:
+        user = ctx.get("opener")
+        if user is None or not accept:
+            return
+        try:
+            await rest_call(
+                "dm.send",
+                lambda: user.send(ACCEPT_EXTRA_DM, allowed_mentions=discord.AllowedMentions.none()),
+                idempotent=False,
+            )
+        except (discord.Forbidden, discord.HTTPException):
+            st["extra_dm_ok"] = False
+
+    # ------------------------------------------------------
+    # Роли — только при принятии
+    # ------------------------------------------------------
+    async def roles() -> None:
+        st["roles_status"] = "SKIP"
+        user = ctx.get("opener")
+        if accept and user is not None:
+            ok, code = await apply_accept_roles(
+                guild,
+                user.id,
+                add_role_id=ACCEPT_ADD_ROLE_ID,
+                remove_role_id=ACCEPT_REMOVE_ROLE_ID,
+            )
+            st["roles_status"] = "OK" if ok else f"FAIL:{code}"
+
+    # Убираем сообщение с кнопками (на случай если удаление канала не получится)
+    async def prompt() -> None:
+        if channel is not None:
+            await disable_or_delete_prompt_message(channel)
+
+    # Логи по шаблону (до удаления канала)
+    async def app_log() -> None:
+        await send_application_log(
+            guild,
+            decision=job.decision,
+            opener=ctx.get("opener"),
+            moderator=moderator,
+            reason_text=reason,
+            dm_sent=st.get("dm_ok", False),
+        )
+
+    # чистим БД + in-memory кэш
+    async def db_cleanup() -> None:
+        await db_delete_ticket(job.channel_id)
+        await db_delete_prompt(job.channel_id)
+        _last_prompt_time.pop(job.channel_id, None)
+        _last_trigger_message.pop(job.channel_id, None)
+
+    # Сообщение модератору (ephemeral) перед удалением канала
+    async def summary() -> None:
+        interaction = _interactions.get(job.id)
+        if interaction is None:
+            return
+        user = ctx.get("opener")
+        player_text = f"{user} ({user.id})" if user else "не найден"
+        decision_ru = "принято ✅" if accept else "отклонено ❌"
+        text = (
+            f"Готово: **{decision_ru}**\n"
+            f"Игрок: **{player_text}**\n"
+            f"DM: **{'OK' if st.get('dm_ok') else 'FAIL'}**"
+        )
+        if accept:
+            text += (
+                f"\nИнвайт в приватку: **{'OK' if st.get('invite_url') else 'FAIL'}**"
+                f"\nДоп. DM: **{'OK' if st.get('extra_dm_ok') else 'FAIL'}**\nРоли: **{st.get('roles_status')}**"
+            )
+            if st.get("invite_url"):
+                text += f"\nСсылка (для тебя): {st['invite_url']}"
+        try:
+            await rest_call(
+                "interaction.followup",
+                lambda: interaction.followup.send(text, ephemeral=True),
+                idempotent=False,
+            )
+        except discord.HTTPException:
+            pass
+
+    # Удаляем тикет-канал
+    async def delete() -> None:
+        if channel is None:
+            return
+        user = ctx.get("opener")
+        player_text = f"{user} ({user.id})" if user else "не найден"
+        try:
+            await rest_call(
+                "channel.delete",
+                lambda: channel.delete(
+                    reason=(
+                        f"[SH] decision={job.decision} by {moderator} ({moderator.id}). "
+                        f"Player: {player_text}. Text: {reason[:200]}"
+                    )
+                ),
+            )
+        except discord.NotFound:
+            pass
+        except (discord.Forbidden, discord.HTTPException) as e:
+            # Если удалить не получилось — как запасной план переносим в архив и закрываем права
+            try:
+                await archive_and_lock_channel(channel, user, moderator, reason)
+            except Exception:
+                pass
+            await log_event(
+                guild,
+                f"[SH] WARNING: failed to delete channel={channel.id}. error={type(e).__name__}: {e}"
+            )
+
+    return [
+        Step("opener", opener),
+        Step("invite", invite, after=("opener",)),
+        Step("roles", roles, after=("opener",)),
+        Step("prompt", prompt),
+        Step("dm", dm, after=("invite",)),
+        Step("extra_dm", extra_dm, after=("dm",)),
+        Step("app_log", app_log, after=("dm",)),
+        Step("db_cleanup", db_cleanup, after=("opener", "prompt")),
+        Step("summary", summary, after=("extra_dm", "roles")),
+        Step("delete", delete, after=("app_log", "db_cleanup", "summary")),
+    ]
+
+
+def _durable(job: DecisionJob, step: Step) -> Step:
+    """Шаг пропускается, если уже выполнен; после успеха отметка сразу пишется в БД."""
+
+    async def run() -> None:
+        if step.name in job.done:
+            return
+        if any(dep not in job.done for dep in step.after):
+            return  # зависимость не выполнена — ждём повтора задачи
+        await step.run()
+        job.done.add(step.name)
+        await _save(job)
+
+    return Step(step.name, run, step.after)
+
+
+async def _run_job(job: DecisionJob) -> bool:
+    """Выполняет невыполненные шаги. True — все шаги выполнены."""
+    guild = client.get_guild(job.guild_id)
+    if guild is None:
+        return False
+    channel = guild.get_channel(job.channel_id)
+    if not isinstance(channel, discord.TextChannel):
+        channel = None  # канал уже удалён — шаги по нему считаются выполненными
+
+    moderator = await _resolve_user(guild, job.moderator_id)
+    if moderator is None:
+        return False
+    ctx: dict = {}
+    if "opener" in job.done:
+        ctx["opener"] = await _resolve_user(guild, job.state.get("opener_id"))
+
+    steps = [_durable(job, step) for step in _decision_steps(job, guild, channel, moderator, ctx)]
+    async with _get_channel_lock(job.channel_id):
+        timings = await run_step_graph(steps, "decision")
+    _channel_locks.pop(job.channel_id, None)
+    print(
+        f"[Decision] job={job.id} channel={job.channel_id} decision={job.decision} attempt={job.attempts + 1} "
+        + " ".join(f"{name}={ms:.0f}ms" for name, ms in timings.items())
+    )
+    return all(step.name in job.done for step in steps)
+
+
+async def _retry_later(job_id: int) -> None:
+    await asyncio.sleep(DECISION_RETRY_DELAY_SECONDS)
+    _queue.put_nowait(job_id)
+
+
+async def _process(job: DecisionJob) -> None:
+    try:
+        finished = await _run_job(job)
+    except Exception as e:
+        print(f"[Decision] job={job.id} FAILED: {type(e).__name__}: {e}")
+        finished = False
+
+    if finished:
+        await _save(job, STATUS_DONE)
+        metrics.inc("decision.jobs.done")
+    else:
+        job.attempts += 1
+        if job.attempts >= DECISION_MAX_ATTEMPTS:
+            await _save(job, STATUS_FAILED)
+            metrics.inc("decision.jobs.failed")
+            # инвайт выдан, но игрок его так и не получил — отзываем
+            if job.state.get("invite_code") and "dm" not in job.done:
+                await revoke_private_invite(job.state["invite_code"], (INVITE_CLAIMED,))
+            guild = client.get_guild(job.guild_id)
+            if guild is not None:
+                await log_event(
+                    guild,
+                    f"[SH] WARNING: decision job={job.id} channel={job.channel_id} gave up after "
+                    f"{job.attempts} attempts; done steps: {', '.join(sorted(job.done)) or '-'}"
+                )
+        else:
+            await _save(job)
+            metrics.inc("decision.jobs.retried")
+            task = asyncio.create_task(_retry_later(job.id), name=f"decision-retry-{job.id}")
+            _retry_tasks.add(task)
+            task.add_done_callback(_retry_tasks.discard)
+            return
+
+    _jobs.pop(job.id, None)
+    _interactions.pop(job.id, None)
+
+
+async def _worker() -> None:
+    while True:
+        job_id = await _queue.get()
+        try:
+            job = _jobs.get(job_id)
+            if job is not None:
+                await _process(job)
+        finally:
+            _queue.task_done()
+
+
+async def decision_workers() -> None:
+    """Поднимает незавершённые задачи из БД и запускает воркеры."""
+    await client.wait_until_ready()
+    started = time.perf_counter()
+    resumed = 0
+    for row in await db_list_unfinished_decision_jobs():
+        job = DecisionJob.from_row(row)
+        if job.id in _jobs:
+            continue
+        _jobs[job.id] = job
+        _queue.put_nowait(job.id)
+        resumed += 1
+    if resumed:
+        metrics.inc("decision.jobs.resumed", resumed)
+        print(f"[Decision] resumed {resumed} unfinished jobs in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    await asyncio.gather(*(_worker() for _ in range(max(1, DECISION_WORKERS))))
@@ -1,25 +1,52 @@
 # events.py
 import asyncio
+import inspect
 import time
 import re
 import discord
 
-from app import client, tree, _last_prompt_time
+import metrics
+from app import client, tree, start_background_task
 from config import (
     TICKETS_CATEGORY_ID,
-    PROMPT_COOLDOWN_SECONDS,
     WELCOME_MESSAGE,
+    PRIVATE_GUILD_ID,
+    PROMPT_SEND_DEADLINE_SECONDS,
     IGNORE_ADD_ADMIN_ID,
 )
-from db import (
+from db_async import (
     db_init,
     db_get_opener,
     db_set_opener,
     db_set_prompt,
+    db_write_stats,
+)
+from helpers import (
+    message_contains_trigger,
+    raw_message_contains_trigger,
+    build_staff_ping,
+    trigger_cache_stats,
+    invalidate_guild_role_index,
+)
+from lookups import lookup_stats
+from rest import rest_call, RETRY_FORBIDDEN, PRIORITY_BACKGROUND, scheduler_stats
+from maintenance import retention_loop
+from reconcile import reconcile_tickets
+from decisions import decision_workers
+from backup import backup_loop, run_backup
+from privatka import ensure_private_setup_message, PrivateSetupView, invite_pool_loop, forget_invite_channel
+from tickets import (
+    resolve_ticket_opener_fallback,
+    track_opener_from_channel,
+    prompt_blocked,
+    claim_prompt,
+    is_ignored_ticket_opener_id,
+    is_ignored_ticket_opener_member,
+    classify_opener,
+    forget_opener_verdict,
+    forget_guild_opener_verdicts,
+    OPENER_OK,
 )
-from helpers import is_staff, message_contains_trigger, build_staff_ping
-from privatka import ensure_private_setup_message, PrivateSetupView
-from tickets import resolve_ticket_opener_fallback, is_ignored_ticket_opener_id, is_ignored_ticket_opener_member
 from ui import TicketDecisionView
 
 
@@ -64,7 +91,7 @@ def _is_simple_id_message(text: str) -> bool:
 
 @client.event
 async def on_ready():
-    db_init()
+    await db_init()
     print(f"Logged in as {client.user} (ID: {client.user.id})")
 
     # persistent views (работают после рестарта)
@@ -74,6 +101,17 @@ async def on_ready():
     # сообщение с кнопкой в приватке (если бот там есть и имеет доступ)
     await ensure_private_setup_message()
 
+    # фоновая очистка БД (истёкшие инвайты, строки удалённых каналов)
+    start_background_task("retention", retention_loop)
+    # онлайн-бэкапы tickets.db по расписанию
+    start_background_task("backup", backup_loop)
+    # сверка тикет-каналов с БД (тикеты, созданные пока бот был выключен)
+    start_background_task("reconcile", lambda: reconcile_tickets(_post_prompt))
+    # воркеры решений по тикетам (+ незавершённые задачи после рестарта)
+    start_background_task("decisions", decision_workers)
+    # пул готовых инвайтов в приватку
+    start_background_task("invite_pool", invite_pool_loop)
+
     # ------------------------------------------------------
     # Slash-команды: делаем "по красоте" — регистрируем в КАЖДОЙ гильдии как guild commands.
     # Почему так:
@@ -89,8 +127,9 @@ async def on_ready():
     total_synced = 0
     for g in list(client.guilds):
         try:
-            tree.copy_global_to(guild=discord.Object(id=g.id))
-            synced = await tree.sync(guild=discord.Object(id=g.id))
+            guild_obj = discord.Object(id=g.id)
+            tree.copy_global_to(guild=guild_obj)
+            synced = await rest_call("tree.sync", lambda: tree.sync(guild=guild_obj), priority=PRIORITY_BACKGROUND)
             total_synced += len(synced)
             print(f"[SlashSync] guild={g.name} ({g.id}) synced={len(synced)}")
         except discord.HTTPException as e:
@@ -103,12 +142,18 @@ async def on_ready():
 @client.event
 async def on_guild_channel_create(channel):
     if isinstance(channel, discord.TextChannel) and channel.category_id == TICKETS_CATEGORY_ID:
+        # opener часто виден сразу: Ticket Tool открывает канал игроку через overwrites
+        await track_opener_from_channel(channel)
         await asyncio.sleep(2)
         try:
-            msg = await channel.send(WELCOME_MESSAGE)
+            msg = await rest_call("channel.send", lambda: channel.send(WELCOME_MESSAGE), idempotent=False)
             # Автозакреп (нужны права Manage Messages)
             try:
-                await msg.pin(reason="[SH] Auto-pin application template")
+                await rest_call(
+                    "message.pin",
+                    lambda: msg.pin(reason="[SH] Auto-pin application template"),
+                    priority=PRIORITY_BACKGROUND,
+                )
             except (discord.Forbidden, discord.HTTPException):
                 pass
         except discord.HTTPException:
@@ -116,79 +161,293 @@ async def on_guild_channel_create(channel):
 
 
 @client.event
-async def on_message(message: discord.Message):
-    # игнор своих сообщений
-    if message.author and client.user and message.author.id == client.user.id:
+async def on_guild_channel_update(before, after):
+    if after.guild.id == PRIVATE_GUILD_ID:
+        forget_invite_channel()  # права канала для инвайтов могли поменяться
+    # Ticket Tool может дописать topic/права уже после создания канала
+    if not isinstance(after, discord.TextChannel) or after.category_id != TICKETS_CATEGORY_ID:
         return
+    if before.topic != after.topic or before.overwrites != after.overwrites:
+        await track_opener_from_channel(after)
+
+
+@client.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    # роли/права могли измениться — закэшированный вердикт opener больше не актуален
+    # (событие приходит только при включённом intents.members; иначе спасает TTL)
+    forget_opener_verdict(after)
+    if client.user and after.id == client.user.id and after.guild.id == PRIVATE_GUILD_ID:
+        forget_invite_channel()
+
+
+def _forget_guild_roles(guild: discord.Guild) -> None:
+    # набор staff-ролей (в т.ч. роли с administrator) и строку пинга пересчитаем лениво
+    invalidate_guild_role_index(guild.id)
+    forget_guild_opener_verdicts(guild.id)
+    if guild.id == PRIVATE_GUILD_ID:
+        forget_invite_channel()  # права бота на создание инвайтов зависят от ролей
+
+
+@client.event
+async def on_guild_role_create(role: discord.Role):
+    _forget_guild_roles(role.guild)
+
+
+@client.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    _forget_guild_roles(after.guild)
+
+
+@client.event
+async def on_guild_role_delete(role: discord.Role):
+    _forget_guild_roles(role.guild)
+
+
+async def _handle_admin_command(message: discord.Message) -> bool:
+    """Админские текстовые команды. True если сообщение было командой и обработано."""
+    if not (message.author and message.author.id == IGNORE_ADD_ADMIN_ID and message.content):
+        return False
+
+    cmd = message.content.strip().lower()
 
     # ------------------------------------------------------
-    # Админская ручная синхронизация slash-команд (на случай, если хостинг/рестарт и т.п.)
+    # Ручная синхронизация slash-команд (на случай, если хостинг/рестарт и т.п.)
     # Работает и в ЛС, и в любом канале.
     # ------------------------------------------------------
-    if message.author and message.author.id == IGNORE_ADD_ADMIN_ID and message.content:
-        cmd = message.content.strip().lower()
-        if cmd in {"!sync", "!resync"}:
-            results = []
-            for g in list(client.guilds):
-                try:
-                    tree.copy_global_to(guild=discord.Object(id=g.id))
-                    synced = await tree.sync(guild=discord.Object(id=g.id))
-                    results.append(f"{g.name}: {len(synced)}")
-                except Exception as e:
-                    results.append(f"{g.name}: FAIL ({type(e).__name__})")
+    if cmd in {"!sync", "!resync"}:
+        results = []
+        for g in list(client.guilds):
             try:
-                await message.channel.send(
-                    "🔁 Sync done. " + " | ".join(results),
-                    allowed_mentions=discord.AllowedMentions.none(),
+                guild_obj = discord.Object(id=g.id)
+                tree.copy_global_to(guild=guild_obj)
+                synced = await rest_call(
+                    "tree.sync", lambda: tree.sync(guild=guild_obj), priority=PRIORITY_BACKGROUND
                 )
-            except discord.HTTPException:
-                pass
-            return
+                results.append(f"{g.name}: {len(synced)}")
+            except Exception as e:
+                results.append(f"{g.name}: FAIL ({type(e).__name__})")
+        text = "🔁 Sync done. " + " | ".join(results)
+
+    elif cmd == "!backup":
+        try:
+            res = await run_backup()
+            text = (
+                f"💾 Backup: `{res['path']}` — {res['archive_size_bytes'] // 1024} KiB "
+                f"(db {res['db_size_bytes'] // 1024} KiB), {res['duration_ms']} ms"
+            )
+        except Exception as e:
+            text = f"💾 Backup FAILED: {type(e).__name__}: {e}"
 
+    elif cmd == "!stats":
+        stats = db_write_stats()
+        for key, value in trigger_cache_stats().items():
+            metrics.set_value(f"trigger_cache.{key}", value)
+        for key, value in lookup_stats().items():
+            metrics.set_value(f"lookup.{key}", value)
+        for key, value in scheduler_stats().items():
+            metrics.set_value(f"rest.queue.{key}", value)
+        text = (
+            f"📊 write-behind: upserts={stats['upserts']} flushes={stats['flushes']} "
+            f"commits_saved={stats['commits_saved']}\n"
+            f"```\n{metrics.format_snapshot()[:1800]}\n```"
+        )
 
-    # дальше нас интересуют только сообщения на сервере, в текстовых каналах
-    if not message.guild or not isinstance(message.channel, discord.TextChannel):
-        return
+    else:
+        return False
+
+    try:
+        await rest_call(
+            "channel.send",
+            lambda: message.channel.send(text, allowed_mentions=discord.AllowedMentions.none()),
+            idempotent=False,
+        )
+    except discord.HTTPException:
+        pass
+    return True
+
+
+# ==========================================================
+#                   ON_MESSAGE PIPELINE
+# ==========================================================
+# Сообщение проходит этапы от дешёвых к дорогим; каждый этап либо пропускает его
+# дальше, либо отбрасывает:
+#   author   — не наше ли это сообщение;
+#   channel  — только текстовые тикет-каналы;
+# дальше две ветки по автору:
+#   игрок (Member, не бот)  -> opener   — запоминаем автора тикета;
+#   бот / вебхук            -> cooldown — анти-спам и dedup по каналу (только чтение),
+#                              trigger  — поиск фразы Ticket Tool (самый дорогой шаг).
+# Игрок не может вызвать кнопки обычным сообщением, поэтому его текст вообще не
+# проходит через trigger. По каждому этапу считаются вызовы, отказы и время:
+# metrics on_message.<stage>.calls / .rejected / .total_us / .max_us (см. !stats).
+
+
+def _stage_author(message: discord.Message) -> bool:
+    return not (message.author and client.user and message.author.id == client.user.id)
+
+
+def _stage_channel(message: discord.Message) -> bool:
+    return (
+        message.guild is not None
+        and isinstance(message.channel, discord.TextChannel)
+        and message.channel.category_id == TICKETS_CATEGORY_ID
+    )
+
+
+def _is_opener_candidate(message: discord.Message) -> bool:
+    return isinstance(message.author, discord.Member) and not message.author.bot
+
+
+def _is_trigger_source(message: discord.Message) -> bool:
+    # защита от подделки: кнопки вызывают только боты (Ticket Tool) и вебхуки
+    return bool(message.author and message.author.bot) or message.webhook_id is not None
+
+
+async def _stage_opener(message: discord.Message) -> bool:
+    # первый non-bot пользователь, который НЕ staff и НЕ в игноре
+    if classify_opener(message.author) != OPENER_OK:
+        return False
+    if await db_get_opener(message.channel.id) is not None:
+        return False
+    await db_set_opener(message.channel.id, message.author.id)
+    return True
+
+
+def _stage_cooldown(message: discord.Message) -> bool:
+    return prompt_blocked(message.channel.id, message.id, time.time()) is None
+
+
+def _stage_trigger(message: discord.Message) -> bool:
+    return message_contains_trigger(message)
 
-    # только тикет-каналы
-    if message.channel.category_id != TICKETS_CATEGORY_ID:
+
+async def _run_stage(event: str, name: str, stage, obj) -> bool:
+    started = time.perf_counter()
+    passed = stage(obj)
+    if inspect.isawaitable(passed):
+        passed = await passed
+    metrics.observe(f"{event}.{name}", time.perf_counter() - started)
+    if not passed:
+        metrics.inc(f"{event}.{name}.rejected")
+    return passed
+
+
+_COMMON_STAGES = (("author", _stage_author), ("channel", _stage_channel))
+_OPENER_STAGES = (("opener", _stage_opener),)
+_TRIGGER_STAGES = (("cooldown", _stage_cooldown), ("trigger", _stage_trigger))
+
+
+@client.event
+async def on_message(message: discord.Message):
+    if await _handle_admin_command(message):
         return
 
-    # 1) сохраняем opener: первый non-bot пользователь, который НЕ staff и НЕ в игноре
-    if isinstance(message.author, discord.Member) and not message.author.bot:
-        if (not is_staff(message.author)) and (not is_ignored_ticket_opener_member(message.author)):
-            if db_get_opener(message.channel.id) is None:
-                db_set_opener(message.channel.id, message.author.id)
+    for name, stage in _COMMON_STAGES:
+        if not await _run_stage("on_message", name, stage, message):
+            return
 
-    # 2) триггер Ticket Tool
-    if not message_contains_trigger(message):
+    if _is_opener_candidate(message):
+        for name, stage in _OPENER_STAGES:
+            if not await _run_stage("on_message", name, stage, message):
+                return
         return
 
-    # защита от подделки: игрок не должен запускать кнопки обычным сообщением
-    # (разрешаем ботов и вебхуки)
-    if not message.author.bot and message.webhook_id is None:
+    if not _is_trigger_source(message):
+        metrics.inc("on_message.untrusted_author.rejected")
         return
 
-    # анти-спам
-    now = time.time()
-    last = _last_prompt_time.get(message.channel.id, 0.0)
-    if now - last < PROMPT_COOLDOWN_SECONDS:
+    for name, stage in _TRIGGER_STAGES:
+        if not await _run_stage("on_message", name, stage, message):
+            return
+
+    await _post_prompt(message.channel, message.id)
+
+
+# ==========================================================
+#                 ON_RAW_MESSAGE_EDIT PIPELINE
+# ==========================================================
+# Некоторые тикет-боты сначала шлют заглушку, а текст подтверждения дописывают правкой.
+# Работаем прямо по payload.data (сырой MESSAGE_UPDATE), без fetch_message.
+# Этапы: author (бот/вебхук, не мы) -> channel -> cooldown (кулдаун канала + на это
+# сообщение кнопки ещё не отправляли) -> trigger. Проверки общие с on_message
+# (tickets.prompt_blocked / claim_prompt).
+# Метрики: on_message_edit.<stage>.*
+
+
+def _raw_edit_author(payload: discord.RawMessageUpdateEvent) -> tuple[int | None, bool]:
+    """(author_id, is_bot) из сырого payload; для частичных апдейтов — из кэша сообщений."""
+    author = payload.data.get("author")
+    if author:
+        return int(author["id"]), bool(author.get("bot"))
+    cached = payload.cached_message
+    if cached is not None and cached.author:
+        return cached.author.id, cached.author.bot
+    return None, False
+
+
+def _edit_stage_author(payload: discord.RawMessageUpdateEvent) -> bool:
+    author_id, is_bot = _raw_edit_author(payload)
+    if author_id is None:
+        return False
+    if client.user and author_id == client.user.id:
+        return False
+    return is_bot or payload.data.get("webhook_id") is not None
+
+
+def _edit_stage_channel(payload: discord.RawMessageUpdateEvent) -> bool:
+    if payload.guild_id is None:
+        return False
+    channel = client.get_channel(payload.channel_id)
+    return isinstance(channel, discord.TextChannel) and channel.category_id == TICKETS_CATEGORY_ID
+
+
+def _edit_stage_cooldown(payload: discord.RawMessageUpdateEvent) -> bool:
+    return prompt_blocked(payload.channel_id, payload.message_id, time.time()) is None
+
+
+def _edit_stage_trigger(payload: discord.RawMessageUpdateEvent) -> bool:
+    return raw_message_contains_trigger(payload.data)
+
+
+_EDIT_STAGES = (
+    ("author", _edit_stage_author),
+    ("channel", _edit_stage_channel),
+    ("cooldown", _edit_stage_cooldown),
+    ("trigger", _edit_stage_trigger),
+)
+
+
+@client.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    for name, stage in _EDIT_STAGES:
+        if not await _run_stage("on_message_edit", name, stage, payload):
+            return
+
+    channel = client.get_channel(payload.channel_id)
+    if isinstance(channel, discord.TextChannel):
+        await _post_prompt(channel, payload.message_id)
+
+
+async def _post_prompt(channel: discord.TextChannel, trigger_message_id: int) -> None:
+    # анти-спам и dedup (см. tickets.prompt_blocked): on_message и on_raw_message_edit
+    # одного сообщения могут прийти подряд, а после рестарта — повтор от Ticket Tool
+    if not claim_prompt(channel.id, trigger_message_id):
         return
-    _last_prompt_time[message.channel.id] = now
+    metrics.inc("prompts.posted")
 
     # если opener не успели записать — попробуем фоллбеком
-    if db_get_opener(message.channel.id) is None:
-        opener = await resolve_ticket_opener_fallback(message.channel)
+    if await db_get_opener(channel.id) is None:
+        opener = await resolve_ticket_opener_fallback(channel)
         if opener:
             if isinstance(opener, discord.Member):
                 if not is_ignored_ticket_opener_member(opener):
-                    db_set_opener(message.channel.id, opener.id)
+                    await db_set_opener(channel.id, opener.id)
             else:
                 # Если по какой-то причине получили не Member, то проверяем только по ID
                 if not is_ignored_ticket_opener_id(opener.id):
-                    db_set_opener(message.channel.id, opener.id)
+                    await db_set_opener(channel.id, opener.id)
 
-    staff_ping = build_staff_ping(message.guild)
+    staff_ping = build_staff_ping()
     spoiler_pings = f"||{staff_ping}||" if staff_ping else ""
 
     # Отступ как просили: текст -> пустая строка -> ||пинги||
@@ -198,20 +457,20 @@ async def on_message(message: discord.Message):
         f"{spoiler_pings}"
     )
 
-    # Небольшая задержка после создания тикета, чтобы Discord успел прогрузить права/интеграции.
-    # Важно: иногда сразу после авто-создания канала/прав первая отправка может падать.
-    # Поэтому делаем быстрый first-try и несколько коротких ретраев.
-    for delay in (0, 1, 2):
-        if delay:
-            await asyncio.sleep(delay)
-        try:
-            sent = await message.channel.send(
+    # Важно: иногда сразу после авто-создания канала/прав первая отправка может падать
+    # (в том числе с 403, пока права не прогрузились) — поэтому ретраим и Forbidden.
+    try:
+        sent = await rest_call(
+            "prompt.send",
+            lambda: channel.send(
                 prompt_text,
                 view=TicketDecisionView(),
                 allowed_mentions=discord.AllowedMentions(roles=True, users=False, everyone=False),
-            )
-            db_set_prompt(message.channel.id, sent.id)
-            break
-        except (discord.Forbidden, discord.HTTPException):
-            continue
-
+            ),
+            deadline=PROMPT_SEND_DEADLINE_SECONDS,
+            retry_on=RETRY_FORBIDDEN,
+            idempotent=False,
+        )
+    except discord.HTTPException:
+        return
+    await db_set_prompt(channel.id, sent.id)
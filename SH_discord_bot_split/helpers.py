@@ -1,58 +1,276 @@
 # helpers.py
 import re
+from functools import lru_cache
+from typing import NamedTuple
+
 import discord
 
-from config import STAFF_ROLE_IDS, STAFF_PING_ROLE_IDS, TRIGGER_PHRASE
+from config import (
+    STAFF_ROLE_IDS,
+    STAFF_PING_ROLE_IDS,
+    TRIGGER_PHRASES,
+    TRIGGER_FUZZY_MAX_DISTANCE,
+    TRIGGER_CACHE_SIZE,
+)
 
 
 # ==========================================================
 #                    HELPER FUNCTIONS
 # ==========================================================
 
+STAFF_ROLE_ID_SET: frozenset[int] = frozenset(STAFF_ROLE_IDS)
+# роль могла пропасть с сервера — упоминание всё равно оставляем, как и раньше
+STAFF_PING: str = " ".join(f"<@&{rid}>" for rid in STAFF_PING_ROLE_IDS)
+
+
+# -------------------- GUILD ROLE INDEX --------------------
+# Что на сервере считается staff и чем пинговать модераторов — считается один раз
+# на гильдию и сбрасывается событиями ролей (см. events.py: on_guild_role_*).
+#   staff_role_ids  — роли из STAFF_ROLE_IDS + все роли с правом administrator;
+#   everyone_admin  — administrator выдан @everyone (тогда staff все);
+#   ping_roles      — существующие на сервере роли из STAFF_PING_ROLE_IDS.
+# Проверка staff — пересечение множеств с id ролей участника, без пересчёта
+# guild_permissions по всем ролям.
+
+
+class GuildRoleIndex(NamedTuple):
+    staff_role_ids: frozenset[int]
+    everyone_admin: bool
+    ping_roles: tuple[discord.Role, ...]
+
+
+_role_indexes: dict[int, GuildRoleIndex] = {}
+
+
+def _build_role_index(guild: discord.Guild) -> GuildRoleIndex:
+    admin_role_ids = {r.id for r in guild.roles if r.permissions.administrator}
+    ping_roles = tuple(r for r in map(guild.get_role, STAFF_PING_ROLE_IDS) if r is not None)
+    return GuildRoleIndex(
+        staff_role_ids=frozenset(STAFF_ROLE_ID_SET | admin_role_ids),
+        everyone_admin=guild.default_role.permissions.administrator,
+        ping_roles=ping_roles,
+    )
+
+
+def guild_role_index(guild: discord.Guild) -> GuildRoleIndex:
+    index = _role_indexes.get(guild.id)
+    if index is None:
+        index = _build_role_index(guild)
+        _role_indexes[guild.id] = index
+    return index
+
+
+def invalidate_guild_role_index(guild_id: int) -> None:
+    _role_indexes.pop(guild_id, None)
+
+
+def member_role_ids(member: discord.Member) -> set[int]:
+    # Только публичный member.roles (без @everyone): он строит список на каждый вызов,
+    # но проверки ролей идут лишь при промахе кэша вердиктов (tickets.classify_opener).
+    return {r.id for r in member.roles if not r.is_default()}
+
 
 def is_staff(member: discord.Member) -> bool:
-    # Жёстко по ролям + админ
-    if member.guild_permissions.administrator:
+    # Жёстко по ролям + админ (владелец сервера — тоже админ)
+    index = guild_role_index(member.guild)
+    if index.everyone_admin or member.id == member.guild.owner_id:
         return True
-    return any(r.id in STAFF_ROLE_IDS for r in member.roles)
+    return not index.staff_role_ids.isdisjoint(member_role_ids(member))
+
+
+# -------------------- TRIGGER MATCHER --------------------
+# Нормализация цепочкой str.replace (как в исходном _normalize_text): ё -> е,
+# markdown (**, __, *, `) выкидываем; одиночное "_" остаётся. str.translate здесь
+# не годится: на кириллице он идёт медленным путём (поиск по словарю на каждый символ).
+# Пробелы не трогаем — любые пробельные символы между словами фразы съедает шаблон
+# (\s+). Все фразы собраны в одно регулярное выражение, так что каждая часть
+# сообщения сканируется один раз, независимо от числа фраз.
+#
+# Перед полным шаблоном нормализованный текст проверяется на "якоря" — самое
+# длинное слово каждой фразы. Нет якоря — нет и фразы (так дешевле отсекается
+# почти весь обычный текст).
+
+
+def _strip_markup(low: str) -> str:
+    return low.replace("ё", "е").replace("**", "").replace("__", "").replace("*", "").replace("`", "")
 
 
 def _normalize_text(text: str) -> str:
-    text = (text or "").lower().strip()
-    # Ticket Tool и другие боты могут использовать "ё"/"е" по-разному.
-    # Для устойчивого триггера приводим к единому виду.
-    text = text.replace("ё", "е")
-    text = text.replace("**", "").replace("__", "").replace("*", "").replace("`", "")
-    text = re.sub(r"\s+", " ", text)
-    return text.strip(" .,!?:;—-")
+    text = _strip_markup((text or "").lower())
+    return " ".join(text.split()).strip(" .,!?:;—-")
 
 
-def message_contains_trigger(msg: discord.Message) -> bool:
-    parts: list[str] = []
+def _phrase_anchor(phrase: str) -> str:
+    return max(phrase.split(" "), key=len)
+
+
+# ---- нечёткий поиск (Myers, bit-parallel) ----
+# Расстояние Левенштейна между фразой и ЛЮБОЙ подстрокой текста: столбец матрицы
+# динамики хранится как два битовых вектора (+1/-1 по вертикали), шаг по символу
+# текста — десяток битовых операций над int, т.е. O(len(text)) на фразу.
+# Чтобы не гонять его по каждому сообщению, сначала ищем "куски": фраза режется
+# на k+2 частей, и при <= k правках хотя бы две части обязаны встретиться в тексте
+# без изменений (принцип Дирихле). Меньше двух кусков — совпадения нет. С одним
+# куском (k+1 частей) фильтр пропускал обычный текст тикетов: короткие куски вроде
+# "this ticket" встречаются в нём постоянно.
+# Текст для него — нормализованный, с одиночными пробелами (как фразы).
+
+
+def _myers_peq(pattern: str) -> dict[str, int]:
+    peq: dict[str, int] = {}
+    for i, ch in enumerate(pattern):
+        peq[ch] = peq.get(ch, 0) | (1 << i)
+    return peq
+
+
+def _myers_within(peq: dict[str, int], m: int, text: str, max_distance: int) -> bool:
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+    pv, mv, score = mask, 0, m
+    for ch in text:
+        eq = peq.get(ch, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = (ph << 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+        if score <= max_distance:
+            return True
+    return False
+
+
+def _two_pieces_in(pieces: tuple[str, ...], text: str) -> bool:
+    found = 0
+    for piece in pieces:
+        if piece in text:
+            found += 1
+            if found == 2:
+                return True
+    return False
+
+
+def _phrase_pieces(phrase: str, parts: int) -> list[str]:
+    size, extra = divmod(len(phrase), parts)
+    pieces, start = [], 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        pieces.append(phrase[start:end])
+        start = end
+    return pieces
+
+
+class TriggerMatcher:
+    def __init__(self, phrases: list[str], max_distance: int = 0):
+        normalized = sorted({n for n in map(_normalize_text, phrases) if n}, key=len, reverse=True)
+        if not normalized:
+            raise RuntimeError("TRIGGER_PHRASES пуст: не на что реагировать.")
+        self.phrases: tuple[str, ...] = tuple(normalized)
+        self._pattern = re.compile("|".join(r"\s+".join(map(re.escape, p.split(" "))) for p in normalized))
+        anchors = sorted({_phrase_anchor(p) for p in normalized}, key=len, reverse=True)
+        self._prefilter = re.compile("|".join(map(re.escape, anchors)))
+
+        self.max_distance = max_distance
+        # (куски фразы, битовые маски символов, длина фразы)
+        self._fuzzy: list[tuple[tuple[str, ...], dict[str, int], int]] = []
+        if max_distance > 0:
+            shortest = len(normalized[-1])
+            if shortest < 4 * max_distance:
+                raise RuntimeError(
+                    f"TRIGGER_FUZZY_MAX_DISTANCE={max_distance} слишком велик для фразы "
+                    f"{normalized[-1]!r} ({shortest} символов): будут ложные срабатывания."
+                )
+            self._fuzzy = [
+                (tuple(_phrase_pieces(p, max_distance + 2)), _myers_peq(p), len(p)) for p in normalized
+            ]
+
+    def search(self, text: str) -> bool:
+        low = _strip_markup(text.lower())
+        if self._prefilter.search(low) is not None and self._pattern.search(low) is not None:
+            return True
+        if not self._fuzzy:
+            return False
+        squashed = " ".join(low.split())
+        return any(
+            _two_pieces_in(pieces, squashed) and _myers_within(peq, m, squashed, self.max_distance)
+            for pieces, peq, m in self._fuzzy
+        )
+
+    def matches_any(self, parts) -> bool:
+        return any(self.search(part) for part in parts)
+
+
+TRIGGER_MATCHER = TriggerMatcher(TRIGGER_PHRASES, TRIGGER_FUZZY_MAX_DISTANCE)
+
+
+def _message_text_parts(msg: discord.Message):
     if msg.content:
-        parts.append(msg.content)
+        yield msg.content
 
     for emb in msg.embeds:
         if emb.title:
-            parts.append(emb.title)
+            yield emb.title
         if emb.description:
-            parts.append(emb.description)
+            yield emb.description
         for f in emb.fields:
             if f.name:
-                parts.append(f.name)
+                yield f.name
             if f.value:
-                parts.append(f.value)
+                yield f.value
         if emb.footer and emb.footer.text:
-            parts.append(emb.footer.text)
+            yield emb.footer.text
+
+
+@lru_cache(maxsize=TRIGGER_CACHE_SIZE)
+def _parts_contain_trigger(parts: tuple[str, ...]) -> bool:
+    # Части проверяются по отдельности: фраза Ticket Tool целиком лежит
+    # в одном поле, склеивать всё в одну строку незачем.
+    return TRIGGER_MATCHER.matches_any(parts)
+
+
+def message_contains_trigger(msg: discord.Message) -> bool:
+    # Ключ кэша — кортеж текстовых частей сообщения (content + поля embed-ов):
+    # одинаковые embed-ы Ticket Tool дают одинаковый ключ, и нормализация
+    # с поиском выполняются один раз на весь LRU.
+    return _parts_contain_trigger(tuple(_message_text_parts(msg)))
+
+
+def _raw_text_parts(data: dict):
+    # То же, что _message_text_parts, но по сырому JSON из gateway (MESSAGE_UPDATE)
+    content = data.get("content")
+    if content:
+        yield content
+
+    for emb in data.get("embeds") or ():
+        if emb.get("title"):
+            yield emb["title"]
+        if emb.get("description"):
+            yield emb["description"]
+        for f in emb.get("fields") or ():
+            if f.get("name"):
+                yield f["name"]
+            if f.get("value"):
+                yield f["value"]
+        footer = emb.get("footer")
+        if footer and footer.get("text"):
+            yield footer["text"]
+
+
+def raw_message_contains_trigger(data: dict) -> bool:
+    # Общий LRU с message_contains_trigger: ключ одинаковый для Message и сырого dict
+    return _parts_contain_trigger(tuple(_raw_text_parts(data)))
+
 
-    joined_norm = _normalize_text(" ".join(parts))
-    trigger_norm = _normalize_text(TRIGGER_PHRASE)
-    return trigger_norm in joined_norm
+def trigger_cache_stats() -> dict[str, int]:
+    info = _parts_contain_trigger.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize or 0}
 
 
-def build_staff_ping(guild: discord.Guild) -> str:
-    mentions = []
-    for rid in STAFF_PING_ROLE_IDS:
-        role = guild.get_role(rid)
-        mentions.append(role.mention if role else f"<@&{rid}>")
-    return " ".join(mentions).strip()
+def build_staff_ping() -> str:
+    return STAFF_PING
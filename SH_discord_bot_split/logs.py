@@ -2,6 +2,7 @@
 import discord
 
 from config import LOG_CHANNEL_ID
+from rest import rest_call, PRIORITY_BACKGROUND
 
 
 async def log_event(guild: discord.Guild, text: str) -> None:
@@ -10,7 +11,12 @@ async def log_event(guild: discord.Guild, text: str) -> None:
     ch = guild.get_channel(LOG_CHANNEL_ID)
     if isinstance(ch, discord.TextChannel):
         try:
-            await ch.send(text, allowed_mentions=discord.AllowedMentions.none())
+            await rest_call(
+                "log.send",
+                lambda: ch.send(text, allowed_mentions=discord.AllowedMentions.none()),
+                priority=PRIORITY_BACKGROUND,
+                idempotent=False,
+            )
         except discord.HTTPException:
             pass
 
@@ -58,14 +64,19 @@ async def send_application_log(
         reaction = "❌"
 
     try:
-        msg = await ch.send(
-            body,
-            allowed_mentions=discord.AllowedMentions(users=True, roles=False, everyone=False),
+        msg = await rest_call(
+            "log.send",
+            lambda: ch.send(
+                body,
+                allowed_mentions=discord.AllowedMentions(users=True, roles=False, everyone=False),
+            ),
+            priority=PRIORITY_BACKGROUND,
+            idempotent=False,
         )
     except discord.HTTPException:
         return
 
     try:
-        await msg.add_reaction(reaction)
+        await rest_call("message.add_reaction", lambda: msg.add_reaction(reaction), priority=PRIORITY_BACKGROUND)
     except (discord.Forbidden, discord.HTTPException):
         pass
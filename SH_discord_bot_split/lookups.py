@@ -0,0 +1,131 @@
+# lookups.py
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+import discord
+
+import metrics
+from app import client
+from config import LOOKUP_CACHE_SIZE, LOOKUP_TTL_SECONDS, LOOKUP_NEGATIVE_TTL_SECONDS
+from rest import rest_call
+
+
+# ==========================================================
+#                  REST LOOKUP CACHE (users/members)
+# ==========================================================
+# fetch_user / fetch_member — это REST-запросы. Здесь общий кэш для них:
+#   - TTL + LRU (не больше LOOKUP_CACHE_SIZE записей на вид запроса);
+#   - NotFound тоже кэшируется (на LOOKUP_NEGATIVE_TTL_SECONDS) как None;
+#   - одновременные промахи по одному ключу ждут один общий запрос.
+# Прочие ошибки (Forbidden, 5xx) не кэшируются и пробрасываются вызывающему.
+# Кэш живёт только в event loop (без блокировок), поэтому и счётчики метрик
+# lookup.<user|member>.* увеличиваются из одного потока.
+
+
+def _consume_exception(task: asyncio.Task) -> None:
+    # ожидающих могли отменить всех — ошибку запроса помечаем как полученную
+    if not task.cancelled():
+        task.exception()
+
+
+class AsyncLookupCache:
+    def __init__(self, name: str, maxsize: int, ttl: float, negative_ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # key -> (expires_at monotonic, value | None)
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                metrics.inc(f"lookup.{self.name}.hits" if entry[1] is not None else f"lookup.{self.name}.negative_hits")
+                return entry[1]
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            metrics.inc(f"lookup.{self.name}.misses")
+            task = asyncio.ensure_future(self._fetch(key, fetch))
+            task.add_done_callback(_consume_exception)
+            self._inflight[key] = task
+        else:
+            metrics.inc(f"lookup.{self.name}.coalesced")
+        # Запрос идёт в своей задаче, все (и первый тоже) ждут его через shield:
+        # отмена любого ожидающего снимает только его ожидание, общий запрос доживает
+        # и кладёт результат в кэш.
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            try:
+                value = await fetch()
+            except discord.NotFound:
+                value = None
+        finally:
+            self._inflight.pop(key, None)
+        self._store(key, value)
+        return value
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        ttl = self.ttl if value is not None else self.negative_ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            metrics.inc(f"lookup.{self.name}.evictions")
+
+    def forget(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def stats(self) -> dict[str, int]:
+        hits = metrics.get(f"lookup.{self.name}.hits") + metrics.get(f"lookup.{self.name}.negative_hits")
+        total = hits + metrics.get(f"lookup.{self.name}.misses") + metrics.get(f"lookup.{self.name}.coalesced")
+        return {
+            "size": len(self._entries),
+            "inflight": len(self._inflight),
+            "hit_rate_pct": round(hits * 100 / total) if total else 0,
+        }
+
+
+_users = AsyncLookupCache("user", LOOKUP_CACHE_SIZE, LOOKUP_TTL_SECONDS, LOOKUP_NEGATIVE_TTL_SECONDS)
+_members = AsyncLookupCache("member", LOOKUP_CACHE_SIZE, LOOKUP_TTL_SECONDS, LOOKUP_NEGATIVE_TTL_SECONDS)
+
+
+async def fetch_user_cached(user_id: int) -> discord.User | None:
+    """client.fetch_user через кэш. None — пользователь не существует (NotFound)."""
+    user = client.get_user(user_id)
+    if user is not None:
+        return user
+    return await _users.get(user_id, lambda: rest_call("user.fetch", lambda: client.fetch_user(user_id)))
+
+
+async def fetch_member_cached(guild: discord.Guild, user_id: int) -> discord.Member | None:
+    """guild.get_member, иначе guild.fetch_member через кэш. None — не участник сервера."""
+    member = guild.get_member(user_id)
+    if member is not None:
+        return member
+    return await _members.get(
+        (guild.id, user_id), lambda: rest_call("member.fetch", lambda: guild.fetch_member(user_id))
+    )
+
+
+def forget_member(guild_id: int, user_id: int) -> None:
+    """Сбросить закэшированного участника (например, после выдачи/снятия ролей)."""
+    _members.forget((guild_id, user_id))
+
+
+def lookup_stats() -> dict[str, int]:
+    out: dict[str, int] = {}
+    for cache in (_users, _members):
+        for key, value in cache.stats().items():
+            out[f"{cache.name}.{key}"] = value
+    return out
@@ -1,7 +1,11 @@
 # main.py
 from config import TOKEN
 from app import client
+from db_async import db_shutdown
 import events  # noqa: F401  (важно: регистрирует handlers)
 import slash_commands  # noqa: F401  (важно: исторически тут были slash-команды; сейчас файл пустой)
 
-client.run(TOKEN)
+try:
+    client.run(TOKEN)
+finally:
+    db_shutdown()
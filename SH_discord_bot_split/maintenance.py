@@ -0,0 +1,111 @@
+# maintenance.py
+import asyncio
+import time
+
+import metrics
+from app import client, _last_prompt_time, _last_trigger_message, _channel_locks
+from config import (
+    RETENTION_SWEEP_INTERVAL_SECONDS,
+    RETENTION_BATCH_SIZE,
+    RETENTION_INVITE_LOGS_DAYS,
+    RETENTION_ORPHAN_GRACE_SECONDS,
+    RETENTION_DECISION_JOBS_DAYS,
+    RETENTION_VACUUM_PAGES,
+)
+from db_async import (
+    db_delete_expired_invites,
+    db_delete_finished_decision_jobs,
+    db_list_ticket_channels,
+    db_delete_ticket_channels,
+    db_incremental_vacuum,
+)
+
+
+# ==========================================================
+#                    RETENTION SWEEPER
+# ==========================================================
+# Периодически чистит то, что само никогда не удаляется:
+#   - invite_logs старше RETENTION_INVITE_LOGS_DAYS после expires_at;
+#   - завершённые decision_jobs старше RETENTION_DECISION_JOBS_DAYS;
+#   - tickets/prompts для каналов, которых уже нет (удалены Ticket Tool-ом или вручную);
+#   - in-memory cooldown/locks для тех же каналов.
+# Удаляем небольшими пачками, между пачками отдаём управление event loop.
+# В конце возвращаем ОС освободившиеся страницы (incremental vacuum).
+
+
+def guild_cache_complete() -> bool:
+    # пока кэш гильдий не полон, "канала нет в кэше" не значит "канал удалён"
+    return client.is_ready() and all(not g.unavailable for g in client.guilds)
+
+
+async def delete_orphan_ticket_rows() -> tuple[int, int]:
+    """Удаляет tickets/prompts каналов, которых нет в кэше (старше grace). -> (tickets, prompts)"""
+    grace_before = int(time.time()) - RETENTION_ORPHAN_GRACE_SECONDS
+    orphans = [
+        channel_id
+        for channel_id, created_at in await db_list_ticket_channels()
+        if created_at < grace_before and client.get_channel(channel_id) is None
+    ]
+    total_tickets = total_prompts = 0
+    for i in range(0, len(orphans), RETENTION_BATCH_SIZE):
+        tickets, prompts = await db_delete_ticket_channels(orphans[i:i + RETENTION_BATCH_SIZE])
+        total_tickets += tickets
+        total_prompts += prompts
+        await asyncio.sleep(0)
+    return total_tickets, total_prompts
+
+
+async def sweep_once() -> dict[str, int]:
+    started = time.perf_counter()
+    stats = {"invite_logs": 0, "decision_jobs": 0, "tickets": 0, "prompts": 0, "freed_bytes": 0}
+
+    # 1) истёкшие инвайты
+    expired_before = int(time.time()) - RETENTION_INVITE_LOGS_DAYS * 86400
+    while True:
+        deleted = await db_delete_expired_invites(expired_before, RETENTION_BATCH_SIZE)
+        stats["invite_logs"] += deleted
+        if deleted < RETENTION_BATCH_SIZE:
+            break
+        await asyncio.sleep(0)
+
+    finished_before = int(time.time()) - RETENTION_DECISION_JOBS_DAYS * 86400
+    while True:
+        deleted = await db_delete_finished_decision_jobs(finished_before, RETENTION_BATCH_SIZE)
+        stats["decision_jobs"] += deleted
+        if deleted < RETENTION_BATCH_SIZE:
+            break
+        await asyncio.sleep(0)
+
+    # 2) строки для каналов, которых больше нет
+    if guild_cache_complete():
+        stats["tickets"], stats["prompts"] = await delete_orphan_ticket_rows()
+
+        for state in (_last_prompt_time, _last_trigger_message, _channel_locks):
+            for channel_id in [cid for cid in state if client.get_channel(cid) is None]:
+                lock = _channel_locks.get(channel_id)
+                if lock is not None and lock.locked():
+                    continue
+                state.pop(channel_id, None)
+
+    # 3) вернуть освободившееся место
+    stats["freed_bytes"] = await db_incremental_vacuum(RETENTION_VACUUM_PAGES)
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    for key, value in stats.items():
+        metrics.inc(f"retention.{key}", value)
+    metrics.inc("retention.sweeps")
+    print(
+        f"[Sweep] invite_logs={stats['invite_logs']} decision_jobs={stats['decision_jobs']} tickets={stats['tickets']} "
+        f"prompts={stats['prompts']} freed={stats['freed_bytes'] // 1024} KiB in {elapsed_ms:.0f} ms"
+    )
+    return stats
+
+
+async def retention_loop() -> None:
+    await client.wait_until_ready()
+    while not client.is_closed():
+        try:
+            await sweep_once()
+        except Exception as e:
+            print(f"[Sweep] FAILED: {type(e).__name__}: {e}")
+        await asyncio.sleep(RETENTION_SWEEP_INTERVAL_SECONDS)
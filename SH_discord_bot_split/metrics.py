@@ -0,0 +1,50 @@
+# metrics.py
+import threading
+
+# ==========================================================
+#                        METRICS
+# ==========================================================
+# Простые счётчики в памяти процесса (сбрасываются при рестарте).
+# Потокобезопасны: часть из них обновляется из потоков БД.
+
+_lock = threading.Lock()
+_counters: dict[str, int] = {}
+
+
+def inc(name: str, value: int = 1) -> None:
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_value(name: str, value: int) -> None:
+    """Для "последних" значений (gauge), например длительности последнего бэкапа."""
+    with _lock:
+        _counters[name] = value
+
+
+def observe(name: str, seconds: float) -> None:
+    """Время выполнения: <name>.calls, <name>.total_us и <name>.max_us."""
+    us = int(seconds * 1_000_000)
+    with _lock:
+        _counters[f"{name}.calls"] = _counters.get(f"{name}.calls", 0) + 1
+        _counters[f"{name}.total_us"] = _counters.get(f"{name}.total_us", 0) + us
+        if us > _counters.get(f"{name}.max_us", 0):
+            _counters[f"{name}.max_us"] = us
+
+
+def get(name: str) -> int:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot() -> dict[str, int]:
+    with _lock:
+        return dict(sorted(_counters.items()))
+
+
+def format_snapshot() -> str:
+    """Текстовый дамп всех счётчиков (для !stats и логов при остановке)."""
+    snap = snapshot()
+    if not snap:
+        return "(пусто)"
+    return "\n".join(f"{k}={v}" for k, v in snap.items())
@@ -1,8 +1,10 @@
 # privatka.py
+import asyncio
 import re
 import time
 import discord
 
+import metrics
 from app import client
 from config import (
     PRIVATE_GUILD_ID,
@@ -10,8 +12,25 @@ from config import (
     PRIVATE_REMOVE_ROLE_ID,
     PRIVATE_ADD_ROLE_ID,
     PRIVATE_SETUP_MESSAGE,
+    PRIVATE_INVITE_MAX_AGE_SECONDS,
+    PRIVATE_INVITE_MAX_USES,
+    INVITE_POOL_SIZE,
+    INVITE_POOL_REFILL_INTERVAL_SECONDS,
+    INVITE_POOL_MAX_IDLE_SECONDS,
+    INVITE_CLAIM_GRACE_SECONDS,
 )
-from db import db_get_private_setup_message, db_set_private_setup_message
+from db import INVITE_POOL, INVITE_CLAIMED, INVITE_DELIVERED, INVITE_REVOKED
+from db_async import (
+    db_get_private_setup_message,
+    db_set_private_setup_message,
+    db_log_invite,
+    db_add_pool_invite,
+    db_claim_pool_invite,
+    db_list_invites,
+    db_transition_invite,
+    db_refresh_invite_claim,
+)
+from rest import rest_call, interaction_call, PRIORITY_USER, PRIORITY_BACKGROUND
 
 
 # ==========================================================
@@ -88,11 +107,17 @@ class PrivateNicknameModal(discord.ui.Modal):
 
     async def on_submit(self, interaction: discord.Interaction) -> None:
         if not interaction.guild or not isinstance(interaction.user, discord.Member):
-            return await interaction.response.send_message("Ошибка: не удалось определить сервер/участника.", ephemeral=True)
+            return await interaction_call(
+                "interaction.send_message",
+                lambda: interaction.response.send_message("Ошибка: не удалось определить сервер/участника.", ephemeral=True),
+            )
 
         # строго работаем только в приватке
         if interaction.guild.id != PRIVATE_GUILD_ID:
-            return await interaction.response.send_message("Эта форма работает только в приватке.", ephemeral=True)
+            return await interaction_call(
+                "interaction.send_message",
+                lambda: interaction.response.send_message("Эта форма работает только в приватке.", ephemeral=True),
+            )
 
         member: discord.Member = interaction.user
         new_nick = format_private_nickname(self.steam_nick.value, self.real_name.value)
@@ -104,7 +129,7 @@ class PrivateNicknameModal(discord.ui.Modal):
 
         # 1) меняем ник
         try:
-            await member.edit(nick=new_nick, reason="[SH] Privatka nickname setup")
+            await rest_call("member.edit", lambda: member.edit(nick=new_nick, reason="[SH] Privatka nickname setup"))
         except discord.Forbidden:
             nick_ok = False
             nick_err = "Нет прав на изменение ника (Manage Nicknames) или роль бота ниже."
@@ -117,9 +142,15 @@ class PrivateNicknameModal(discord.ui.Modal):
         add_role = interaction.guild.get_role(PRIVATE_ADD_ROLE_ID)
         try:
             if remove_role and remove_role in member.roles:
-                await member.remove_roles(remove_role, reason="[SH] Privatka nickname setup: remove role")
+                await rest_call(
+                    "member.remove_roles",
+                    lambda: member.remove_roles(remove_role, reason="[SH] Privatka nickname setup: remove role"),
+                )
             if add_role and add_role not in member.roles:
-                await member.add_roles(add_role, reason="[SH] Privatka nickname setup: add role")
+                await rest_call(
+                    "member.add_roles",
+                    lambda: member.add_roles(add_role, reason="[SH] Privatka nickname setup: add role"),
+                )
         except discord.Forbidden:
             roles_ok = False
             roles_err = "Нет прав на выдачу ролей (Manage Roles) или роли выше роли бота."
@@ -139,7 +170,10 @@ class PrivateNicknameModal(discord.ui.Modal):
         else:
             lines.append(f"❌ Роли не обновлены. {roles_err}")
 
-        await interaction.response.send_message("\n".join(lines), ephemeral=True)
+        await interaction_call(
+            "interaction.send_message",
+            lambda: interaction.response.send_message("\n".join(lines), ephemeral=True),
+        )
 
 
 class PrivateSetupView(discord.ui.View):
@@ -153,15 +187,23 @@ class PrivateSetupView(discord.ui.View):
     )
     async def open_form(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not interaction.guild or interaction.guild.id != PRIVATE_GUILD_ID:
-            return await interaction.response.send_message("Эта кнопка работает только в приватке.", ephemeral=True)
-
-        await interaction.response.send_modal(PrivateNicknameModal())
+            return await interaction_call(
+                "interaction.send_message",
+                lambda: interaction.response.send_message("Эта кнопка работает только в приватке.", ephemeral=True),
+            )
+
+        await interaction_call(
+            "interaction.send_modal",
+            lambda: interaction.response.send_modal(PrivateNicknameModal()),
+        )
 
 
 async def ensure_private_setup_message() -> None:
     # Создаёт (один раз) сообщение с кнопкой в канале приватки.
     try:
-        ch = client.get_channel(PRIVATE_SETUP_CHANNEL_ID) or await client.fetch_channel(PRIVATE_SETUP_CHANNEL_ID)
+        ch = client.get_channel(PRIVATE_SETUP_CHANNEL_ID) or await rest_call(
+            "channel.fetch", lambda: client.fetch_channel(PRIVATE_SETUP_CHANNEL_ID)
+        )
     except (discord.Forbidden, discord.NotFound, discord.HTTPException):
         return
 
@@ -171,22 +213,26 @@ async def ensure_private_setup_message() -> None:
     if ch.guild.id != PRIVATE_GUILD_ID:
         return
 
-    stored_id = db_get_private_setup_message(PRIVATE_SETUP_CHANNEL_ID)
+    stored_id = await db_get_private_setup_message(PRIVATE_SETUP_CHANNEL_ID)
     if stored_id:
         try:
-            old = await ch.fetch_message(stored_id)
+            old = await rest_call("message.fetch", lambda: ch.fetch_message(stored_id))
             if client.user and old.author and old.author.id == client.user.id:
                 return  # уже есть
         except (discord.NotFound, discord.HTTPException):
             pass
 
     try:
-        msg = await ch.send(
-            PRIVATE_SETUP_MESSAGE,
-            view=PrivateSetupView(),
-            allowed_mentions=discord.AllowedMentions.none(),
+        msg = await rest_call(
+            "channel.send",
+            lambda: ch.send(
+                PRIVATE_SETUP_MESSAGE,
+                view=PrivateSetupView(),
+                allowed_mentions=discord.AllowedMentions.none(),
+            ),
+            idempotent=False,
         )
-        db_set_private_setup_message(PRIVATE_SETUP_CHANNEL_ID, msg.id)
+        await db_set_private_setup_message(PRIVATE_SETUP_CHANNEL_ID, msg.id)
     except discord.HTTPException:
         return
 
@@ -194,29 +240,43 @@ async def ensure_private_setup_message() -> None:
 # ==========================================================
 #                PRIVATKA: INVITE GENERATION
 # ==========================================================
-
-async def create_one_time_private_invite(
-    *,
-    opener: discord.abc.User,
-    moderator: discord.Member | discord.User,
-) -> discord.Invite | None:
-    """Создаёт персональный инвайт в приватку (1 день, 1 использование)."""
-    from config import (
-        PRIVATE_GUILD_ID,
-        PRIVATE_SETUP_CHANNEL_ID,
-        PRIVATE_INVITE_MAX_AGE_SECONDS,
-        PRIVATE_INVITE_MAX_USES,
-    )
-    from db import db_log_invite
-
-    guild = client.get_guild(PRIVATE_GUILD_ID)
-    if guild is None:
-        return None
-
-    # Пробуем создать инвайт в заданном канале, иначе ищем первый доступный текстовый канал
-    target_channel = guild.get_channel(PRIVATE_SETUP_CHANNEL_ID)
-    invite_channel: discord.abc.GuildChannel | None = None
-
+# Персональные инвайты (1 использование) выдаются из пула: invite_pool_loop держит
+# INVITE_POOL_SIZE готовых инвайтов (invite_logs.status='pool'), принятие только
+# забирает строку из БД. Пул пополняется раз в INVITE_POOL_REFILL_INTERVAL_SECONDS
+# и сразу после каждой выдачи. Инвайт, пролежавший в пуле дольше
+# INVITE_POOL_MAX_IDLE_SECONDS или удалённый вручную, отзывается и заменяется.
+# Пустой пул — создаём инвайт сразу, как раньше.
+# Выданный инвайт (claimed), который за INVITE_CLAIM_GRACE_SECONDS так и не дошёл до
+# DM (шаг решения не выполнился), отзывается при пополнении. Все смены статуса
+# условные (db_transition_invite), поэтому отзыв не заденет только что выданный инвайт.
+# Срок действия у инвайтов из пула разный — в DM пишем точное время истечения.
+# Канал для инвайтов выбирается один раз и кэшируется до изменения каналов/ролей
+# приватки (см. forget_invite_channel в events.py) или ответа 403.
+# Метрики: invite_pool.*
+
+_invite_channel_id: int | None = None
+_pool_wanted = asyncio.Event()
+
+
+def private_invite_url(code: str) -> str:
+    return f"https://discord.gg/{code}"
+
+
+def forget_invite_channel() -> None:
+    global _invite_channel_id
+    _invite_channel_id = None
+
+
+def _invite_channel(guild: discord.Guild) -> discord.abc.GuildChannel | None:
+    """Канал, в котором бот может создавать инвайты (кэшируется)."""
+    global _invite_channel_id
+    if _invite_channel_id is not None:
+        cached = guild.get_channel(_invite_channel_id)
+        if cached is not None:
+            return cached
+        _invite_channel_id = None
+
+    metrics.inc("invite_pool.channel_lookups")
     me = guild.get_member(client.user.id) if client.user else None
 
     def _can_create(ch: discord.abc.GuildChannel) -> bool:
@@ -225,6 +285,9 @@ async def create_one_time_private_invite(
         perms = ch.permissions_for(me)
         return perms.create_instant_invite and perms.view_channel
 
+    # Пробуем создать инвайт в заданном канале, иначе ищем первый доступный текстовый канал
+    target_channel = guild.get_channel(PRIVATE_SETUP_CHANNEL_ID)
+    invite_channel: discord.abc.GuildChannel | None = None
     if isinstance(target_channel, (discord.TextChannel, discord.VoiceChannel, discord.StageChannel)):
         if _can_create(target_channel):
             invite_channel = target_channel
@@ -239,21 +302,150 @@ async def create_one_time_private_invite(
             except Exception:
                 continue
 
+    if invite_channel is not None:
+        _invite_channel_id = invite_channel.id
+    return invite_channel
+
+
+async def _create_invite(guild: discord.Guild, max_age: int, reason: str, priority: str) -> discord.Invite | None:
+    invite_channel = _invite_channel(guild)
     if invite_channel is None:
         return None
-
     try:
-        invite = await invite_channel.create_invite(
-            max_age=PRIVATE_INVITE_MAX_AGE_SECONDS,
-            max_uses=PRIVATE_INVITE_MAX_USES,
-            unique=True,
-            reason=f"[SH] one-time privatka invite for user {opener.id} by {getattr(moderator, 'id', 0)}",
+        return await rest_call(
+            "invite.create",
+            lambda: invite_channel.create_invite(
+                max_age=max_age,
+                max_uses=PRIVATE_INVITE_MAX_USES,
+                unique=True,
+                reason=reason,
+            ),
+            priority=priority,
         )
-        expires_at = int(time.time()) + int(PRIVATE_INVITE_MAX_AGE_SECONDS)
+    except discord.Forbidden:
+        forget_invite_channel()  # права на канал поменялись — в следующий раз выберем заново
+        return None
+    except discord.HTTPException:
+        return None
+
+
+async def create_one_time_private_invite(
+    *,
+    opener: discord.abc.User,
+    moderator: discord.Member | discord.User,
+) -> tuple[str, int] | None:
+    """Персональный инвайт в приватку (1 использование): из пула, иначе создаём сразу.
+    Возвращает (код, expires_at unix)."""
+    moderator_id = getattr(moderator, "id", 0)
+    # инвайт из пула должен действовать у игрока не меньше обычного срока
+    valid_until = int(time.time()) + int(PRIVATE_INVITE_MAX_AGE_SECONDS)
+    claimed = await db_claim_pool_invite(opener.id, moderator_id, valid_until)
+    _pool_wanted.set()
+    if claimed is not None:
+        metrics.inc("invite_pool.claimed")
+        return claimed
+
+    metrics.inc("invite_pool.empty")
+    guild = client.get_guild(PRIVATE_GUILD_ID)
+    if guild is None:
+        return None
+    invite = await _create_invite(
+        guild,
+        PRIVATE_INVITE_MAX_AGE_SECONDS,
+        f"[SH] one-time privatka invite for user {opener.id} by {moderator_id}",
+        PRIORITY_USER,
+    )
+    if invite is None:
+        return None
+    expires_at = int(time.time()) + int(PRIVATE_INVITE_MAX_AGE_SECONDS)
+    try:
+        await db_log_invite(invite.code, opener.id, moderator_id, invite.channel.id, expires_at)
+    except Exception:
+        pass
+    return invite.code, expires_at
+
+
+async def refresh_invite_claim(code: str) -> bool:
+    """Перед отправкой ссылки. False — инвайт уже отозван (нужен новый)."""
+    return await db_refresh_invite_claim(code)
+
+
+async def mark_invite_delivered(code: str) -> bool:
+    """Отмечает, что ссылка ушла игроку (только после успешной отправки)."""
+    return await db_transition_invite(code, (INVITE_CLAIMED, INVITE_DELIVERED), INVITE_DELIVERED)
+
+
+async def revoke_private_invite(code: str, from_statuses: tuple[str, ...] = (INVITE_POOL,)) -> bool:
+    """Отзывает инвайт, если его статус всё ещё один из from_statuses: сначала строка
+    в БД (условно), и только потом удаление в Discord. True — инвайт отозван."""
+    if not await db_transition_invite(code, from_statuses, INVITE_REVOKED):
+        return False
+    try:
+        await rest_call("invite.delete", lambda: client.delete_invite(code), priority=PRIORITY_BACKGROUND)
+    except discord.NotFound:
+        pass
+    except discord.HTTPException as e:
+        # строка уже revoked, никому не выдаётся; инвайт просто доживёт до истечения
+        print(f"[InvitePool] revoke {code} FAILED: {type(e).__name__}: {e}")
+    metrics.inc("invite_pool.revoked")
+    return True
+
+
+async def refill_invite_pool() -> int:
+    """Заменяет устаревшие инвайты пула и добирает его до INVITE_POOL_SIZE. Возвращает размер пула."""
+    guild = client.get_guild(PRIVATE_GUILD_ID)
+    if guild is None:
+        return 0
+    now = int(time.time())
+    pool = await db_list_invites(INVITE_POOL)
+
+    # инвайты, удалённые вручную, видны только со списком инвайтов сервера (Manage Server)
+    live: set[str] | None
+    try:
+        live = {inv.code for inv in await rest_call("guild.invites", guild.invites, priority=PRIORITY_BACKGROUND)}
+    except discord.HTTPException:
+        live = None
+
+    stale = [
+        code
+        for code, created_at in pool
+        if created_at < now - INVITE_POOL_MAX_IDLE_SECONDS or (live is not None and code not in live)
+    ]
+    revoked = 0
+    for code in stale:
+        revoked += await revoke_private_invite(code)
+    # выданные, но так и не отправленные игроку
+    for code, claimed_at in await db_list_invites(INVITE_CLAIMED):
+        if claimed_at < now - INVITE_CLAIM_GRACE_SECONDS:
+            revoked += await revoke_private_invite(code, (INVITE_CLAIMED,))
+
+    # пока шли REST-запросы, часть пула могли выдать — считаем заново
+    size = len(await db_list_invites(INVITE_POOL))
+    max_age = int(PRIVATE_INVITE_MAX_AGE_SECONDS) + int(INVITE_POOL_MAX_IDLE_SECONDS)
+    created = 0
+    while size < INVITE_POOL_SIZE:
+        invite = await _create_invite(guild, max_age, "[SH] privatka invite pool", PRIORITY_BACKGROUND)
+        if invite is None:
+            break
+        await db_add_pool_invite(invite.code, invite.channel.id, int(time.time()) + max_age)
+        size += 1
+        created += 1
+
+    metrics.set_value("invite_pool.size", size)
+    if revoked or created:
+        print(f"[InvitePool] size={size} created={created} revoked={revoked}")
+    return size
+
+
+async def invite_pool_loop() -> None:
+    await client.wait_until_ready()
+    while True:
+        _pool_wanted.clear()
+        try:
+            await refill_invite_pool()
+        except Exception as e:
+            print(f"[InvitePool] FAILED: {type(e).__name__}: {e}")
         try:
-            db_log_invite(invite.code, opener.id, getattr(moderator, "id", 0), invite_channel.id, expires_at)
-        except Exception:
+            await asyncio.wait_for(_pool_wanted.wait(), timeout=INVITE_POOL_REFILL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
             pass
-        return invite
-    except (discord.Forbidden, discord.HTTPException):
-        return None
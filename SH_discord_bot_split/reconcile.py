@@ -0,0 +1,153 @@
+# reconcile.py
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+import discord
+
+import metrics
+from app import client
+from config import TICKETS_CATEGORY_ID, RECONCILE_CONCURRENCY, RECONCILE_HISTORY_LIMIT
+from db_async import db_get_opener, db_set_opener, db_get_prompt, db_set_prompt
+from helpers import message_contains_trigger
+from maintenance import guild_cache_complete, delete_orphan_ticket_rows
+from tickets import (
+    track_opener_from_channel,
+    resolve_ticket_opener_fallback,
+    is_ignored_ticket_opener_id,
+    is_ignored_ticket_opener_member,
+)
+
+
+# ==========================================================
+#                 STARTUP RECONCILIATION
+# ==========================================================
+# Пока бот был выключен, Ticket Tool мог создать/удалить тикеты. После старта:
+#   1) удаляем строки tickets/prompts каналов, которых больше нет;
+#   2) по каждому каналу TICKETS_CATEGORY_ID (не больше RECONCILE_CONCURRENCY сразу):
+#      - нет opener в БД -> overwrites/topic, затем фоллбек с историей канала;
+#      - нет панели в БД -> ищем в последних сообщениях нашу панель (запоминаем)
+#        или фразу-триггер после неё (отправляем панель через post_prompt).
+# Тогда первый клик модератора после рестарта не платит за поиск opener.
+# Метрики: reconcile.*; прогресс и итог — в лог "[Reconcile] ...".
+
+# custom_id кнопки "Принять" из ui.TicketDecisionView — по нему узнаём нашу панель
+_PROMPT_BUTTON_ID = "sh_accept_with_reason"
+
+PostPrompt = Callable[[discord.TextChannel, int], Awaitable[None]]
+
+
+def _ticket_channels() -> list[discord.TextChannel]:
+    return [
+        ch
+        for g in client.guilds
+        for ch in g.text_channels
+        if ch.category_id == TICKETS_CATEGORY_ID
+    ]
+
+
+def _is_our_prompt(msg: discord.Message) -> bool:
+    if not (client.user and msg.author.id == client.user.id):
+        return False
+    return any(
+        getattr(child, "custom_id", None) == _PROMPT_BUTTON_ID
+        for row in msg.components
+        for child in getattr(row, "children", ())
+    )
+
+
+def _is_trigger_message(msg: discord.Message) -> bool:
+    if client.user and msg.author.id == client.user.id:
+        return False
+    if not (msg.author.bot or msg.webhook_id is not None):
+        return False
+    return message_contains_trigger(msg)
+
+
+async def _reconcile_opener(channel: discord.TextChannel) -> str:
+    if await db_get_opener(channel.id) is not None:
+        return "known"
+    if await track_opener_from_channel(channel) is not None:
+        return "cheap"
+    opener = await resolve_ticket_opener_fallback(channel)
+    if opener is None:
+        return "missing"
+    if isinstance(opener, discord.Member):
+        if is_ignored_ticket_opener_member(opener):
+            return "missing"
+    elif is_ignored_ticket_opener_id(opener.id):
+        return "missing"
+    await db_set_opener(channel.id, opener.id)
+    return "resolved"
+
+
+async def _reconcile_prompt(channel: discord.TextChannel, post_prompt: PostPrompt) -> str:
+    if await db_get_prompt(channel.id) is not None:
+        return "known"
+    # от новых к старым: что встретится первым — панель или триггер после неё
+    async for msg in channel.history(limit=RECONCILE_HISTORY_LIMIT):
+        if _is_our_prompt(msg):
+            await db_set_prompt(channel.id, msg.id, int(msg.created_at.timestamp()))
+            return "found"
+        if _is_trigger_message(msg):
+            await post_prompt(channel, msg.id)
+            return "posted"
+    return "none"
+
+
+async def _reconcile_channel(
+    channel: discord.TextChannel,
+    post_prompt: PostPrompt,
+    sem: asyncio.Semaphore,
+    stats: dict[str, int],
+) -> None:
+    async with sem:
+        try:
+            stats[f"opener_{await _reconcile_opener(channel)}"] += 1
+            stats[f"prompt_{await _reconcile_prompt(channel, post_prompt)}"] += 1
+        except Exception as e:
+            # один сломанный канал (не только HTTP-ошибка) не должен прерывать сверку остальных
+            stats["failed"] += 1
+            print(f"[Reconcile] channel={channel.id} FAILED: {type(e).__name__}: {e}")
+        stats["done"] += 1
+        if stats["done"] % 25 == 0:
+            print(f"[Reconcile] progress {stats['done']}/{stats['channels']}")
+
+
+async def reconcile_tickets(post_prompt: PostPrompt) -> dict[str, int]:
+    await client.wait_until_ready()
+    started = time.perf_counter()
+    stats = dict.fromkeys(
+        (
+            "channels", "done", "failed", "stale_tickets", "stale_prompts",
+            "opener_known", "opener_cheap", "opener_resolved", "opener_missing",
+            "prompt_known", "prompt_found", "prompt_posted", "prompt_none",
+        ),
+        0,
+    )
+
+    if guild_cache_complete():
+        stats["stale_tickets"], stats["stale_prompts"] = await delete_orphan_ticket_rows()
+
+    channels = _ticket_channels()
+    stats["channels"] = len(channels)
+    print(f"[Reconcile] start: {len(channels)} ticket channels, concurrency={RECONCILE_CONCURRENCY}")
+
+    sem = asyncio.Semaphore(max(1, RECONCILE_CONCURRENCY))
+    results = await asyncio.gather(
+        *(_reconcile_channel(ch, post_prompt, sem, stats) for ch in channels), return_exceptions=True
+    )
+    for channel, result in zip(channels, results):
+        if isinstance(result, BaseException):
+            stats["failed"] += 1
+            print(f"[Reconcile] channel={channel.id} FAILED: {type(result).__name__}: {result}")
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    for key, value in stats.items():
+        metrics.set_value(f"reconcile.{key}", value)
+    metrics.set_value("reconcile.duration_ms", int(elapsed_ms))
+    print(
+        "[Reconcile] done in "
+        f"{elapsed_ms:.0f} ms: " + " ".join(f"{k}={v}" for k, v in stats.items() if k != "done")
+    )
+    return stats
@@ -0,0 +1,207 @@
+# rest.py
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+import aiohttp
+import discord
+
+import metrics
+from config import (
+    REST_RETRY_BASE_DELAY,
+    REST_RETRY_MAX_DELAY,
+    REST_RETRY_DEADLINE_SECONDS,
+    REST_INTERACTION_DEADLINE_SECONDS,
+    REST_LIMIT_INTERACTIVE,
+    REST_LIMIT_USER,
+    REST_LIMIT_BACKGROUND,
+)
+
+T = TypeVar("T")
+
+
+# ==========================================================
+#                  REST CALLS (retry/backoff)
+# ==========================================================
+# Все REST-вызовы Discord идут через rest_call(route, lambda: ...):
+#   - повторяем 5xx, 429 (discord.RateLimited / HTTP 429) и обрывы сети;
+#   - 403/404 и прочие 4xx — сразу пробрасываем (повтор не поможет);
+#   - задержка: base * 2^попытка, не больше max, со случайным разбросом 50..100%;
+#     если Discord прислал retry_after — ждём не меньше него;
+#   - не выходим за дедлайн: если следующая пауза его перескакивает —
+#     пробрасываем последнюю ошибку.
+# Неидемпотентные вызовы (отправка сообщений/DM, ответы на interaction) —
+# idempotent=False: 5xx или таймаут не значит, что сообщение не ушло, поэтому
+# повторяем только 429 и отказ в соединении (запрос точно не дошёл до Discord).
+# discord.py сам повторяет часть 5xx/429 внутри одного вызова; здесь — внешний
+# уровень с общим дедлайном. Ошибки пробрасываются как есть, так что обработка
+# Forbidden/NotFound/HTTPException в вызывающем коде не меняется.
+# Метрики (только из event loop): rest.<route>.attempts/.retries/.failed + время rest.<route>.*
+
+# ---- приоритеты ----
+# Все вызовы делят одни и те же rate-limit бакеты discord.py, поэтому при пачке
+# принятий лог-канал (send + реакция) и закрепы не должны задерживать ответы на
+# interaction (3 секунды) и DM игрокам. Каждая попытка вызова занимает слот своего
+# класса (паузы между повторами — без слота):
+#   interactive — ответы на interaction / модалки;
+#   user        — то, что видят игроки: DM, панель, роли, инвайты, удаление канала;
+#   background  — лог-канал, реакции, закрепы.
+# У класса свой лимит одновременных вызовов; background стартует только
+# если interactive и user никого не ждут.
+# Метрики: rest.queue.<class>.depth/.active (текущие), .max_depth, .queued, время ожидания rest.queue.<class>.wait.*
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_USER = "user"
+PRIORITY_BACKGROUND = "background"
+
+
+class _PriorityClass:
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.active = 0
+        self.waiters: deque[asyncio.Future] = deque()
+
+    def publish(self) -> None:
+        metrics.set_value(f"rest.queue.{self.name}.depth", len(self.waiters))
+        metrics.set_value(f"rest.queue.{self.name}.active", self.active)
+        if len(self.waiters) > metrics.get(f"rest.queue.{self.name}.max_depth"):
+            metrics.set_value(f"rest.queue.{self.name}.max_depth", len(self.waiters))
+
+
+# в порядке приоритета
+_classes: dict[str, _PriorityClass] = {
+    PRIORITY_INTERACTIVE: _PriorityClass(PRIORITY_INTERACTIVE, REST_LIMIT_INTERACTIVE),
+    PRIORITY_USER: _PriorityClass(PRIORITY_USER, REST_LIMIT_USER),
+    PRIORITY_BACKGROUND: _PriorityClass(PRIORITY_BACKGROUND, REST_LIMIT_BACKGROUND),
+}
+
+
+def _may_start(cls: _PriorityClass) -> bool:
+    if cls.active >= cls.limit:
+        return False
+    if cls.name == PRIORITY_BACKGROUND:
+        return not any(c.waiters for c in _classes.values() if c is not cls)
+    return True
+
+
+def _wake() -> None:
+    for cls in _classes.values():
+        while cls.waiters and _may_start(cls):
+            fut = cls.waiters.popleft()
+            if fut.done():
+                continue  # ожидающий отменён
+            cls.active += 1
+            fut.set_result(None)
+        cls.publish()
+
+
+async def _acquire(cls: _PriorityClass) -> None:
+    if not cls.waiters and _may_start(cls):
+        cls.active += 1
+        cls.publish()
+        return
+    started = time.monotonic()
+    fut = asyncio.get_running_loop().create_future()
+    cls.waiters.append(fut)
+    metrics.inc(f"rest.queue.{cls.name}.queued")
+    cls.publish()
+    try:
+        await fut
+    except asyncio.CancelledError:
+        if fut.done() and not fut.cancelled():
+            _release(cls)  # слот уже выдан, но вызывающий отменён
+        else:
+            try:
+                cls.waiters.remove(fut)
+            except ValueError:
+                pass
+            cls.publish()
+        raise
+    metrics.observe(f"rest.queue.{cls.name}.wait", time.monotonic() - started)
+
+
+def _release(cls: _PriorityClass) -> None:
+    cls.active -= 1
+    _wake()
+
+
+def scheduler_stats() -> dict[str, int]:
+    return {
+        f"{cls.name}.{key}": value
+        for cls in _classes.values()
+        for key, value in (("active", cls.active), ("depth", len(cls.waiters)), ("limit", cls.limit))
+    }
+
+
+# ретраи по 403 для мест, где права появляются с задержкой (свежий тикет-канал)
+RETRY_FORBIDDEN: tuple[type[BaseException], ...] = (discord.Forbidden,)
+
+
+def _retry_after(exc: BaseException, idempotent: bool = True) -> float | None:
+    """Сколько Discord просит подождать (сек) или None, если ошибку повторять нельзя."""
+    if isinstance(exc, discord.RateLimited):
+        return exc.retry_after
+    if isinstance(exc, discord.HTTPException):
+        if exc.status == 429:
+            try:
+                return float(exc.response.headers.get("Retry-After", 0))
+            except (AttributeError, TypeError, ValueError):
+                return 0.0
+        if exc.status >= 500 and idempotent:
+            return 0.0
+        return None
+    # соединение не установлено — запрос не отправлен, повтор безопасен всегда
+    if isinstance(exc, aiohttp.ClientConnectorError):
+        return 0.0
+    if idempotent and isinstance(exc, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return 0.0
+    return None
+
+
+async def rest_call(
+    route: str,
+    call: Callable[[], Awaitable[T]],
+    *,
+    deadline: float = REST_RETRY_DEADLINE_SECONDS,
+    retry_on: tuple[type[BaseException], ...] = (),
+    priority: str = PRIORITY_USER,
+    idempotent: bool = True,
+) -> T:
+    """Выполняет call() с повторами; route — имя для метрик ("channel.send", "member.roles"...)."""
+    cls = _classes[priority]
+    started = time.monotonic()
+    attempt = 0
+    try:
+        while True:
+            metrics.inc(f"rest.{route}.attempts")
+            await _acquire(cls)
+            try:
+                return await call()
+            except Exception as e:
+                wait = 0.0 if retry_on and isinstance(e, retry_on) else _retry_after(e, idempotent)
+                if wait is None:
+                    metrics.inc(f"rest.{route}.failed")
+                    raise
+                backoff = min(REST_RETRY_MAX_DELAY, REST_RETRY_BASE_DELAY * 2 ** attempt)
+                delay = max(wait, backoff * random.uniform(0.5, 1.0))
+                if time.monotonic() - started + delay > deadline:
+                    metrics.inc(f"rest.{route}.failed")
+                    raise
+                attempt += 1
+                metrics.inc(f"rest.{route}.retries")
+                print(f"[REST] {route}: {type(e).__name__} ({getattr(e, 'status', '-')}), retry #{attempt} in {delay:.1f}s")
+            finally:
+                _release(cls)
+            await asyncio.sleep(delay)
+    finally:
+        metrics.observe(f"rest.{route}", time.monotonic() - started)
+
+
+async def interaction_call(route: str, call: Callable[[], Awaitable[T]]) -> T:
+    """Ответ на interaction: у токена 3 секунды, поэтому короткий дедлайн. Повтор после
+    5xx дал бы "interaction already acknowledged", поэтому как неидемпотентный вызов."""
+    return await rest_call(
+        route, call, deadline=REST_INTERACTION_DEADLINE_SECONDS, priority=PRIORITY_INTERACTIVE, idempotent=False
+    )
@@ -0,0 +1,455 @@
+# storage.py
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import db
+from config import STORAGE_BACKEND
+
+# ==========================================================
+#                    STORAGE BACKENDS
+# ==========================================================
+# Интерфейс хранилища для tickets, prompts, private_setup, ignored_users и invite_logs.
+# db_async.py работает только через него, поэтому бэкенд выбирается конфигом:
+#   - "sqlite" — боевой вариант (функции из db.py);
+#   - "memory" — всё в dict-ах процесса, без диска: для нагрузочных тестов,
+#     replay-скриптов и бенчмарков обработчиков.
+# Методы синхронные: db_async вызывает их из своих потоков (писатель/читатели).
+# Storage — ABC: бэкенд, в котором забыли метод, не создастся (TypeError в create_storage),
+# а не упадёт NotImplementedError посреди работы.
+
+
+class Storage(ABC):
+    name = "base"
+    supports_backup = False
+
+    @abstractmethod
+    def init(self) -> None:
+        ...
+
+    @abstractmethod
+    def close(self) -> None:
+        ...
+
+    # -------------------- TICKETS / PROMPTS --------------------
+
+    @abstractmethod
+    def write_batch(self, tickets: list[tuple[int, int, int]], prompts: list[tuple[int, int, int]]) -> None:
+        ...
+
+    @abstractmethod
+    def load_ticket_state(self) -> dict[int, tuple[int | None, int | None, int | None]]:
+        ...
+
+    @abstractmethod
+    def get_opener(self, channel_id: int) -> int | None:
+        ...
+
+    @abstractmethod
+    def delete_ticket(self, channel_id: int) -> None:
+        ...
+
+    @abstractmethod
+    def get_prompt(self, channel_id: int) -> int | None:
+        ...
+
+    @abstractmethod
+    def delete_prompt(self, channel_id: int) -> None:
+        ...
+
+    @abstractmethod
+    def list_ticket_channels(self) -> list[tuple[int, int]]:
+        ...
+
+    @abstractmethod
+    def delete_ticket_channels(self, channel_ids: list[int]) -> tuple[int, int]:
+        ...
+
+    # -------------------- PRIVATE SETUP --------------------
+
+    @abstractmethod
+    def set_private_setup_message(self, channel_id: int, message_id: int) -> None:
+        ...
+
+    @abstractmethod
+    def get_private_setup_message(self, channel_id: int) -> int | None:
+        ...
+
+    @abstractmethod
+    def delete_private_setup_message(self, channel_id: int) -> None:
+        ...
+
+    # -------------------- IGNORE USERS --------------------
+
+    @abstractmethod
+    def add_ignored_user(self, user_id: int, added_by: int) -> None:
+        ...
+
+    @abstractmethod
+    def remove_ignored_user(self, user_id: int) -> bool:
+        ...
+
+    @abstractmethod
+    def list_ignored_users(self) -> list[int]:
+        ...
+
+    # -------------------- INVITE LOGS --------------------
+
+    @abstractmethod
+    def log_invite(self, invite_code: str, user_id: int, moderator_id: int, channel_id: int, expires_at: int) -> None:
+        ...
+
+    @abstractmethod
+    def delete_expired_invites(self, expired_before: int, limit: int) -> int:
+        ...
+
+    @abstractmethod
+    def add_pool_invite(self, invite_code: str, channel_id: int, expires_at: int) -> None:
+        ...
+
+    @abstractmethod
+    def claim_pool_invite(self, user_id: int, moderator_id: int, valid_until: int) -> tuple[str, int] | None:
+        ...
+
+    @abstractmethod
+    def list_invites(self, status: str) -> list[tuple[str, int]]:
+        ...
+
+    @abstractmethod
+    def transition_invite(self, invite_code: str, from_statuses: tuple[str, ...], to_status: str) -> bool:
+        ...
+
+    @abstractmethod
+    def refresh_invite_claim(self, invite_code: str) -> bool:
+        ...
+
+    # -------------------- DECISION JOBS --------------------
+
+    @abstractmethod
+    def create_decision_job(self, guild_id: int, channel_id: int, decision: str, moderator_id: int, reason: str) -> int | None:
+        ...
+
+    @abstractmethod
+    def update_decision_job(self, job_id: int, state_json: str, done_steps: str, status: str, attempts: int) -> None:
+        ...
+
+    @abstractmethod
+    def list_unfinished_decision_jobs(self) -> list[db.DecisionJobRow]:
+        ...
+
+    @abstractmethod
+    def delete_finished_decision_jobs(self, finished_before: int, limit: int) -> int:
+        ...
+
+    # -------------------- MAINTENANCE --------------------
+
+    def incremental_vacuum(self, max_pages: int) -> int:
+        return 0
+
+    def backup_to(self, dest_path: str, pages_per_step: int, sleep_seconds: float) -> None:
+        raise NotImplementedError(f"storage backend {self.name!r} не поддерживает бэкапы")
+
+    @abstractmethod
+    def log_backup(self, path: str, duration_ms: int, db_size_bytes: int, archive_size_bytes: int) -> None:
+        ...
+
+
+class SQLiteStorage(Storage):
+    name = "sqlite"
+    supports_backup = True
+
+    def init(self) -> None:
+        db.db_init()
+
+    def close(self) -> None:
+        db.db_close()
+
+    def write_batch(self, tickets: list[tuple[int, int, int]], prompts: list[tuple[int, int, int]]) -> None:
+        db.db_write_batch(tickets, prompts)
+
+    def load_ticket_state(self) -> dict[int, tuple[int | None, int | None, int | None]]:
+        return db.db_load_ticket_state()
+
+    def get_opener(self, channel_id: int) -> int | None:
+        return db.db_get_opener(channel_id)
+
+    def delete_ticket(self, channel_id: int) -> None:
+        db.db_delete_ticket(channel_id)
+
+    def get_prompt(self, channel_id: int) -> int | None:
+        return db.db_get_prompt(channel_id)
+
+    def delete_prompt(self, channel_id: int) -> None:
+        db.db_delete_prompt(channel_id)
+
+    def list_ticket_channels(self) -> list[tuple[int, int]]:
+        return db.db_list_ticket_channels()
+
+    def delete_ticket_channels(self, channel_ids: list[int]) -> tuple[int, int]:
+        return db.db_delete_ticket_channels(channel_ids)
+
+    def set_private_setup_message(self, channel_id: int, message_id: int) -> None:
+        db.db_set_private_setup_message(channel_id, message_id)
+
+    def get_private_setup_message(self, channel_id: int) -> int | None:
+        return db.db_get_private_setup_message(channel_id)
+
+    def delete_private_setup_message(self, channel_id: int) -> None:
+        db.db_delete_private_setup_message(channel_id)
+
+    def add_ignored_user(self, user_id: int, added_by: int) -> None:
+        db.db_add_ignored_user(user_id, added_by)
+
+    def remove_ignored_user(self, user_id: int) -> bool:
+        return db.db_remove_ignored_user(user_id)
+
+    def list_ignored_users(self) -> list[int]:
+        return db.db_list_ignored_users()
+
+    def log_invite(self, invite_code: str, user_id: int, moderator_id: int, channel_id: int, expires_at: int) -> None:
+        db.db_log_invite(invite_code, user_id, moderator_id, channel_id, expires_at)
+
+    def delete_expired_invites(self, expired_before: int, limit: int) -> int:
+        return db.db_delete_expired_invites(expired_before, limit)
+
+    def add_pool_invite(self, invite_code: str, channel_id: int, expires_at: int) -> None:
+        db.db_add_pool_invite(invite_code, channel_id, expires_at)
+
+    def claim_pool_invite(self, user_id: int, moderator_id: int, valid_until: int) -> tuple[str, int] | None:
+        return db.db_claim_pool_invite(user_id, moderator_id, valid_until)
+
+    def list_invites(self, status: str) -> list[tuple[str, int]]:
+        return db.db_list_invites(status)
+
+    def transition_invite(self, invite_code: str, from_statuses: tuple[str, ...], to_status: str) -> bool:
+        return db.db_transition_invite(invite_code, from_statuses, to_status)
+
+    def refresh_invite_claim(self, invite_code: str) -> bool:
+        return db.db_refresh_invite_claim(invite_code)
+
+    def create_decision_job(self, guild_id: int, channel_id: int, decision: str, moderator_id: int, reason: str) -> int | None:
+        return db.db_create_decision_job(guild_id, channel_id, decision, moderator_id, reason)
+
+    def update_decision_job(self, job_id: int, state_json: str, done_steps: str, status: str, attempts: int) -> None:
+        db.db_update_decision_job(job_id, state_json, done_steps, status, attempts)
+
+    def list_unfinished_decision_jobs(self) -> list[db.DecisionJobRow]:
+        return db.db_list_unfinished_decision_jobs()
+
+    def delete_finished_decision_jobs(self, finished_before: int, limit: int) -> int:
+        return db.db_delete_finished_decision_jobs(finished_before, limit)
+
+    def incremental_vacuum(self, max_pages: int) -> int:
+        return db.db_incremental_vacuum(max_pages)
+
+    def backup_to(self, dest_path: str, pages_per_step: int, sleep_seconds: float) -> None:
+        db.db_backup_to(dest_path, pages_per_step, sleep_seconds)
+
+    def log_backup(self, path: str, duration_ms: int, db_size_bytes: int, archive_size_bytes: int) -> None:
+        db.db_log_backup(path, duration_ms, db_size_bytes, archive_size_bytes)
+
+
+class MemoryStorage(Storage):
+    """Всё в памяти процесса; данные теряются при остановке."""
+
+    name = "memory"
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._tickets: dict[int, tuple[int, int]] = {}  # channel_id -> (opener_id, created_at)
+        self._prompts: dict[int, tuple[int, int]] = {}  # channel_id -> (message_id, created_at)
+        self._private_setup: dict[int, int] = {}
+        self._ignored: dict[int, tuple[int, int]] = {}  # user_id -> (added_by, added_at)
+        # invite_code -> (user_id, moderator_id, channel_id, created_at, expires_at, status)
+        self._invites: dict[str, tuple[int, int, int, int, int, str]] = {}
+        self._backups: list[tuple[int, str, int, int, int]] = []
+        # job_id -> [guild_id, channel_id, decision, moderator_id, reason, state, done_steps, status, attempts, updated_at]
+        self._decision_jobs: dict[int, list] = {}
+        self._next_job_id = 1
+
+    def init(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def write_batch(self, tickets: list[tuple[int, int, int]], prompts: list[tuple[int, int, int]]) -> None:
+        with self._lock:
+            for channel_id, opener_id, created_at in tickets:
+                self._tickets[channel_id] = (opener_id, created_at)
+            for channel_id, message_id, created_at in prompts:
+                self._prompts[channel_id] = (message_id, created_at)
+
+    def load_ticket_state(self) -> dict[int, tuple[int | None, int | None, int | None]]:
+        with self._lock:
+            state: dict[int, tuple[int | None, int | None, int | None]] = {
+                cid: (opener_id, None, None) for cid, (opener_id, _) in self._tickets.items()
+            }
+            for cid, (message_id, created_at) in self._prompts.items():
+                state[cid] = (state.get(cid, (None, None, None))[0], message_id, created_at)
+            return state
+
+    def get_opener(self, channel_id: int) -> int | None:
+        with self._lock:
+            row = self._tickets.get(channel_id)
+            return row[0] if row else None
+
+    def delete_ticket(self, channel_id: int) -> None:
+        with self._lock:
+            self._tickets.pop(channel_id, None)
+
+    def get_prompt(self, channel_id: int) -> int | None:
+        with self._lock:
+            row = self._prompts.get(channel_id)
+            return row[0] if row else None
+
+    def delete_prompt(self, channel_id: int) -> None:
+        with self._lock:
+            self._prompts.pop(channel_id, None)
+
+    def list_ticket_channels(self) -> list[tuple[int, int]]:
+        with self._lock:
+            latest: dict[int, int] = {}
+            for table in (self._tickets, self._prompts):
+                for cid, (_, created_at) in table.items():
+                    latest[cid] = max(created_at, latest.get(cid, created_at))
+            return list(latest.items())
+
+    def delete_ticket_channels(self, channel_ids: list[int]) -> tuple[int, int]:
+        with self._lock:
+            tickets = sum(1 for cid in channel_ids if self._tickets.pop(cid, None) is not None)
+            prompts = sum(1 for cid in channel_ids if self._prompts.pop(cid, None) is not None)
+            return tickets, prompts
+
+    def set_private_setup_message(self, channel_id: int, message_id: int) -> None:
+        with self._lock:
+            self._private_setup[channel_id] = message_id
+
+    def get_private_setup_message(self, channel_id: int) -> int | None:
+        with self._lock:
+            return self._private_setup.get(channel_id)
+
+    def delete_private_setup_message(self, channel_id: int) -> None:
+        with self._lock:
+            self._private_setup.pop(channel_id, None)
+
+    def add_ignored_user(self, user_id: int, added_by: int) -> None:
+        with self._lock:
+            self._ignored.setdefault(user_id, (added_by, int(time.time())))
+
+    def remove_ignored_user(self, user_id: int) -> bool:
+        with self._lock:
+            return self._ignored.pop(user_id, None) is not None
+
+    def list_ignored_users(self) -> list[int]:
+        with self._lock:
+            return [uid for uid, _ in sorted(self._ignored.items(), key=lambda kv: kv[1][1])]
+
+    def log_invite(self, invite_code: str, user_id: int, moderator_id: int, channel_id: int, expires_at: int) -> None:
+        with self._lock:
+            self._invites[invite_code] = (
+                user_id, moderator_id, channel_id, int(time.time()), expires_at, db.INVITE_CLAIMED
+            )
+
+    def delete_expired_invites(self, expired_before: int, limit: int) -> int:
+        with self._lock:
+            expired = [code for code, row in self._invites.items() if row[4] < expired_before][:limit]
+            for code in expired:
+                del self._invites[code]
+            return len(expired)
+
+    def add_pool_invite(self, invite_code: str, channel_id: int, expires_at: int) -> None:
+        with self._lock:
+            self._invites[invite_code] = (0, 0, channel_id, int(time.time()), expires_at, db.INVITE_POOL)
+
+    def claim_pool_invite(self, user_id: int, moderator_id: int, valid_until: int) -> tuple[str, int] | None:
+        with self._lock:
+            pool = [
+                (row[3], code)
+                for code, row in self._invites.items()
+                if row[5] == db.INVITE_POOL and row[4] >= valid_until
+            ]
+            if not pool:
+                return None
+            code = min(pool)[1]
+            channel_id, expires_at = self._invites[code][2], self._invites[code][4]
+            self._invites[code] = (
+                user_id, moderator_id, channel_id, int(time.time()), expires_at, db.INVITE_CLAIMED
+            )
+            return code, expires_at
+
+    def list_invites(self, status: str) -> list[tuple[str, int]]:
+        with self._lock:
+            return sorted(
+                ((code, row[3]) for code, row in self._invites.items() if row[5] == status),
+                key=lambda item: item[1],
+            )
+
+    def transition_invite(self, invite_code: str, from_statuses: tuple[str, ...], to_status: str) -> bool:
+        with self._lock:
+            row = self._invites.get(invite_code)
+            if row is None or row[5] not in from_statuses:
+                return False
+            self._invites[invite_code] = row[:5] + (to_status,)
+            return True
+
+    def refresh_invite_claim(self, invite_code: str) -> bool:
+        with self._lock:
+            row = self._invites.get(invite_code)
+            if row is None or row[5] not in (db.INVITE_CLAIMED, db.INVITE_DELIVERED):
+                return False
+            if row[5] == db.INVITE_CLAIMED:
+                self._invites[invite_code] = row[:3] + (int(time.time()),) + row[4:]
+            return True
+
+    def create_decision_job(self, guild_id: int, channel_id: int, decision: str, moderator_id: int, reason: str) -> int | None:
+        with self._lock:
+            if any(j[1] == channel_id and j[7] == "pending" for j in self._decision_jobs.values()):
+                return None
+            job_id = self._next_job_id
+            self._next_job_id += 1
+            self._decision_jobs[job_id] = [
+                guild_id, channel_id, decision, moderator_id, reason, "{}", "", "pending", 0, int(time.time())
+            ]
+            return job_id
+
+    def update_decision_job(self, job_id: int, state_json: str, done_steps: str, status: str, attempts: int) -> None:
+        with self._lock:
+            job = self._decision_jobs.get(job_id)
+            if job is not None:
+                job[5:10] = [state_json, done_steps, status, attempts, int(time.time())]
+
+    def list_unfinished_decision_jobs(self) -> list[db.DecisionJobRow]:
+        with self._lock:
+            return [
+                (job_id, j[0], j[1], j[2], j[3], j[4], j[5], j[6], j[8])
+                for job_id, j in sorted(self._decision_jobs.items())
+                if j[7] == "pending"
+            ]
+
+    def delete_finished_decision_jobs(self, finished_before: int, limit: int) -> int:
+        with self._lock:
+            old = [
+                job_id for job_id, j in self._decision_jobs.items()
+                if j[7] in ("done", "failed") and j[9] < finished_before
+            ][:limit]
+            for job_id in old:
+                del self._decision_jobs[job_id]
+            return len(old)
+
+    def log_backup(self, path: str, duration_ms: int, db_size_bytes: int, archive_size_bytes: int) -> None:
+        with self._lock:
+            self._backups.append((int(time.time()), path, duration_ms, db_size_bytes, archive_size_bytes))
+
+
+_BACKENDS: dict[str, type[Storage]] = {
+    SQLiteStorage.name: SQLiteStorage,
+    MemoryStorage.name: MemoryStorage,
+}
+
+
+def create_storage(name: str = STORAGE_BACKEND) -> Storage:
+    backend = _BACKENDS.get(name)
+    if backend is None:
+        raise RuntimeError(f"Неизвестный STORAGE_BACKEND={name!r}. Варианты: {', '.join(_BACKENDS)}")
+    return backend()
@@ -0,0 +1,62 @@
+# taskgraph.py
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, NamedTuple
+
+import metrics
+
+
+# ==========================================================
+#                  STEP GRAPH (asyncio)
+# ==========================================================
+# Набор шагов с зависимостями: каждый шаг — отдельная asyncio-задача, которая ждёт
+# только свои зависимости, так что независимые REST-запросы идут параллельно.
+# Шаги сами обрабатывают ожидаемые ошибки Discord; неожиданное исключение
+# пишется в лог, а зависимые шаги всё равно выполняются (как и при прежнем
+# последовательном коде, где один сбой не отменял остальное).
+# Время каждого шага — metrics <prefix>.<step>.*, итог — <prefix>.total.*
+
+
+class Step(NamedTuple):
+    name: str
+    run: Callable[[], Awaitable[Any]]
+    after: tuple[str, ...] = ()
+
+
+async def run_step_graph(steps: list[Step], prefix: str) -> dict[str, float]:
+    """Выполняет шаги с учётом after; возвращает {имя шага: мс} + "total"."""
+    tasks: dict[str, asyncio.Task] = {}
+    timings: dict[str, float] = {}
+
+    async def _run(step: Step) -> None:
+        if step.after:
+            await asyncio.gather(*(tasks[name] for name in step.after))
+        started = time.perf_counter()
+        try:
+            await step.run()
+        except Exception as e:
+            metrics.inc(f"{prefix}.{step.name}.errors")
+            print(f"[{prefix}] step {step.name} FAILED: {type(e).__name__}: {e}")
+        elapsed = time.perf_counter() - started
+        metrics.observe(f"{prefix}.{step.name}", elapsed)
+        timings[step.name] = elapsed * 1000
+
+    # граф проверяется целиком до создания задач: ошибка не оставит запущенных шагов
+    seen: set[str] = set()
+    for step in steps:
+        missing = [name for name in step.after if name not in seen]
+        if missing:
+            raise RuntimeError(f"шаг {step.name!r} зависит от неизвестных/более поздних шагов: {missing}")
+        if step.name in seen:
+            raise RuntimeError(f"шаг {step.name!r} объявлен дважды")
+        seen.add(step.name)
+
+    started = time.perf_counter()
+    for step in steps:
+        tasks[step.name] = asyncio.create_task(_run(step), name=f"{prefix}-{step.name}")
+    await asyncio.gather(*tasks.values())
+
+    elapsed = time.perf_counter() - started
+    metrics.observe(f"{prefix}.total", elapsed)
+    timings["total"] = elapsed * 1000
+    return timings
@@ -0,0 +1,7 @@
+# tests/conftest.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DISCORD_TOKEN", "test")
+os.environ.setdefault("SH_STORAGE_BACKEND", "memory")
@@ -0,0 +1,71 @@
+# tests/test_db_async.py
+import asyncio
+
+import pytest
+
+import db_async
+from storage import MemoryStorage
+
+
+class FlakyStorage(MemoryStorage):
+    """write_batch падает первые `failures` раз; удаления записываются в журнал."""
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+        self.log: list[tuple[str, int]] = []
+
+    def write_batch(self, tickets, prompts):
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError("disk I/O error")
+        self.log.extend(("upsert", row[0]) for row in tickets)
+        super().write_batch(tickets, prompts)
+
+    def delete_ticket(self, channel_id):
+        self.log.append(("delete", channel_id))
+        super().delete_ticket(channel_id)
+
+
+@pytest.fixture
+def flaky(monkeypatch):
+    def install(failures: int) -> FlakyStorage:
+        storage = FlakyStorage(failures)
+        monkeypatch.setattr(db_async, "_storage", storage)
+        monkeypatch.setattr(db_async, "_BATCH_RETRY_DELAYS", (0.0, 0.0))
+        return storage
+
+    yield install
+    asyncio.run(_drain())
+
+
+async def _drain() -> None:
+    # буфер модульный — не оставляем строки следующему тесту
+    with db_async._pending_lock:
+        db_async._take_pending()
+
+
+def test_delete_waits_for_retried_batch(flaky):
+    storage = flaky(failures=2)
+
+    async def scenario():
+        await db_async.db_set_opener(1, 10)
+        await db_async.db_delete_ticket(1)
+
+    asyncio.run(scenario())
+    assert storage.log == [("upsert", 1), ("delete", 1)]
+    assert storage.get_opener(1) is None
+
+
+def test_delete_not_run_when_batch_keeps_failing(flaky):
+    storage = flaky(failures=10)
+
+    async def scenario():
+        await db_async.db_set_opener(2, 20)
+        with pytest.raises(RuntimeError, match="disk I/O error"):
+            await db_async.db_delete_ticket(2)
+
+    asyncio.run(scenario())
+    # удаление не обогнало upsert: не выполнено вовсе, строка ждёт в буфере
+    assert ("delete", 2) not in storage.log
+    assert db_async._is_pending("tickets", 2)
@@ -1,101 +1,285 @@
 # tickets.py
 import re
+import time
 import discord
 
-from app import client
-from config import ARCHIVE_CATEGORY_ID, STAFF_PING_ROLE_IDS, IGNORED_TICKET_OPENER_IDS, IGNORED_TICKET_OPENER_ROLE_IDS
-from db import (
+from app import client, _last_prompt_time, _last_trigger_message
+from config import (
+    ARCHIVE_CATEGORY_ID,
+    PROMPT_COOLDOWN_SECONDS,
+    IGNORED_TICKET_OPENER_ROLE_IDS,
+    OPENER_VERDICT_TTL_SECONDS,
+)
+from db_async import (
     db_get_opener,
     db_set_opener,
     db_get_prompt,
     db_delete_prompt,
-    db_is_ignored_user,
+    db_cached_prompt,
+    is_ignored_opener_id,
 )
-from helpers import is_staff
+from helpers import is_staff, member_role_ids, guild_role_index
+from lookups import fetch_user_cached, fetch_member_cached, forget_member
+from rest import rest_call
+import metrics
 
 
-def is_ignored_ticket_opener_id(user_id: int) -> bool:
-    # статический список + динамический (из БД)
-    if user_id in IGNORED_TICKET_OPENER_IDS:
-        return True
-    return db_is_ignored_user(user_id)
+# ==========================================================
+#                  OPENER CLASSIFICATION
+# ==========================================================
+# Один классификатор для всех проверок "может ли участник быть opener".
+# Таблицы ролей — frozenset, посчитанные один раз из config.py.
+# Вердикт по ролям кэшируется на участника; кэш сбрасывается в on_member_update
+# (см. events.py) и, на случай если это событие не приходит (нет intents.members),
+# живёт не дольше OPENER_VERDICT_TTL_SECONDS.
+# Проверка по ID (ignored_users) не кэшируется: она и так O(1), а /add /del
+# должны действовать сразу.
+
+OPENER_OK = "ok"
+OPENER_BOT = "bot"
+OPENER_IGNORED_ID = "ignored_id"
+OPENER_STAFF = "staff"
+OPENER_IGNORED_ROLE = "ignored_role"
+
+_IGNORED_OPENER_ROLE_IDS: frozenset[int] = frozenset(IGNORED_TICKET_OPENER_ROLE_IDS)
+_VERDICT_CACHE_MAX = 5000
+
+# (guild_id, member_id) -> (expires_at monotonic, verdict)
+_opener_verdicts: dict[tuple[int, int], tuple[float, str]] = {}
+
+
+def _classify_opener_roles(member: discord.Member) -> str:
+    if member.bot:
+        return OPENER_BOT
+    if is_staff(member):
+        return OPENER_STAFF
+    role_ids = member_role_ids(member)
+    if not _IGNORED_OPENER_ROLE_IDS.isdisjoint(role_ids):
+        return OPENER_IGNORED_ROLE
+    return OPENER_OK
+
+
+def classify_opener(member: discord.Member) -> str:
+    """Вердикт для участника: OPENER_OK или причина, почему он не opener."""
+    if is_ignored_opener_id(member.id):
+        return OPENER_IGNORED_ID
+
+    key = (member.guild.id, member.id)
+    now = time.monotonic()
+    cached = _opener_verdicts.get(key)
+    if cached is not None and cached[0] > now:
+        metrics.inc("opener.verdict_cache.hits")
+        return cached[1]
+
+    metrics.inc("opener.verdict_cache.misses")
+    verdict = _classify_opener_roles(member)
+    if len(_opener_verdicts) >= _VERDICT_CACHE_MAX:
+        _opener_verdicts.clear()
+    _opener_verdicts[key] = (now + OPENER_VERDICT_TTL_SECONDS, verdict)
+    return verdict
+
+
+def forget_opener_verdict(member: discord.Member) -> None:
+    _opener_verdicts.pop((member.guild.id, member.id), None)
+
 
+def forget_guild_opener_verdicts(guild_id: int) -> None:
+    # роль стала/перестала быть staff — вердикты всех участников сервера устарели
+    for key in [k for k in _opener_verdicts if k[0] == guild_id]:
+        del _opener_verdicts[key]
+
+
+def is_ignored_ticket_opener_id(user_id: int) -> bool:
+    # статический список + динамический (ignored_users, держится в памяти)
+    return is_ignored_opener_id(user_id)
 
 
 def is_ignored_ticket_opener_member(member: discord.Member) -> bool:
     """True если участник не должен считаться opener (по ID или по роли)."""
-    if is_ignored_ticket_opener_member(member):
+    if is_ignored_ticket_opener_id(member.id):
         return True
-    # Роли
-    try:
-        role_ids = {r.id for r in member.roles}
-    except Exception:
-        role_ids = set()
-    return any(rid in IGNORED_TICKET_OPENER_ROLE_IDS for rid in role_ids)
+    return not _IGNORED_OPENER_ROLE_IDS.isdisjoint(member_role_ids(member))
 
 
 def _is_valid_opener_member(member: discord.Member) -> bool:
-    if member.bot:
-        return False
-    if is_staff(member):
-        return False
-    if is_ignored_ticket_opener_member(member):
+    return classify_opener(member) == OPENER_OK
+
+
+# -------------------- PROMPT COOLDOWN / DEDUP --------------------
+# Отправлять ли панель с кнопками в канал. Источник правды — таблица prompts
+# (prompt_message_id + created_at), её копия в памяти (db_async) переживает рестарт
+# и не требует чтения с диска. Поверх неё — отметки этого процесса в app.py
+# (_last_prompt_time / _last_trigger_message): слот занимается ДО отправки, пока
+# панель ещё не записана в prompts.
+#   cooldown — последняя панель моложе PROMPT_COOLDOWN_SECONDS;
+#   answered — на это сообщение-триггер уже ответили: это то же сообщение, или оно
+#              старше нашей панели (id в Discord растут со временем).
+
+
+def prompt_blocked(channel_id: int, trigger_message_id: int | None, now: float) -> str | None:
+    """Причина НЕ отправлять панель ("cooldown" / "answered") или None."""
+    prompt_id, prompt_at = db_cached_prompt(channel_id)
+    last = max(_last_prompt_time.get(channel_id, 0.0), prompt_at or 0)
+    if now - last < PROMPT_COOLDOWN_SECONDS:
+        return "cooldown"
+    if trigger_message_id is not None:
+        if _last_trigger_message.get(channel_id) == trigger_message_id:
+            return "answered"
+        if prompt_id is not None and trigger_message_id < prompt_id:
+            return "answered"
+    return None
+
+
+def claim_prompt(channel_id: int, trigger_message_id: int) -> bool:
+    """Проверяет и занимает слот без await между проверкой и записью."""
+    now = time.time()
+    reason = prompt_blocked(channel_id, trigger_message_id, now)
+    if reason is not None:
+        metrics.inc(f"prompts.blocked.{reason}")
         return False
+    _last_prompt_time[channel_id] = now
+    _last_trigger_message[channel_id] = trigger_message_id
     return True
 
 
-async def resolve_ticket_opener_fallback(channel: discord.TextChannel) -> discord.abc.User | None:
-    # 1) topic
-    if channel.topic:
-        m = re.search(r"<@!?(\d{15,25})>", channel.topic)
-        if m:
-            uid = int(m.group(1))
-            if not is_ignored_ticket_opener_id(uid):
-                member = channel.guild.get_member(uid)
-                if isinstance(member, discord.Member) and _is_valid_opener_member(member):
-                    return member
-                try:
-                    u = await client.fetch_user(uid)
-                    return u
-                except discord.HTTPException:
-                    pass
-
-        m = re.search(r"\b(\d{15,25})\b", channel.topic)
+# -------------------- OPENER TRACKING --------------------
+# Opener определяется по мере прихода событий и сразу пишется в БД:
+#   - on_guild_channel_create: overwrites канала (Ticket Tool открывает канал игроку;
+#     без intents.members цель — discord.Object, участника догружаем fetch_member_cached)
+#     и topic (там часто лежит <@id>);
+#   - on_guild_channel_update: появился/сменился topic или overwrites;
+#   - on_message: первый подходящий автор (events.py, этап "opener").
+# Тогда к моменту нажатия кнопки opener уже в БД/кэше, а resolve_ticket_opener_fallback
+# с REST-запросами (fetch_user, история канала) нужен только в редких случаях.
+# Метрики: opener.source.<overwrites|topic|history>, opener.history_scan.*
+
+_TOPIC_MENTION_RE = re.compile(r"<@!?(\d{15,25})>")
+_TOPIC_ID_RE = re.compile(r"\b(\d{15,25})\b")
+_HISTORY_SCAN_LIMIT = 200
+
+
+def opener_id_from_topic(topic: str | None) -> int | None:
+    """Первый не игнорируемый ID из topic: сначала упоминание, потом "голый" ID."""
+    if not topic:
+        return None
+    for rx in (_TOPIC_MENTION_RE, _TOPIC_ID_RE):
+        m = rx.search(topic)
         if m:
             uid = int(m.group(1))
             if not is_ignored_ticket_opener_id(uid):
-                member = channel.guild.get_member(uid)
-                if isinstance(member, discord.Member) and _is_valid_opener_member(member):
-                    return member
-                try:
-                    u = await client.fetch_user(uid)
-                    return u
-                except discord.HTTPException:
-                    pass
+                return uid
+    return None
 
-    # 2) overwrites
+
+async def opener_from_overwrites(channel: discord.TextChannel) -> discord.Member | None:
+    """Участник с персональным view_channel=True в overwrites канала.
+
+    Без intents.members участника обычно нет в кэше, и discord.py отдаёт цель как
+    discord.Object(type=User) — такой ID проверяем на игнор и догружаем через
+    fetch_member_cached, чтобы проверить роли/staff.
+    """
     for target, ow in channel.overwrites.items():
-        if isinstance(target, discord.Member) and ow.view_channel is True:
+        if ow.view_channel is not True:
+            continue
+        if isinstance(target, discord.Member):
             if _is_valid_opener_member(target):
                 return target
+            continue
+        if not isinstance(target, discord.Object) or target.type is discord.Role:
+            continue
+        if is_ignored_ticket_opener_id(target.id) or (client.user and target.id == client.user.id):
+            continue
+        try:
+            member = await fetch_member_cached(channel.guild, target.id)
+        except discord.HTTPException:
+            continue
+        if member is not None and _is_valid_opener_member(member):
+            return member
+    return None
+
+
+def _opener_from_topic_member(channel: discord.TextChannel) -> tuple[int | None, discord.Member | None]:
+    uid = opener_id_from_topic(channel.topic)
+    if uid is None:
+        return None, None
+    member = channel.guild.get_member(uid)
+    if isinstance(member, discord.Member) and _is_valid_opener_member(member):
+        return uid, member
+    return uid, None
+
+
+async def track_opener_from_channel(channel: discord.TextChannel) -> int | None:
+    """Определяет opener по overwrites/topic (без истории канала) и сразу сохраняет его."""
+    if await db_get_opener(channel.id) is not None:
+        return None
+
+    member = await opener_from_overwrites(channel)
+    if member is not None:
+        source, opener_id = "overwrites", member.id
+    else:
+        opener_id, member = _opener_from_topic_member(channel)
+        if opener_id is None:
+            return None
+        source = "topic"
+        # участник не в кэше — принимаем ID как есть (как и fetch_user в фоллбеке),
+        # но если он в кэше и это staff/ignored-роль — такой ID не годится
+        if member is None and channel.guild.get_member(opener_id) is not None:
+            return None
+
+    await db_set_opener(channel.id, opener_id)
+    metrics.inc(f"opener.source.{source}")
+    return opener_id
+
 
-    # 3) history
+async def resolve_ticket_opener_fallback(channel: discord.TextChannel) -> discord.abc.User | None:
+    # 1) topic (без REST, если участник в кэше)
+    uid, member = _opener_from_topic_member(channel)
+    if member is not None:
+        metrics.inc("opener.source.topic")
+        return member
+
+    # 2) overwrites
+    member = await opener_from_overwrites(channel)
+    if member is not None:
+        metrics.inc("opener.source.overwrites")
+        return member
+
+    if uid is not None and channel.guild.get_member(uid) is None:
+        try:
+            u = await fetch_user_cached(uid)
+            if u is not None:
+                metrics.inc("opener.source.topic")
+                return u
+        except discord.HTTPException:
+            pass
+
+    # 3) history — последний вариант: до нескольких REST-страниц истории канала
+    started = time.perf_counter()
+    found: discord.abc.User | None = None
     try:
-        async for m in channel.history(limit=200, oldest_first=True):
+        async for m in channel.history(limit=_HISTORY_SCAN_LIMIT, oldest_first=True):
             if isinstance(m.author, discord.Member) and _is_valid_opener_member(m.author):
-                return m.author
+                found = m.author
+                break
             # если author не Member (например, в некоторых случаях), проверим по id
             if m.author and not getattr(m.author, "bot", False):
                 if not is_ignored_ticket_opener_id(m.author.id):
-                    return m.author
+                    found = m.author
+                    break
     except discord.HTTPException:
         pass
-
-    return None
+    metrics.observe("opener.history_scan", time.perf_counter() - started)
+    if found is not None:
+        metrics.inc("opener.source.history")
+    print(
+        f"[Opener] history scan channel={channel.id} found={found.id if found else None} "
+        f"in {(time.perf_counter() - started) * 1000:.0f} ms"
+    )
+    return found
 
 
 async def get_opener_user(channel: discord.TextChannel) -> discord.abc.User | None:
-    opener_id = db_get_opener(channel.id)
+    opener_id = await db_get_opener(channel.id)
     if opener_id:
         # если в БД лежит "игнорируемый" ID — пробуем определить заново
         if is_ignored_ticket_opener_id(opener_id):
@@ -105,13 +289,16 @@ async def get_opener_user(channel: discord.TextChannel) -> discord.abc.User | No
             if member and isinstance(member, discord.Member) and _is_valid_opener_member(member):
                 return member
             try:
-                return await client.fetch_user(opener_id)
+                user = await fetch_user_cached(opener_id)
+                if user is not None:
+                    return user
             except discord.HTTPException:
-                opener_id = None
+                pass
+            opener_id = None
 
     opener = await resolve_ticket_opener_fallback(channel)
     if opener:
-        db_set_opener(channel.id, opener.id)
+        await db_set_opener(channel.id, opener.id)
     return opener
 
 
@@ -121,12 +308,9 @@ async def ensure_guild_member(guild: discord.Guild, user_id: int) -> discord.Mem
     1) пробуем из кеша
     2) если нет — делаем REST fetch (работает даже без intents.members)
     """
-    m = guild.get_member(user_id)
-    if m:
-        return m
     try:
-        return await guild.fetch_member(user_id)
-    except (discord.NotFound, discord.Forbidden, discord.HTTPException):
+        return await fetch_member_cached(guild, user_id)
+    except (discord.Forbidden, discord.HTTPException):
         return None
 
 
@@ -154,9 +338,16 @@ async def apply_accept_roles(
 
     try:
         if rem_role and rem_role in member.roles:
-            await member.remove_roles(rem_role, reason="[SH] Ticket accepted: remove role")
+            await rest_call(
+                "member.remove_roles",
+                lambda: member.remove_roles(rem_role, reason="[SH] Ticket accepted: remove role"),
+            )
         if add_role and add_role not in member.roles:
-            await member.add_roles(add_role, reason="[SH] Ticket accepted: add role")
+            await rest_call(
+                "member.add_roles",
+                lambda: member.add_roles(add_role, reason="[SH] Ticket accepted: add role"),
+            )
+        forget_member(guild.id, member.id)
         return True, "ok"
     except discord.Forbidden:
         # Обычно: у бота нет Manage Roles или роль выше роли бота
@@ -171,30 +362,33 @@ async def disable_or_delete_prompt_message(channel: discord.TextChannel) -> None
     - пытаемся удалить сообщение с кнопками
     - если не получилось: снимаем кнопки (view=None) и меняем текст на "Закрыто."
     """
-    msg_id = db_get_prompt(channel.id)
+    msg_id = await db_get_prompt(channel.id)
     if not msg_id:
         return
 
     try:
-        msg = await channel.fetch_message(msg_id)
+        msg = await rest_call("message.fetch", lambda: channel.fetch_message(msg_id))
     except discord.NotFound:
-        db_delete_prompt(channel.id)
+        await db_delete_prompt(channel.id)
         return
     except discord.HTTPException:
         return
 
     # delete
     try:
-        await msg.delete()
-        db_delete_prompt(channel.id)
+        await rest_call("message.delete", msg.delete)
+        await db_delete_prompt(channel.id)
         return
     except (discord.Forbidden, discord.HTTPException):
         pass
 
     # disable buttons
     try:
-        await msg.edit(content="**Закрыто.**", view=None, allowed_mentions=discord.AllowedMentions.none())
-        db_delete_prompt(channel.id)
+        await rest_call(
+            "message.edit",
+            lambda: msg.edit(content="**Закрыто.**", view=None, allowed_mentions=discord.AllowedMentions.none()),
+        )
+        await db_delete_prompt(channel.id)
     except discord.HTTPException:
         pass
 
@@ -226,14 +420,12 @@ async def archive_and_lock_channel(
             overwrites[opener_member] = discord.PermissionOverwrite(view_channel=False)
 
     # открыть модерам
-    for rid in STAFF_PING_ROLE_IDS:
-        role = guild.get_role(rid)
-        if role:
-            overwrites[role] = discord.PermissionOverwrite(
-                view_channel=True,
-                send_messages=True,
-                read_message_history=True,
-            )
+    for role in guild_role_index(guild).ping_roles:
+        overwrites[role] = discord.PermissionOverwrite(
+            view_channel=True,
+            send_messages=True,
+            read_message_history=True,
+        )
 
     # открыть боту
     me = guild.get_member(client.user.id) if client.user else None
@@ -245,8 +437,11 @@ async def archive_and_lock_channel(
             manage_channels=True,
         )
 
-    await channel.edit(
-        category=archive_category,
-        overwrites=overwrites,
-        reason=f"Archived by {moderator} ({moderator.id}). Reason: {reason_text[:200]}",
+    await rest_call(
+        "channel.edit",
+        lambda: channel.edit(
+            category=archive_category,
+            overwrites=overwrites,
+            reason=f"Archived by {moderator} ({moderator.id}). Reason: {reason_text[:200]}",
+        ),
     )
@@ -1,24 +1,9 @@
 # ui.py
-import asyncio
 import discord
 
-from app import _get_channel_lock, _last_prompt_time, _channel_locks
-from config import (
-    INVITE_LINK,  # остаётся для отказа (если хотите убрать — скажи)
-    ACCEPT_EXTRA_DM,
-    ACCEPT_ADD_ROLE_ID,
-    ACCEPT_REMOVE_ROLE_ID,
-)
-from db import db_delete_ticket, db_delete_prompt
+from decisions import create_decision_job, enqueue_decision_job
 from helpers import is_staff
-from logs import log_event, send_application_log
-from privatka import create_one_time_private_invite
-from tickets import (
-    get_opener_user,
-    apply_accept_roles,
-    disable_or_delete_prompt_message,
-    archive_and_lock_channel,
-)
+from rest import rest_call, interaction_call, PRIORITY_INTERACTIVE
 
 
 # ==========================================================
@@ -42,157 +27,44 @@ class DecisionReasonModal(discord.ui.Modal):
 
     async def on_submit(self, interaction: discord.Interaction) -> None:
         if not interaction.guild or not isinstance(interaction.channel, discord.TextChannel):
-            return await interaction.response.send_message("Ошибка: не удалось определить канал.", ephemeral=True)
+            return await interaction_call(
+                "interaction.send_message",
+                lambda: interaction.response.send_message("Ошибка: не удалось определить канал.", ephemeral=True),
+            )
 
         moderator = interaction.user
         if not isinstance(moderator, discord.Member) or not is_staff(moderator):
-            return await interaction.response.send_message("Недостаточно прав.", ephemeral=True)
-
-        channel = interaction.channel
-        lock = _get_channel_lock(channel.id)
-
-        # если кто-то уже обрабатывает — не даём повторно
-        if lock.locked():
-            return await interaction.response.send_message(
-                "Тикет уже обрабатывается другим модератором.",
-                ephemeral=True,
-            )
-
-        async with lock:
-            opener = await get_opener_user(channel)
-
-            await interaction.response.send_message(
-                "**Причина принята.** *Уведомляю пользователя, обновляю роли (если принят) и удаляю тикет…*",
-                ephemeral=True,
+            return await interaction_call(
+                "interaction.send_message",
+                lambda: interaction.response.send_message("Недостаточно прав.", ephemeral=True),
             )
 
-            # ------------------------------------------------------
-            # Инвайт в приватку (только при принятии)
-            # ------------------------------------------------------
-            invite_url: str | None = None
-            invite_ok = False
-            if self.decision == "accept" and opener is not None:
-                invite = await create_one_time_private_invite(opener=opener, moderator=moderator)
-                if invite:
-                    invite_url = invite.url
-                    invite_ok = True
-
-            # ------------------------------------------------------
-            # DM пользователю
-            # ------------------------------------------------------
-            dm_ok = True
-            extra_dm_ok = True
-            if opener is None:
-                dm_ok = False
-                extra_dm_ok = False
-            else:
-                if self.decision == "reject":
-                    dm_text = (
-                        f"**Приветствую {opener.mention} ! Сожалеем, но ваша заявка в клан SH была отклонена модератором.**\n"
-                        f"**Причина:** *{self.reason.value}*\n\n"
-                        f"**Если хотите, то обязательно подавайте заявку повторно, мы вас обязательно ждем!**\n"
-                        f"**permanent link:** {INVITE_LINK}"
-                    )
-                else:
-                    invite_line = (
-                        f"**Персональная ссылка в приватку (1 раз, действует 24 часа):** {invite_url}"
-                        if invite_url
-                        else "**Ссылка в приватку:** *(не удалось создать автоматически — напишите модератору)*"
-                    )
-                    dm_text = (
-                        f"**Приветствую {opener.mention} ! Отличные новости — ваша заявка в клан SH была одобрена модератором.**\n"
-                        f"**Комментарий:** *{self.reason.value}*\n\n"
-                        f"{invite_line}"
-                    )
-
-                try:
-                    await opener.send(dm_text, allowed_mentions=discord.AllowedMentions(users=True))
-                except (discord.Forbidden, discord.HTTPException):
-                    dm_ok = False
-
-                # Дополнительное сообщение при принятии
-                if self.decision == "accept":
-                    try:
-                        await opener.send(ACCEPT_EXTRA_DM, allowed_mentions=discord.AllowedMentions.none())
-                    except (discord.Forbidden, discord.HTTPException):
-                        extra_dm_ok = False
-
-            # ------------------------------------------------------
-            # Роли — только при принятии
-            # ------------------------------------------------------
-            roles_status = "SKIP"
-            if self.decision == "accept" and opener is not None:
-                ok, code = await apply_accept_roles(
-                    interaction.guild,
-                    opener.id,
-                    add_role_id=ACCEPT_ADD_ROLE_ID,
-                    remove_role_id=ACCEPT_REMOVE_ROLE_ID,
-                )
-                roles_status = "OK" if ok else f"FAIL:{code}"
-
-            # Убираем сообщение с кнопками (на случай если удаление канала не получится)
-            await disable_or_delete_prompt_message(channel)
-
-            player_text = f"{opener} ({opener.id})" if opener else "не найден"
-            dm_status = "OK" if dm_ok else "FAIL"
-            extra_dm_status = "OK" if extra_dm_ok else "FAIL"
-            invite_status = "OK" if invite_ok else "FAIL"
-
-            # Логи по шаблону (до удаления канала)
-            await send_application_log(
-                interaction.guild,
-                decision=self.decision,
-                opener=opener,
-                moderator=moderator,
-                reason_text=self.reason.value,
-                dm_sent=dm_ok,
-            )
-
-            # чистим БД + in-memory кэш
-            db_delete_ticket(channel.id)
-            db_delete_prompt(channel.id)
-            _last_prompt_time.pop(channel.id, None)
+        channel = interaction.channel
+        # сначала подтверждаем interaction (3 секунды на ответ), и только потом пишем
+        # задачу в БД: очередь писателя может быть занята пачкой upsert-ов или очисткой
+        await interaction_call(
+            "interaction.defer",
+            lambda: interaction.response.defer(ephemeral=True, thinking=True),
+        )
 
-            # Сообщение модератору (ephemeral) перед удалением канала
-            decision_ru = "принято ✅" if self.decision == "accept" else "отклонено ❌"
-            summary = (
-                f"Готово: **{decision_ru}**\n"
-                f"Игрок: **{player_text}**\n"
-                f"DM: **{dm_status}**"
+        # решение пишется в decision_jobs; уникальный индекс по каналу не даёт
+        # второму модератору запустить обработку того же тикета
+        job = await create_decision_job(interaction, channel, moderator, self.decision, self.reason.value)
+        if job is None:
+            text = "Тикет уже обрабатывается другим модератором."
+        else:
+            text = "**Причина принята.** *Уведомляю пользователя, обновляю роли (если принят) и удаляю тикет…*"
+        try:
+            await rest_call(
+                "interaction.followup",
+                lambda: interaction.followup.send(text, ephemeral=True),
+                priority=PRIORITY_INTERACTIVE,
+                idempotent=False,
             )
-            if self.decision == "accept":
-                summary += (
-                    f"\nИнвайт в приватку: **{invite_status}**"
-                    f"\nДоп. DM: **{extra_dm_status}**\nРоли: **{roles_status}**"
-                )
-                if invite_url:
-                    summary += f"\nСсылка (для тебя): {invite_url}"
-
-            try:
-                await interaction.followup.send(summary, ephemeral=True)
-            except discord.HTTPException:
-                pass
-
-            # Удаляем тикет-канал
-            try:
-                await channel.delete(
-                    reason=(
-                        f"[SH] decision={self.decision} by {moderator} ({moderator.id}). "
-                        f"Player: {player_text}. Text: {self.reason.value[:200]}"
-                    )
-                )
-            except (discord.Forbidden, discord.HTTPException) as e:
-                # Если удалить не получилось — как запасной план переносим в архив и закрываем права
-                try:
-                    await archive_and_lock_channel(channel, opener, moderator, self.reason.value)
-                except Exception:
-                    pass
-                await log_event(
-                    interaction.guild,
-                    f"[SH] WARNING: failed to delete channel={channel.id}. error={type(e).__name__}: {e}"
-                )
-
-            _channel_locks.pop(channel.id, None)
+        except discord.HTTPException:
+            pass
+        if job is not None:
+            enqueue_decision_job(job)
 
 
 class TicketDecisionView(discord.ui.View):
@@ -207,8 +79,14 @@ class TicketDecisionView(discord.ui.View):
     async def accept_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
         moderator = interaction.user
         if not isinstance(moderator, discord.Member) or not is_staff(moderator):
-            return await interaction.response.send_message("Недостаточно прав.", ephemeral=True)
-        await interaction.response.send_modal(DecisionReasonModal("accept"))
+            return await interaction_call(
+                "interaction.send_message",
+                lambda: interaction.response.send_message("Недостаточно прав.", ephemeral=True),
+            )
+        await interaction_call(
+            "interaction.send_modal",
+            lambda: interaction.response.send_modal(DecisionReasonModal("accept")),
+        )
 
     @discord.ui.button(
         label="Отклонить с причиной",
@@ -218,5 +96,11 @@ class TicketDecisionView(discord.ui.View):
     async def reject_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
         moderator = interaction.user
         if not isinstance(moderator, discord.Member) or not is_staff(moderator):
-            return await interaction.response.send_message("Недостаточно прав.", ephemeral=True)
-        await interaction.response.send_modal(DecisionReasonModal("reject"))
+            return await interaction_call(
+                "interaction.send_message",
+                lambda: interaction.response.send_message("Недостаточно прав.", ephemeral=True),
+            )
+        await interaction_call(
+            "interaction.send_modal",
+            lambda: interaction.response.send_modal(DecisionReasonModal("reject")),
+        )